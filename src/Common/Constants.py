@@ -7,7 +7,7 @@ import wx
 #import wx.lib.agw.flatnotebook as FNB
 import External.wxPython.flatnotebook_fix as FNB
 
-CUR_VER = '0.8.11'
+CUR_VER = '0.8.12'
 
 #Variables to configure GUI
 FNB_STYLE = FNB.FNB_DEFAULT_STYLE|FNB.FNB_HIDE_ON_SINGLE_TAB|FNB.FNB_NO_X_BUTTON|FNB.FNB_FF2
@@ -73,6 +73,54 @@ if not os.path.exists(LOG_PATH):
 #Menu Options
 # removed to use built in id generator wx.ID_ANY
 
+#Database Variables
+#number of prepared statements each workspace connection keeps compiled
+DB_STATEMENT_CACHE_SIZE = 256
+#seconds a connection waits on a locked database before failing
+DB_BUSY_TIMEOUT = 60
+#seconds the writer must be idle before it checkpoints the write-ahead-log
+DB_CHECKPOINT_INTERVAL = 5
+#documents whose tokens are moved together when upgrading an older workspace database
+DB_UPGRADE_DOCUMENTS_PER_BATCH = 10000
+#documents times string fields being tokenized at which string_tokens' indexes are rebuilt after inserting instead of maintained during it
+DB_BULK_LOAD_MIN_DOCUMENTS = 50000
+#rows of each index sampled when the query planner's statistics are refreshed
+DB_ANALYSIS_LIMIT = 1000
+#documents whose tokens are read from the database at a time when capturing tokens for a model
+DB_DOCUMENTS_TOKENS_BATCH = 1000
+#values bound to a single statement's IN list, sqlite builds before 3.32 allow at most 999 variables per statement
+DB_MAX_VARIABLES = 999
+#recalculate the maintained token counts from the token tables whenever they are read and log any that differ
+DB_VERIFY_COUNTS = False
+#log every database statement's time, rows and query plan to DB_PROFILE_LOG_FILE in LOG_PATH to find statements that scan whole tables
+DB_PROFILE = False
+DB_PROFILE_LOG_FILE = "DatabaseProfile.log"
+#seconds between idle maintenance of the workspace database and number of free pages each incremental vacuum step returns
+DB_MAINTENANCE_INTERVAL = 600
+DB_MAINTENANCE_VACUUM_PAGES = 1000
+#where new workspaces keep the string tokens of their datasets,
+#'sqlite' keeps them in the workspace database and 'columnar' keeps them in memory-mapped integer columns next to it
+DB_TOKEN_STORE = 'sqlite'
+
+#Multiprocessing Variables
+#languages whose tokenization pipelines every process of the pool loads when it starts, other languages are loaded the first time a process uses them
+TOKENIZATION_PRELOAD_LANGUAGES = ['eng-sm']
+#spacy components that are not loaded for tokenization, only text, lemma_, pos_ and is_stop are used so the dependency parser and entity recognizer are not needed
+TOKENIZATION_EXCLUDED_COMPONENTS = ['parser', 'ner', 'senter']
+#texts spacy processes together in each batch when tokenizing
+TOKENIZATION_BATCH_SIZE = 256
+#chunks of similar character counts each field is split into per process of the pool, more chunks keep every process busy until the end of a field
+TOKENIZATION_CHUNKS_PER_PROCESS = 4
+#finished chunks that can wait to be stored in the database, beyond one being tokenized per process of the pool, before no more chunks are handed to the pool
+TOKENIZATION_RESULTS_QUEUE_SIZE = 8
+#keep the tokens of every text tokenized in a cache shared by all workspaces so identical text is not tokenized again
+TOKENIZATION_CACHE = True
+TOKENIZATION_CACHE_PATH = os.path.realpath(os.path.join(APP_DATA_PATH, 'TokenizationCache.db'))
+#size in bytes the cache can grow to before the least recently used texts are evicted
+TOKENIZATION_CACHE_MAX_BYTES = 1024*1024*1024
+#surface forms whose normalized text and stem each process of the pool remembers
+TOKENIZATION_MEMO_SIZE = 100000
+
 #Module Specific Variables
 ##Filtering
 TOKEN_TEXT_IDX = 0
@@ -102,6 +150,10 @@ FILTER_TFIDF_REMOVE = 'remove tokens where their tfidf is '
 FILTER_TFIDF_INCLUDE = 'include tokens where their tfidf is '
 FILTER_TFIDF_LOWER = ' in the lower '
 FILTER_TFIDF_UPPER = ' in the upper  '
+#rows of the included/removed word lists fetched from the database at a time
+TOKEN_LIST_PAGE_SIZE = 500
+#pages of each word list kept in memory
+TOKEN_LIST_CACHED_PAGES = 20
 ###Token Filters
 AVAILABLE_DATASET_LANGUAGES1 = ['eng-sm', 'fre-sm'] #removed eng-trf and fre-trf due to difficulties with preparing installations -- Sept 21, 2021
 AVAILABLE_DATASET_LANGUAGES2 = ['English', 'French']
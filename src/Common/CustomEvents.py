@@ -75,6 +75,18 @@ class SaveResultEvent(wx.PyEvent):
         self.SetEventType(SAVE_EVT_RESULT_ID)
         self.data = data
 
+MAINTENANCE_EVT_RESULT_ID = wx.NewIdRef()
+def MAINTENANCE_EVT_RESULT(win, func):
+    """Define Result Event."""
+    win.Connect(-1, -1, MAINTENANCE_EVT_RESULT_ID, func)
+class MaintenanceResultEvent(wx.PyEvent):
+    """Simple event to carry arbitrary result data."""
+    def __init__(self, data):
+        """Init Result Event."""
+        wx.PyEvent.__init__(self)
+        self.SetEventType(MAINTENANCE_EVT_RESULT_ID)
+        self.data = data
+
 RETRIEVE_EVT_RESULT_ID = wx.NewIdRef()
 def RETRIEVE_EVT_RESULT(win, func):
     """Define Result Event."""
@@ -111,6 +123,18 @@ class ApplyFilterRulesResultEvent(wx.PyEvent):
         self.SetEventType(APPLY_FILTER_RULES_EVT_RESULT_ID)
         self.data = data
 
+PREVIEW_FILTER_RULES_EVT_RESULT_ID = wx.NewIdRef()
+def PREVIEW_FILTER_RULES_EVT_RESULT(win, func):
+    """Define Result Event."""
+    win.Connect(-1, -1, PREVIEW_FILTER_RULES_EVT_RESULT_ID, func)
+class PreviewFilterRulesResultEvent(wx.PyEvent):
+    """Simple event to carry arbitrary result data."""
+    def __init__(self, data):
+        """Init Result Event."""
+        wx.PyEvent.__init__(self)
+        self.SetEventType(PREVIEW_FILTER_RULES_EVT_RESULT_ID)
+        self.data = data
+
 CREATE_WORD_DATAFRAME_EVT_RESULT_ID = wx.NewIdRef()
 def CREATE_WORD_DATAFRAME_EVT_RESULT(win, func):
     """Define Result Event."""
@@ -3,38 +3,429 @@ import sqlite3
 import math
 import os.path
 import ast
+import threading
+import queue
+import functools
+import itertools
+import json
+import sys
+import time
+from concurrent.futures import Future
 from datetime import datetime, timedelta
 
+import numpy as np
 import wx
 
 from Common.GUIText import Filtering as GUITextFiltering
 import Common.Constants as Constants
 import Common.CustomEvents as CustomEvents
+import Common.TokenStore as TokenStore
+
+#one manager per workspace database so that connections are reused between calls
+connection_managers = {}
+connection_managers_lock = threading.Lock()
+
+def GetConnectionManager(current_workspace_path):
+    with connection_managers_lock:
+        if current_workspace_path not in connection_managers:
+            connection_managers[current_workspace_path] = ConnectionManager(current_workspace_path)
+        return connection_managers[current_workspace_path]
+
+def CloseWorkspace(current_workspace_path):
+    '''closes all connections to a workspace's database, must be called before the workspace's directory is removed'''
+    with connection_managers_lock:
+        manager = connection_managers.pop(current_workspace_path, None)
+    if manager is not None:
+        manager.CloseAll()
+
+def WriteOperation(func):
+    '''runs the decorated DatabaseConnection method on the workspace's writer thread'''
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        return self.manager.RunWriteOperation(func, self, *args, **kwargs)
+    return wrapper
+
+def TokenTypeVocabulary(token_type):
+    '''returns the string_tokens column and the vocabulary table that hold a token type's interned strings'''
+    if token_type == 'stem':
+        return 'stem_id', 'stem_vocabulary'
+    elif token_type == 'lemma':
+        return 'lemma_id', 'lemma_vocabulary'
+    else:
+        return 'text_id', 'text_vocabulary'
+
+#inclusion and the included/removed aggregates are maintained for every token type so that switching between them only changes which ones are read
+TOKEN_TYPES = ['text', 'stem', 'lemma']
+
+def TokenTypeInclusion(token_type):
+    '''returns the token_groups columns that hold a token type's included value and its refresh flags for the included and removed aggregates'''
+    if token_type not in TOKEN_TYPES:
+        token_type = 'text'
+    return token_type+'_included', token_type+'_refresh_included', token_type+'_refresh_removed'
+
+def TokenGroupsRefreshSql():
+    '''returns the assignments that flag a token group's aggregates of every token type for refreshing'''
+    assignments = []
+    for token_type in TOKEN_TYPES:
+        included_column, refresh_included_column, refresh_removed_column = TokenTypeInclusion(token_type)
+        assignments.append(refresh_included_column+" = 1")
+        assignments.append(refresh_removed_column+" = 1")
+    return ", ".join(assignments)
+
+def StringTokensTable(dataset_id):
+    '''returns the name of the table that holds a dataset's string tokens'''
+    return 'string_tokens_'+str(int(dataset_id))
+
+def EncodePostingList(document_ids):
+    '''returns document ids as a blob of sorted deltas, the first byte is the number of bytes used by each delta'''
+    document_ids = np.unique(np.asarray(document_ids, dtype=np.int64))
+    deltas = np.diff(document_ids, prepend=0)
+    max_delta = deltas.max() if len(deltas) > 0 else 0
+    if max_delta < 2**8:
+        width = 1
+    elif max_delta < 2**16:
+        width = 2
+    elif max_delta < 2**32:
+        width = 4
+    else:
+        width = 8
+    return bytes([width]) + deltas.astype('<u'+str(width)).tobytes()
+
+def DecodePostingList(posting_list):
+    '''returns the sorted document ids stored in a posting list blob as a numpy array'''
+    if not posting_list:
+        return np.zeros(0, dtype=np.int64)
+    deltas = np.frombuffer(posting_list, dtype='<u'+str(posting_list[0]), offset=1)
+    return np.cumsum(deltas, dtype=np.int64)
+
+def EncodeDocumentKey(document_key):
+    '''returns a document key as json so that it can be read back without evaluating it'''
+    return json.dumps(document_key)
+
+def DecodeDocumentKey(encoded_document_key):
+    '''returns the document key stored by EncodeDocumentKey, json arrays are turned back into tuples'''
+    def ListsToTuples(value):
+        if isinstance(value, list):
+            return tuple(ListsToTuples(entry) for entry in value)
+        return value
+    return ListsToTuples(json.loads(encoded_document_key))
+
+class PostingListAggregate():
+    '''sqlite aggregate posting_list(document_id) that collects a group's document ids into a posting list blob'''
+    def __init__(self):
+        self.document_ids = []
+
+    def step(self, document_id):
+        self.document_ids.append(document_id)
+
+    def finalize(self):
+        return EncodePostingList(self.document_ids)
+
+class ProfilingCursor(sqlite3.Cursor):
+    '''cursor used while Constants.DB_PROFILE is set, every statement it runs is timed and logged with its query plan
+    as a line of json to the Common.Database.Profile logger'''
+    def execute(self, sql, parameters=()):
+        return self._Profile(sqlite3.Cursor.execute, sql, parameters, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        #the plan is the same for every set of parameters so it is only explained for the first one
+        seq_of_parameters = list(seq_of_parameters)
+        explain_parameters = seq_of_parameters[0] if len(seq_of_parameters) > 0 else ()
+        return self._Profile(sqlite3.Cursor.executemany, sql, seq_of_parameters, explain_parameters)
+
+    def _Profile(self, execute, sql, parameters, explain_parameters):
+        record = self.connection.ProfileContext()
+        record['sql'] = " ".join(sql.split())
+        record['plan'] = []
+        if record['sql'].split(" ", 1)[0].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE'):
+            try:
+                explain_cursor = sqlite3.Cursor(self.connection)
+                explain_cursor.execute("EXPLAIN QUERY PLAN "+sql, explain_parameters)
+                record['plan'] = [row[3] for row in explain_cursor.fetchall()]
+                explain_cursor.close()
+            except sqlite3.Error as e:
+                record['plan_error'] = str(e)
+        #tables read from start to end without an index and sorts that could not use an index are what make statements slow on large workspaces
+        record['full_scans'] = [detail[5:] for detail in record['plan']
+                                if detail.startswith("SCAN ") and " USING " not in detail and detail != "SCAN CONSTANT ROW"]
+        record['temp_sorts'] = [detail for detail in record['plan'] if detail.startswith("USE TEMP B-TREE")]
+        start_time = time.perf_counter()
+        try:
+            return execute(self, sql, parameters)
+        finally:
+            record['seconds'] = round(time.perf_counter() - start_time, 6)
+            record['rows'] = self.rowcount
+            profile_logger = logging.getLogger(__name__+".Profile")
+            if len(record['full_scans']) > 0 or len(record['temp_sorts']) > 0:
+                profile_logger.warning(json.dumps(record, default=str))
+            else:
+                profile_logger.info(json.dumps(record, default=str))
+
+class ProfilingConnection(sqlite3.Connection):
+    '''connection used while Constants.DB_PROFILE is set, its statements are run by a ProfilingCursor'''
+    def __init__(self, *args, **kwargs):
+        sqlite3.Connection.__init__(self, *args, **kwargs)
+        self.dataset_sizes = {}
+
+    def cursor(self, factory=ProfilingCursor):
+        return sqlite3.Connection.cursor(self, factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def ProfileContext(self):
+        #the statement is attributed to the public DatabaseConnection method that is running it and the dataset that method was given
+        context = {'time': datetime.now().isoformat(), 'method': None}
+        frame = sys._getframe(2)
+        while frame is not None:
+            if isinstance(frame.f_locals.get('self'), DatabaseConnection) and not frame.f_code.co_name.startswith("_"):
+                context['method'] = frame.f_code.co_name
+                if 'dataset_key' in frame.f_locals:
+                    context['dataset_key'] = str(frame.f_locals['dataset_key'])
+                    context.update(self.DatasetSize(context['dataset_key'], id(frame)))
+                break
+            frame = frame.f_back
+        return context
+
+    def DatasetSize(self, dataset_key, method_id):
+        #sizes are looked up once per method call, the number of tokens is estimated from the largest token id so no table is counted
+        if dataset_key not in self.dataset_sizes or self.dataset_sizes[dataset_key][0] != method_id:
+            size = {}
+            try:
+                c = sqlite3.Cursor(self)
+                c.execute("""SELECT id FROM datasets WHERE dataset_key = ?""", (dataset_key,))
+                result = c.fetchone()
+                if result is not None:
+                    c.execute("""SELECT COUNT(*) FROM documents WHERE dataset_id = ?""", (result[0],))
+                    size['dataset_documents'] = c.fetchone()[0]
+                    c.execute("""SELECT IFNULL(MAX(id), 0) FROM """+StringTokensTable(result[0]))
+                    size['dataset_tokens'] = c.fetchone()[0]
+                c.close()
+            except sqlite3.Error:
+                pass
+            self.dataset_sizes[dataset_key] = (method_id, size)
+        return self.dataset_sizes[dataset_key][1]
+
+class DocumentMap():
+    '''cached two way mapping between the keys and ids of a dataset's documents'''
+    def __init__(self):
+        self.ids = {}
+        self.keys = {}
+        self.max_id = 0
+
+    def Add(self, rows):
+        for document_id, document_key, document_key_json in rows:
+            self.ids[document_key] = document_id
+            self.keys[document_id] = document_key_json
+            if document_id > self.max_id:
+                self.max_id = document_id
+
+    def GetIds(self, document_keys):
+        '''returns the ids of the documents with the given keys as a numpy array'''
+        return np.fromiter((self.ids[str(document_key)] for document_key in document_keys), dtype=np.int64, count=len(document_keys))
+
+    def GetKeys(self, document_ids):
+        '''returns the keys of the documents with the given ids'''
+        return [DecodeDocumentKey(self.keys[int(document_id)]) for document_id in document_ids]
+
+class ConnectionManager():
+    '''Keeps one open connection per thread to a workspace's database.
+    sqlite3 keeps a cache of prepared statements on each connection so reusing connections also reuses compiled sql.
+    The database runs in write-ahead-log mode: every write is executed by a single writer thread
+    while any other thread can keep reading from its own connection without being blocked.'''
+    def __init__(self, current_workspace_path):
+        self.database_path = os.path.join(current_workspace_path, "workspace_sqlite3.db")
+        self.closed = False
+        self.__lock = threading.Lock()
+        self.__connections = {}
+        self.__write_queue = queue.Queue()
+        self.__writer_thread = None
+        #document maps are keyed by dataset id and are loaded or extended while holding the lock
+        self.document_maps = {}
+        self.document_maps_lock = threading.Lock()
+
+    def GetConnection(self):
+        thread_id = threading.get_ident()
+        with self.__lock:
+            if self.closed:
+                raise sqlite3.ProgrammingError("workspace database has been closed: "+self.database_path)
+            conn = self.__connections.get(thread_id)
+            if conn is None:
+                self.__CloseFinishedThreadConnections()
+                conn = self.__Connect()
+                self.__connections[thread_id] = conn
+        return conn
+
+    def OpenConnection(self):
+        '''returns a new connection that is not shared with any other caller, the caller must close it'''
+        with self.__lock:
+            if self.closed:
+                raise sqlite3.ProgrammingError("workspace database has been closed: "+self.database_path)
+        return self.__Connect()
+
+    def RunWriteOperation(self, func, *args, **kwargs):
+        #write operations that call other write operations are already on the writer thread
+        if threading.current_thread() is self.__writer_thread:
+            return func(*args, **kwargs)
+        future = Future()
+        with self.__lock:
+            if self.closed:
+                raise sqlite3.ProgrammingError("workspace database has been closed: "+self.database_path)
+            if self.__writer_thread is None:
+                self.__writer_thread = threading.Thread(target=self.__WriterLoop,
+                                                        name="DatabaseWriter["+self.database_path+"]",
+                                                        daemon=True)
+                self.__writer_thread.start()
+            self.__write_queue.put((future, func, args, kwargs))
+        return future.result()
+
+    def CloseAll(self):
+        logger = logging.getLogger(__name__+".ConnectionManager.CloseAll")
+        logger.info("Starting")
+        with self.__lock:
+            self.closed = True
+            writer_thread = self.__writer_thread
+        if writer_thread is not None:
+            self.__write_queue.put(None)
+            writer_thread.join()
+        with self.__lock:
+            for conn in self.__connections.values():
+                conn.close()
+            self.__connections.clear()
+        logger.info("Finished")
+
+    def __Connect(self):
+        #connections are only ever used by the thread that requested them,
+        #check_same_thread is disabled so CloseAll can close them from the main thread
+        if Constants.DB_PROFILE:
+            connection_factory = ProfilingConnection
+        else:
+            connection_factory = sqlite3.Connection
+        conn = sqlite3.connect(self.database_path,
+                               timeout=Constants.DB_BUSY_TIMEOUT,
+                               check_same_thread=False,
+                               cached_statements=Constants.DB_STATEMENT_CACHE_SIZE,
+                               factory=connection_factory)
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("PRAGMA journal_mode = WAL")
+        #in wal mode NORMAL only syncs on checkpoints, which keeps bulk inserts fast without risking corruption
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.create_function('log', 1, math.log)
+        conn.create_aggregate('posting_list', 1, PostingListAggregate)
+        return conn
+
+    def __CloseFinishedThreadConnections(self):
+        alive_thread_ids = set(thread.ident for thread in threading.enumerate())
+        for thread_id in list(self.__connections.keys()):
+            if thread_id not in alive_thread_ids:
+                self.__connections.pop(thread_id).close()
+
+    def __WriterLoop(self):
+        logger = logging.getLogger(__name__+".ConnectionManager.WriterLoop")
+        logger.info("Starting")
+        checkpoint_needed = False
+        while True:
+            try:
+                item = self.__write_queue.get(timeout=Constants.DB_CHECKPOINT_INTERVAL)
+            except queue.Empty:
+                #checkpoint the log into the database while no writes are waiting
+                if checkpoint_needed:
+                    try:
+                        self.GetConnection().execute("PRAGMA wal_checkpoint(PASSIVE)")
+                    except sqlite3.Error:
+                        logger.exception("checkpoint failed with error")
+                    checkpoint_needed = False
+                continue
+            if item is None:
+                break
+            future, func, args, kwargs = item
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(func(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+            checkpoint_needed = True
+        logger.info("Finished")
 
 class DatabaseConnection():
     def __init__(self, current_workspace_path):
-        database_path = os.path.join(current_workspace_path, "workspace_sqlite3.db")
-        self.__conn = sqlite3.connect(database_path)
-        self.__conn.execute("PRAGMA foreign_keys = ON")
-        self.__conn.execute("PRAGMA synchronous = OFF")
-        self.__conn.execute("PRAGMA journal_mode = MEMORY")
-    
-    def __del__(self):
-        self.__conn.close()
-
+        self.manager = GetConnectionManager(current_workspace_path)
+
+    @property
+    def __conn(self):
+        return self.manager.GetConnection()
+
+    def _GetDocumentMap(self, c, dataset_id):
+        with self.manager.document_maps_lock:
+            document_map = self.manager.document_maps.get(dataset_id)
+            if document_map is None:
+                sql_select_documents = """SELECT id, document_key, document_key_json
+                                          FROM documents
+                                          WHERE dataset_id = ?
+                                          """
+                c.execute(sql_select_documents, (dataset_id,))
+                document_map = DocumentMap()
+                document_map.Add(c.fetchall())
+                self.manager.document_maps[dataset_id] = document_map
+        return document_map
+
+    def _SyncDocumentMap(self, c, dataset_id):
+        #only maps that are already loaded are extended, others are loaded the next time they are needed
+        with self.manager.document_maps_lock:
+            document_map = self.manager.document_maps.get(dataset_id)
+            if document_map is not None:
+                sql_select_newdocuments = """SELECT id, document_key, document_key_json
+                                             FROM documents
+                                             WHERE dataset_id = ?
+                                             AND id > ?
+                                             """
+                c.execute(sql_select_newdocuments, (dataset_id, document_map.max_id,))
+                document_map.Add(c.fetchall())
+
+    def _DropDocumentMap(self, dataset_id):
+        with self.manager.document_maps_lock:
+            self.manager.document_maps.pop(dataset_id, None)
+
+    def _GetTokenStore(self, c, dataset_id):
+        #returns the columnar store of a dataset that keeps its tokens outside of sqlite, or None when they are kept in its string tokens table
+        c.execute("""SELECT token_store FROM datasets WHERE id = ?""", (dataset_id,))
+        result = c.fetchone()
+        if result is None or result[0] != 'columnar':
+            return None
+        return TokenStore.ColumnarTokenStore(os.path.join(os.path.dirname(self.manager.database_path), "TokenStore", str(int(dataset_id))))
+
+    @WriteOperation
     def Create(self):
         logger = logging.getLogger(__name__+".Create")
         logger.info("Starting")
         try:
             c = self.__conn.cursor()
 
+            #pages freed by deletes are only returned to the file system in incremental vacuum mode,
+            #the mode can be switched cheaply while the database is still empty
+            c.execute("""SELECT COUNT(*) FROM sqlite_master""")
+            if c.fetchone()[0] == 0:
+                self._EnableIncrementalVacuum(c)
+
             sql_createtable_datasets = """ CREATE TABLE IF NOT EXISTS datasets (
                                                     id INTEGER PRIMARY KEY,
                                                     dataset_key TEXT UNIQUE,
-                                                    token_type TEXT
+                                                    token_type TEXT,
+                                                    tfidf_document_count INTEGER,
+                                                    token_store TEXT DEFAULT 'sqlite'
                                                 )"""
             c.execute(sql_createtable_datasets)
 
+            sql_createtable_workspacesettings = """CREATE TABLE IF NOT EXISTS workspace_settings (
+                                                        key TEXT PRIMARY KEY,
+                                                        value TEXT
+                                                    )"""
+            c.execute(sql_createtable_workspacesettings)
+            c.execute("""INSERT OR IGNORE INTO workspace_settings (key, value) VALUES ('token_store', ?)""", (Constants.DB_TOKEN_STORE,))
+
             sql_createtable_datasets = """ CREATE TABLE IF NOT EXISTS fields (
                                                     id INTEGER PRIMARY KEY,
                                                     dataset_id, INTEGER,
@@ -51,6 +442,7 @@ class DatabaseConnection():
                                                     id INTEGER PRIMARY KEY,
                                                     dataset_id, INTEGER,
                                                     document_key TEXT,
+                                                    document_key_json TEXT,
                                                     FOREIGN KEY(dataset_id) REFERENCES datasets(id)
                                                         ON UPDATE CASCADE
                                                         ON DELETE CASCADE,
@@ -58,52 +450,123 @@ class DatabaseConnection():
                                                 )"""
             c.execute(sql_createtable_datasets)
 
-            sql_createtable_stringtokens = """ CREATE TABLE IF NOT EXISTS string_tokens (
-                                                    id integer PRIMARY KEY,
+            #strings are stored once in a vocabulary table per token type and referenced from string_tokens by id
+            sql_createtable_textvocabulary = """ CREATE TABLE IF NOT EXISTS text_vocabulary (
+                                                    id INTEGER PRIMARY KEY,
+                                                    term TEXT UNIQUE
+                                                )"""
+            c.execute(sql_createtable_textvocabulary)
+            sql_createtable_stemvocabulary = """ CREATE TABLE IF NOT EXISTS stem_vocabulary (
+                                                    id INTEGER PRIMARY KEY,
+                                                    term TEXT UNIQUE
+                                                )"""
+            c.execute(sql_createtable_stemvocabulary)
+            sql_createtable_lemmavocabulary = """ CREATE TABLE IF NOT EXISTS lemma_vocabulary (
+                                                    id INTEGER PRIMARY KEY,
+                                                    term TEXT UNIQUE
+                                                )"""
+            c.execute(sql_createtable_lemmavocabulary)
+            sql_createtable_posvocabulary = """ CREATE TABLE IF NOT EXISTS pos_vocabulary (
+                                                    id INTEGER PRIMARY KEY,
+                                                    term TEXT UNIQUE
+                                                )"""
+            c.execute(sql_createtable_posvocabulary)
+
+            #tokens that share a field, strings, pos and stopword flag can only ever be matched together by a filter rule,
+            #so inclusion is tracked once per group instead of on every token
+            sql_createtable_tokengroups = """CREATE TABLE IF NOT EXISTS token_groups (
+                                                    id INTEGER PRIMARY KEY,
                                                     dataset_id INTEGER,
                                                     field_id INTEGER,
-                                                    document_id INTEGER,
-                                                    position INT,
-                                                    text TEXT,
-                                                    stem TEXT,
-                                                    lemma TEXT,
-                                                    pos TEXT,
+                                                    text_id INTEGER,
+                                                    stem_id INTEGER,
+                                                    lemma_id INTEGER,
+                                                    pos_id INTEGER,
                                                     spacy_stopword BOOLEAN,
-                                                    text_tfidf FLOAT,
-                                                    stem_tfidf FLOAT,
-                                                    lemma_tfidf FLOAT,
-                                                    included BOOLEAN DEFAULT 1,
+                                                    text_included BOOLEAN DEFAULT 1,
+                                                    stem_included BOOLEAN DEFAULT 1,
+                                                    lemma_included BOOLEAN DEFAULT 1,
+                                                    text_refresh_included BOOLEAN DEFAULT 1,
+                                                    stem_refresh_included BOOLEAN DEFAULT 1,
+                                                    lemma_refresh_included BOOLEAN DEFAULT 1,
+                                                    text_refresh_removed BOOLEAN DEFAULT 1,
+                                                    stem_refresh_removed BOOLEAN DEFAULT 1,
+                                                    lemma_refresh_removed BOOLEAN DEFAULT 1,
                                                     FOREIGN KEY(dataset_id) REFERENCES datasets(id)
                                                         ON UPDATE CASCADE
                                                         ON DELETE CASCADE,
                                                     FOREIGN KEY(field_id) REFERENCES fields(id)
                                                         ON UPDATE CASCADE
                                                         ON DELETE CASCADE,
-                                                    FOREIGN KEY(document_id) REFERENCES documents(id)
-                                                        ON UPDATE CASCADE
-                                                        ON DELETE CASCADE
+                                                    UNIQUE(field_id, text_id, stem_id, lemma_id, pos_id, spacy_stopword)
                                                 )"""
-            c.execute(sql_createtable_stringtokens)
-
-            sql_create_text_index = """CREATE INDEX IF NOT EXISTS string_tokens_text_index ON string_tokens(dataset_id, text, document_id)"""
-            c.execute(sql_create_text_index)
-            sql_create_stem_index = """CREATE INDEX IF NOT EXISTS string_tokens_stem_index ON string_tokens(dataset_id, stem, document_id)"""
-            c.execute(sql_create_stem_index)
-            sql_create_lemma_index = """CREATE INDEX IF NOT EXISTS string_tokens_lemma_index ON string_tokens(dataset_id, lemma, document_id)"""
-            c.execute(sql_create_lemma_index)
-
-            sql_create_included_index = """CREATE INDEX IF NOT EXISTS string_tokens_included_index ON string_tokens(dataset_id, included)"""
-            c.execute(sql_create_included_index)
-
-            sql_create_text_index = """CREATE INDEX IF NOT EXISTS string_tokens_field_id_index ON string_tokens(field_id)"""
-            c.execute(sql_create_text_index)
+            c.execute(sql_createtable_tokengroups)
+            sql_create_tokengroups_text_index = """CREATE INDEX IF NOT EXISTS token_groups_text_index ON token_groups(dataset_id, text_id)"""
+            c.execute(sql_create_tokengroups_text_index)
+            sql_create_tokengroups_stem_index = """CREATE INDEX IF NOT EXISTS token_groups_stem_index ON token_groups(dataset_id, stem_id)"""
+            c.execute(sql_create_tokengroups_stem_index)
+            sql_create_tokengroups_lemma_index = """CREATE INDEX IF NOT EXISTS token_groups_lemma_index ON token_groups(dataset_id, lemma_id)"""
+            c.execute(sql_create_tokengroups_lemma_index)
+
+            sql_createtable_tokengroupdocuments = """CREATE TABLE IF NOT EXISTS token_group_documents (
+                                                            group_id INTEGER,
+                                                            document_id INTEGER,
+                                                            token_count INTEGER,
+                                                            PRIMARY KEY(group_id, document_id),
+                                                            FOREIGN KEY(group_id) REFERENCES token_groups(id)
+                                                                ON UPDATE CASCADE
+                                                                ON DELETE CASCADE
+                                                        ) WITHOUT ROWID"""
+            c.execute(sql_createtable_tokengroupdocuments)
 
-            sql_create_text_index = """CREATE INDEX IF NOT EXISTS string_tokens_document_id_index ON string_tokens(document_id)"""
-            c.execute(sql_create_text_index)
+            #tf-idf rules differ between the documents of a group, their results are stored as exceptions to the group's included value for a token type
+            sql_createtable_tokengroupoverrides = """CREATE TABLE IF NOT EXISTS token_group_overrides (
+                                                            dataset_id INTEGER,
+                                                            token_type TEXT,
+                                                            group_id INTEGER,
+                                                            document_id INTEGER,
+                                                            included BOOLEAN,
+                                                            PRIMARY KEY(dataset_id, token_type, group_id, document_id),
+                                                            FOREIGN KEY(dataset_id) REFERENCES datasets(id)
+                                                                ON UPDATE CASCADE
+                                                                ON DELETE CASCADE
+                                                        ) WITHOUT ROWID"""
+            c.execute(sql_createtable_tokengroupoverrides)
+
+            #term statistics are kept up to date as tokens are inserted and removed so tf-idf only needs recalculating for changed terms
+            sql_createtable_termstatistics = """CREATE TABLE IF NOT EXISTS term_statistics (
+                                                        dataset_id INTEGER,
+                                                        token_type TEXT,
+                                                        term_id INTEGER,
+                                                        document_frequency INTEGER DEFAULT 0,
+                                                        changed BOOLEAN DEFAULT 1,
+                                                        PRIMARY KEY(dataset_id, token_type, term_id),
+                                                        FOREIGN KEY(dataset_id) REFERENCES datasets(id)
+                                                            ON UPDATE CASCADE
+                                                            ON DELETE CASCADE
+                                                    ) WITHOUT ROWID"""
+            c.execute(sql_createtable_termstatistics)
+
+            sql_createtable_termdocumentstatistics = """CREATE TABLE IF NOT EXISTS term_document_statistics (
+                                                                dataset_id INTEGER,
+                                                                token_type TEXT,
+                                                                term_id INTEGER,
+                                                                document_id INTEGER,
+                                                                tf INTEGER,
+                                                                tfidf FLOAT,
+                                                                PRIMARY KEY(dataset_id, token_type, term_id, document_id),
+                                                                FOREIGN KEY(dataset_id) REFERENCES datasets(id)
+                                                                    ON UPDATE CASCADE
+                                                                    ON DELETE CASCADE
+                                                            ) WITHOUT ROWID"""
+            c.execute(sql_createtable_termdocumentstatistics)
 
             sql_createtable_stringtokensincluded = """CREATE TABLE IF NOT EXISTS string_tokens_included (
                                                             id INTEGER PRIMARY KEY,
                                                             dataset_id INTEGER,
+                                                            token_type TEXT,
+                                                            word_id INTEGER,
+                                                            pos_id INTEGER,
                                                             words TEXT,
                                                             pos TEXT,
                                                             num_of_words, INTEGER,
@@ -111,16 +574,21 @@ class DatabaseConnection():
                                                             spacy_stopword BOOLEAN,
                                                             tfidf_range_min FLOAT,
                                                             tfidf_range_max FLOAT,
-                                                            document_ids TEXT,
+                                                            document_ids BLOB,
                                                             FOREIGN KEY(dataset_id) REFERENCES datasets(id)
                                                                 ON UPDATE CASCADE
                                                                 ON DELETE CASCADE
                                                         )"""
             c.execute(sql_createtable_stringtokensincluded)
+            sql_create_includedkey_index = """CREATE INDEX IF NOT EXISTS string_tokens_included_key_index ON string_tokens_included(dataset_id, token_type, word_id, pos_id)"""
+            c.execute(sql_create_includedkey_index)
 
             sql_createtable_stringtokensremoved = """CREATE TABLE IF NOT EXISTS string_tokens_removed (
                                                             id INTEGER PRIMARY KEY,
                                                             dataset_id INTEGER,
+                                                            token_type TEXT,
+                                                            word_id INTEGER,
+                                                            pos_id INTEGER,
                                                             words TEXT,
                                                             pos TEXT,
                                                             num_of_words, INTEGER,
@@ -128,19 +596,82 @@ class DatabaseConnection():
                                                             spacy_stopword BOOLEAN,
                                                             tfidf_range_min FLOAT,
                                                             tfidf_range_max FLOAT,
-                                                            document_ids TEXT,
+                                                            document_ids BLOB,
                                                             FOREIGN KEY(dataset_id) REFERENCES datasets(id)
                                                                 ON UPDATE CASCADE
                                                                 ON DELETE CASCADE
                                                        )"""
             c.execute(sql_createtable_stringtokensremoved)
+            sql_create_removedkey_index = """CREATE INDEX IF NOT EXISTS string_tokens_removed_key_index ON string_tokens_removed(dataset_id, token_type, word_id, pos_id)"""
+            c.execute(sql_create_removedkey_index)
+
+            #the totals shown for a dataset are kept up to date whenever the included and removed aggregates change
+            #so that reading them does not have to scan the token groups
+            sql_createtable_stringtokenscounts = """CREATE TABLE IF NOT EXISTS string_tokens_counts (
+                                                        dataset_id INTEGER,
+                                                        token_type TEXT,
+                                                        tokens INTEGER DEFAULT 0,
+                                                        unique_tokens INTEGER DEFAULT 0,
+                                                        documents INTEGER DEFAULT 0,
+                                                        included_tokens INTEGER DEFAULT 0,
+                                                        included_unique_tokens INTEGER DEFAULT 0,
+                                                        included_documents INTEGER DEFAULT 0,
+                                                        PRIMARY KEY(dataset_id, token_type),
+                                                        FOREIGN KEY(dataset_id) REFERENCES datasets(id)
+                                                            ON UPDATE CASCADE
+                                                            ON DELETE CASCADE
+                                                    ) WITHOUT ROWID"""
+            c.execute(sql_createtable_stringtokenscounts)
+            #number of included and removed aggregates each document appears in, used to know when a document starts or stops being counted
+            sql_createtable_stringtokensdocumentcounts = """CREATE TABLE IF NOT EXISTS string_tokens_document_counts (
+                                                                dataset_id INTEGER,
+                                                                token_type TEXT,
+                                                                document_id INTEGER,
+                                                                included_words INTEGER DEFAULT 0,
+                                                                removed_words INTEGER DEFAULT 0,
+                                                                PRIMARY KEY(dataset_id, token_type, document_id),
+                                                                FOREIGN KEY(dataset_id) REFERENCES datasets(id)
+                                                                    ON UPDATE CASCADE
+                                                                    ON DELETE CASCADE
+                                                            ) WITHOUT ROWID"""
+            c.execute(sql_createtable_stringtokensdocumentcounts)
+
+            c.execute("""SELECT id FROM datasets""")
+            for row in c.fetchall():
+                self._CreateStringTokensTable(c, row[0])
 
             self.__conn.commit()
             c.close()
         except sqlite3.Error:
             logger.exception("sql failed with sql error")
+            self.__conn.rollback()
         logger.info("Finished")
 
+    def _CreateStringTokensTable(self, c, dataset_id):
+        #each dataset's tokens are kept in their own table so that a dataset's tokens can be dropped instead of deleted row by row
+        #and scans of one dataset never read another dataset's pages,
+        #the table has no foreign keys so that deleting fields or documents never has to search it
+        string_tokens_table = StringTokensTable(dataset_id)
+        sql_createtable_stringtokens = """CREATE TABLE IF NOT EXISTS """+string_tokens_table+""" (
+                                            id INTEGER PRIMARY KEY,
+                                            dataset_id INTEGER,
+                                            field_id INTEGER,
+                                            document_id INTEGER,
+                                            position INT,
+                                            text_id INTEGER,
+                                            stem_id INTEGER,
+                                            lemma_id INTEGER,
+                                            pos_id INTEGER,
+                                            spacy_stopword BOOLEAN,
+                                            group_id INTEGER
+                                        )"""
+        c.execute(sql_createtable_stringtokens)
+        sql_create_document_index = """CREATE INDEX IF NOT EXISTS """+string_tokens_table+"""_document_index ON """+string_tokens_table+"""(document_id, field_id, position)"""
+        c.execute(sql_create_document_index)
+        sql_create_field_index = """CREATE INDEX IF NOT EXISTS """+string_tokens_table+"""_field_index ON """+string_tokens_table+"""(field_id)"""
+        c.execute(sql_create_field_index)
+
+    @WriteOperation
     def Upgrade0_8_5(self):
         logger = logging.getLogger(__name__+".Upgrade0_8_5")
         logger.info("Starting")
@@ -150,47 +681,397 @@ class DatabaseConnection():
             c.execute("""DROP VIEW IF EXISTS string_tokens_included_view""")
             c.execute("""DROP VIEW IF EXISTS string_tokens_removed_view""")
 
+            #string_tokens has to be split into each dataset's own table before Create builds their indexes
+            self.Upgrade0_8_12()
             self.Create()
             self.__conn.commit()
             c.close()
         except sqlite3.Error:
             logger.exception("sql failed with sql error")
+            self.__conn.rollback()
         logger.info("Finished")
     
+    @WriteOperation
     def Upgrade0_8_7(self):
         logger = logging.getLogger(__name__+".Upgrade0_8_7")
         logger.info("Starting")
         try:
             c = self.__conn.cursor()
 
-            c.execute("""ALTER TABLE string_tokens_included
-                         ADD COLUMN document_ids text;
-                         """)
-            c.execute("""ALTER TABLE string_tokens_removed
-                         ADD COLUMN document_ids text;
-                         """)
+            #workspaces upgraded from before 0.8.5 already have the current tables with their document_ids
+            for table in ['string_tokens_included', 'string_tokens_removed']:
+                c.execute("""PRAGMA table_info("""+table+""")""")
+                columns = [row[1] for row in c.fetchall()]
+                if 'document_ids' not in columns:
+                    c.execute("""ALTER TABLE """+table+"""
+                                 ADD COLUMN document_ids text;
+                                 """)
             self.__conn.commit()
             c.close()
         except sqlite3.Error:
             logger.exception("sql failed with sql error")
+            self.__conn.rollback()
         logger.info("Finished")
 
+    @WriteOperation
+    def Upgrade0_8_12(self):
+        logger = logging.getLogger(__name__+".Upgrade0_8_12")
+        logger.info("Starting")
+        try:
+            c = self.__conn.cursor()
+
+            c.execute("""PRAGMA table_info(datasets)""")
+            columns = [row[1] for row in c.fetchall()]
+            if 'tfidf_document_count' not in columns:
+                c.execute("""ALTER TABLE datasets
+                             ADD COLUMN tfidf_document_count INTEGER;
+                             """)
+            if 'token_store' not in columns:
+                c.execute("""ALTER TABLE datasets
+                             ADD COLUMN token_store TEXT DEFAULT 'sqlite';
+                             """)
+
+            c.execute("""PRAGMA table_info(documents)""")
+            columns = [row[1] for row in c.fetchall()]
+            if 'document_key_json' not in columns:
+                #keys are evaluated one last time so that they can be read back as json from now on
+                c.execute("""ALTER TABLE documents
+                             ADD COLUMN document_key_json TEXT;
+                             """)
+                c.execute("""SELECT id, document_key FROM documents""")
+                parameters = [(EncodeDocumentKey(ast.literal_eval(row[1])), row[0],) for row in c.fetchall()]
+                c.executemany("""UPDATE documents SET document_key_json = ? WHERE id = ?""", parameters)
+
+            c.execute("""PRAGMA table_info(token_groups)""")
+            columns = [row[1] for row in c.fetchall()]
+            if len(columns) > 0 and 'text_included' not in columns:
+                #inclusion is now kept for every token type, the rules are reapplied after upgrading so every group starts included
+                for token_type in TOKEN_TYPES:
+                    for column in TokenTypeInclusion(token_type):
+                        c.execute("""ALTER TABLE token_groups
+                                     ADD COLUMN """+column+""" BOOLEAN DEFAULT 1;
+                                     """)
+                c.execute("""DROP TABLE IF EXISTS token_group_overrides""")
+
+            c.execute("""PRAGMA table_info(string_tokens_included)""")
+            column_types = {row[1]: row[2] for row in c.fetchall()}
+            c.execute("""PRAGMA table_info(string_tokens_counts)""")
+            counts_columns = [row[1] for row in c.fetchall()]
+            if 'word_id' not in column_types or 'token_type' not in column_types or column_types.get('document_ids') != 'BLOB' or len(counts_columns) == 0:
+                #these tables only hold aggregates so they are recreated and refreshed rather than converted,
+                #the counts are kept in step with the aggregates so they are recreated along with them
+                c.execute("""DROP TABLE IF EXISTS string_tokens_included""")
+                c.execute("""DROP TABLE IF EXISTS string_tokens_removed""")
+                c.execute("""DROP TABLE IF EXISTS string_tokens_counts""")
+                c.execute("""DROP TABLE IF EXISTS string_tokens_document_counts""")
+                c.execute("""SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'token_groups'""")
+                if c.fetchone() is not None:
+                    c.execute("""UPDATE token_groups SET """+TokenGroupsRefreshSql())
+
+            c.execute("""PRAGMA table_info(string_tokens)""")
+            columns = [row[1] for row in c.fetchall()]
+            if 'text' in columns:
+                #move the tokens stored as strings aside and reinsert them into each dataset's string tokens table that uses the vocabularies
+                c.execute("""DROP INDEX IF EXISTS string_tokens_text_index""")
+                c.execute("""DROP INDEX IF EXISTS string_tokens_stem_index""")
+                c.execute("""DROP INDEX IF EXISTS string_tokens_lemma_index""")
+                c.execute("""DROP INDEX IF EXISTS string_tokens_included_index""")
+                c.execute("""DROP INDEX IF EXISTS string_tokens_field_id_index""")
+                c.execute("""DROP INDEX IF EXISTS string_tokens_document_id_index""")
+                c.execute("""ALTER TABLE string_tokens RENAME TO string_tokens_old""")
+                self.__conn.commit()
+                self.Create()
+                c.execute("""SELECT dataset_key FROM datasets""")
+                dataset_keys = [row[0] for row in c.fetchall()]
+                for dataset_key in dataset_keys:
+                    self.BeginBulkLoad(dataset_key)
+
+                sql_select_fields = """SELECT fields.id,
+                                              datasets.dataset_key,
+                                              fields.field_key
+                                       FROM fields
+                                       JOIN datasets ON
+                                            fields.dataset_id = datasets.id
+                                       """
+                c.execute(sql_select_fields)
+                fields = c.fetchall()
+
+                sql_select_documentids = """SELECT DISTINCT document_id
+                                            FROM string_tokens_old
+                                            WHERE field_id = ?
+                                            ORDER BY document_id
+                                            """
+                sql_select_oldtokens = """SELECT documents.document_key,
+                                                 position,
+                                                 text,
+                                                 stem,
+                                                 lemma,
+                                                 pos,
+                                                 spacy_stopword
+                                          FROM string_tokens_old
+                                          JOIN documents ON
+                                               string_tokens_old.document_id = documents.id
+                                          WHERE field_id = ?
+                                          AND document_id BETWEEN ? AND ?
+                                          ORDER BY document_id, position
+                                          """
+                for field_id, dataset_key, field_key in fields:
+                    c.execute(sql_select_documentids, (field_id,))
+                    document_ids = [row[0] for row in c.fetchall()]
+                    for i in range(0, len(document_ids), Constants.DB_UPGRADE_DOCUMENTS_PER_BATCH):
+                        batch_ids = document_ids[i:i+Constants.DB_UPGRADE_DOCUMENTS_PER_BATCH]
+                        c.execute(sql_select_oldtokens, (field_id, batch_ids[0], batch_ids[-1],))
+                        tokens = {}
+                        for row in c.fetchall():
+                            tokens.setdefault(row[0], []).append(row[1:])
+                        self.InsertStringTokens(dataset_key, field_key, tokens)
+                    logger.info("Upgraded tokens of field[%s] in dataset[%s]", field_key, dataset_key)
+
+                c.execute("""DROP TABLE string_tokens_old""")
+                self.__conn.commit()
+                for dataset_key in dataset_keys:
+                    self.EndBulkLoad(dataset_key)
+            elif 'group_id' in columns:
+                #tokens that already use the vocabularies only have to be split into each dataset's own table
+                self.__conn.commit()
+                self.Create()
+                c.execute("""SELECT id FROM datasets""")
+                for row in c.fetchall():
+                    sql_copy_stringtokens = """INSERT INTO """+StringTokensTable(row[0])+"""
+                                                 SELECT id,
+                                                        dataset_id,
+                                                        field_id,
+                                                        document_id,
+                                                        position,
+                                                        text_id,
+                                                        stem_id,
+                                                        lemma_id,
+                                                        pos_id,
+                                                        spacy_stopword,
+                                                        group_id
+                                                 FROM string_tokens
+                                                 WHERE dataset_id = ?
+                                                 """
+                    c.execute(sql_copy_stringtokens, (row[0],))
+                c.execute("""DROP TABLE string_tokens""")
+            self.__conn.commit()
+            #older workspaces were created without incremental vacuum so they are rebuilt once to switch modes,
+            #which also drops the pages freed by the upgrade
+            self._EnableIncrementalVacuum(c)
+            c.close()
+            #recreates any tables dropped above
+            self.Create()
+        except sqlite3.Error:
+            logger.exception("sql failed with sql error")
+            self.__conn.rollback()
+        logger.info("Finished")
+
+    def _EnableIncrementalVacuum(self, c):
+        c.execute("""PRAGMA auto_vacuum""")
+        if c.fetchone()[0] != 2:
+            c.execute("""PRAGMA auto_vacuum = INCREMENTAL""")
+            #switching an existing database into incremental mode requires it to be rebuilt
+            c.execute("""VACUUM""")
+
+    @WriteOperation
+    def Analyze(self):
+        '''refreshes the statistics used by the query planner'''
+        logger = logging.getLogger(__name__+".Analyze")
+        logger.info("Starting")
+        try:
+            c = self.__conn.cursor()
+            #limits how many rows of each index are sampled so analyzing stays quick on large workspaces
+            c.execute("""PRAGMA analysis_limit = """+str(Constants.DB_ANALYSIS_LIMIT))
+            c.execute("""ANALYZE""")
+            self.__conn.commit()
+            c.close()
+        except sqlite3.Error as e:
+            logger.exception("sql failed with error")
+            self.__conn.rollback()
+        logger.info("Finished")
+
+    @WriteOperation
+    def IncrementalVacuum(self, max_pages):
+        '''returns up to max_pages free pages to the file system so that the database file shrinks after deletes,
+        only a few pages are freed by each call so other writes waiting on the writer thread are not held up.
+        returns the number of pages that were freed'''
+        logger = logging.getLogger(__name__+".IncrementalVacuum")
+        logger.info("Starting")
+        freed_pages = 0
+        try:
+            c = self.__conn.cursor()
+            c.execute("""PRAGMA auto_vacuum""")
+            if c.fetchone()[0] == 2:
+                c.execute("""PRAGMA freelist_count""")
+                free_pages = c.fetchone()[0]
+                c.execute("""PRAGMA incremental_vacuum("""+str(int(max_pages))+""")""")
+                c.fetchall()
+                self.__conn.commit()
+                c.execute("""PRAGMA freelist_count""")
+                freed_pages = free_pages - c.fetchone()[0]
+            c.close()
+        except sqlite3.Error as e:
+            logger.exception("sql failed with error")
+            self.__conn.rollback()
+        logger.info("Finished")
+        return freed_pages
+
+    def GetStorageFootprint(self):
+        '''returns the number of bytes used by the database file, by its free pages,
+        by each dataset's string tokens and by the tables shared between datasets'''
+        logger = logging.getLogger(__name__+".GetStorageFootprint")
+        logger.info("Starting")
+        footprint = {'file_bytes': 0, 'free_bytes': 0, 'shared_bytes': 0, 'datasets_bytes': {}}
+        try:
+            c = self.__conn.cursor()
+            c.execute("""PRAGMA page_size""")
+            page_size = c.fetchone()[0]
+            c.execute("""PRAGMA page_count""")
+            footprint['file_bytes'] = c.fetchone()[0] * page_size
+            c.execute("""PRAGMA freelist_count""")
+            footprint['free_bytes'] = c.fetchone()[0] * page_size
+            c.execute("""SELECT id, dataset_key FROM datasets""")
+            string_tokens_tables = {}
+            for row in c.fetchall():
+                string_tokens_tables[StringTokensTable(row[0])] = row[1]
+                footprint['datasets_bytes'][row[1]] = 0
+                #tokens kept in a columnar store are outside of the database file
+                token_store = self._GetTokenStore(c, row[0])
+                if token_store is not None:
+                    footprint['datasets_bytes'][row[1]] += token_store.Size()
+            #indexes are counted against the table they belong to
+            sql_select_tablesizes = """SELECT IFNULL(sqlite_master.tbl_name, dbstat.name),
+                                              SUM(dbstat.pgsize)
+                                       FROM dbstat
+                                       LEFT JOIN sqlite_master ON sqlite_master.name = dbstat.name
+                                       WHERE dbstat.aggregate = TRUE
+                                       GROUP BY 1
+                                       """
+            c.execute(sql_select_tablesizes)
+            for row in c.fetchall():
+                if row[0] in string_tokens_tables:
+                    footprint['datasets_bytes'][string_tokens_tables[row[0]]] += row[1]
+                else:
+                    footprint['shared_bytes'] += row[1]
+            c.close()
+        except sqlite3.Error as e:
+            logger.exception("sql failed with error")
+        logger.info("Finished")
+        return footprint
+
+    def GetWorkspaceSetting(self, key):
+        logger = logging.getLogger(__name__+".GetWorkspaceSetting")
+        logger.info("Starting")
+        value = None
+        try:
+            c = self.__conn.cursor()
+            c.execute("""SELECT value FROM workspace_settings WHERE key = ?""", (key,))
+            result = c.fetchone()
+            if result is not None:
+                value = result[0]
+            c.close()
+        except sqlite3.Error as e:
+            logger.exception("sql failed with error")
+        logger.info("Finished")
+        return value
+
+    @WriteOperation
+    def UpdateWorkspaceSetting(self, key, value):
+        logger = logging.getLogger(__name__+".UpdateWorkspaceSetting")
+        logger.info("Starting")
+        try:
+            c = self.__conn.cursor()
+            sql_upsert_setting = """INSERT INTO workspace_settings (key, value)
+                                    VALUES (?, ?)
+                                    ON CONFLICT(key) DO UPDATE SET value = excluded.value
+                                    """
+            c.execute(sql_upsert_setting, (key, value,))
+            self.__conn.commit()
+            c.close()
+        except sqlite3.Error as e:
+            logger.exception("sql failed with error")
+            self.__conn.rollback()
+        logger.info("Finished")
+
+    @WriteOperation
+    def Checkpoint(self):
+        logger = logging.getLogger(__name__+".Checkpoint")
+        logger.info("Starting")
+        try:
+            #moves the write-ahead-log into the database file so the file can be copied on its own
+            self.__conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            logger.exception("sql failed with error")
+        logger.info("Finished")
+
+    @WriteOperation
+    def BeginBulkLoad(self, dataset_key):
+        '''drops the indexes of a dataset's string tokens so that large token inserts do not maintain them row by row,
+        EndBulkLoad must be called once the inserts are finished'''
+        logger = logging.getLogger(__name__+".BeginBulkLoad")
+        logger.info("Starting")
+        try:
+            c = self.__conn.cursor()
+            sql_select_datasetid = """SELECT id
+                                      FROM datasets 
+                                      WHERE dataset_key = ?
+                                      """
+            c.execute(sql_select_datasetid, (str(dataset_key),))
+            string_tokens_table = StringTokensTable(c.fetchone()[0])
+            c.execute("""DROP INDEX IF EXISTS """+string_tokens_table+"""_document_index""")
+            c.execute("""DROP INDEX IF EXISTS """+string_tokens_table+"""_field_index""")
+            self.__conn.commit()
+            c.close()
+        except sqlite3.Error as e:
+            logger.exception("sql failed with error")
+            self.__conn.rollback()
+        logger.info("Finished")
+
+    @WriteOperation
+    def EndBulkLoad(self, dataset_key):
+        '''rebuilds the indexes dropped by BeginBulkLoad and refreshes the statistics used by the query planner'''
+        logger = logging.getLogger(__name__+".EndBulkLoad")
+        logger.info("Starting")
+        try:
+            c = self.__conn.cursor()
+            sql_select_datasetid = """SELECT id
+                                      FROM datasets 
+                                      WHERE dataset_key = ?
+                                      """
+            c.execute(sql_select_datasetid, (str(dataset_key),))
+            self._CreateStringTokensTable(c, c.fetchone()[0])
+            self.__conn.commit()
+            c.close()
+        except sqlite3.Error as e:
+            logger.exception("sql failed with error")
+            self.__conn.rollback()
+        self.Analyze()
+        logger.info("Finished")
+
+    @WriteOperation
     def InsertDataset(self, dataset_key, token_type):
         logger = logging.getLogger(__name__+".InsertDataset")
         logger.info("Starting")
         try:
             c = self.__conn.cursor()
+            #datasets keep the token store the workspace was set to use when they were added
             sql_insert_dataset = """INSERT INTO datasets (
                                         dataset_key,
-                                        token_type
-                                        ) values (?, ?)"""
+                                        token_type,
+                                        token_store
+                                        ) values (?, ?, IFNULL((SELECT value
+                                                                FROM workspace_settings
+                                                                WHERE key = 'token_store'), 'sqlite'))"""
             c.execute(sql_insert_dataset, (str(dataset_key), str(token_type),))
+            self._CreateStringTokensTable(c, c.lastrowid)
             self.__conn.commit()
             c.close()
         except sqlite3.Error as e:
             logger.exception("sql failed with error")
+            self.__conn.rollback()
         logger.info("Finished")
 
+    @WriteOperation
     def UpdateDatasetKey(self, old_dataset_key, new_dataset_key):
         logger = logging.getLogger(__name__+".UpdateDatasetKey")
         logger.info("Starting")
@@ -206,8 +1087,10 @@ class DatabaseConnection():
             c.close()
         except sqlite3.Error as e:
             logger.exception("sql failed with error")
+            self.__conn.rollback()
         logger.info("Finished")
 
+    @WriteOperation
     def UpdateDatasetTokenType(self, dataset_key, token_type):
         logger = logging.getLogger(__name__+".UpdateDatasetTokenType")
         logger.info("Starting")
@@ -217,28 +1100,47 @@ class DatabaseConnection():
                                       SET token_type = ?
                                       WHERE dataset_key = ?
                                       """
+            #the aggregates of every token type are already maintained so only which of them are read changes
             c.execute(sql_update_tokentype, (token_type, str(dataset_key),))
             self.__conn.commit()
             c.close()
         except sqlite3.Error as e:
             logger.exception("sql failed with error")
+            self.__conn.rollback()
         logger.info("Finished")
 
+    @WriteOperation
     def DeleteDataset(self, dataset_key):
         logger = logging.getLogger(__name__+".DeleteDataset")
         logger.info("Starting")
         try:
             c = self.__conn.cursor()
+            sql_select_datasetid = """SELECT id
+                                      FROM datasets 
+                                      WHERE dataset_key = ?
+                                      """
+            c.execute(sql_select_datasetid, (str(dataset_key),))
+            result = c.fetchone()
+            token_store = None
+            if result is not None:
+                token_store = self._GetTokenStore(c, result[0])
+                c.execute("""DROP TABLE IF EXISTS """+StringTokensTable(result[0]))
             sql_delete_dataset = """DELETE FROM datasets
                                     WHERE dataset_key = ?
                                     """
             c.execute(sql_delete_dataset, (str(dataset_key),))
             self.__conn.commit()
             c.close()
+            if result is not None:
+                self._DropDocumentMap(result[0])
+            if token_store is not None:
+                token_store.Drop()
         except sqlite3.Error as e:
             logger.exception("sql failed with error")
+            self.__conn.rollback()
         logger.info("Finished")
     
+    @WriteOperation
     def InsertField(self, dataset_key, field_key):
         logger = logging.getLogger(__name__+".InsertField")
         logger.info("Starting")
@@ -259,8 +1161,10 @@ class DatabaseConnection():
             c.close()
         except sqlite3.Error as e:
             logger.exception("sql failed with error")
+            self.__conn.rollback()
         logger.info("Finished")
 
+    @WriteOperation
     def UpdateFieldKey(self, dataset_key, old_field_key, new_field_key):
         logger = logging.getLogger(__name__+".UpdateDatasetKey")
         logger.info("Starting")
@@ -278,8 +1182,10 @@ class DatabaseConnection():
             c.close()
         except sqlite3.Error as e:
             logger.exception("sql failed with error")
+            self.__conn.rollback()
         logger.info("Finished")
     
+    @WriteOperation
     def UpdateFieldPosition(self, dataset_key, field_key, position):
         logger = logging.getLogger(__name__+".InsertField")
         logger.info("Starting")
@@ -297,24 +1203,134 @@ class DatabaseConnection():
             c.close()
         except sqlite3.Error as e:
             logger.exception("sql failed with error")
+            self.__conn.rollback()
         logger.info("Finished")
 
+    @WriteOperation
     def DeleteField(self, dataset_key, field_key):
         logger = logging.getLogger(__name__+".DeleteField")
         logger.info("Starting")
         try:
             c = self.__conn.cursor()
-            sql_delete_field = """DELETE FROM fields
-                                  WHERE dataset_id = (SELECT id
-                                                      FROM datasets 
-                                                      WHERE dataset_key = ?)
+            sql_select_field = """SELECT fields.dataset_id,
+                                         fields.id
+                                  FROM fields
+                                  JOIN datasets ON
+                                       fields.dataset_id = datasets.id
+                                  WHERE dataset_key = ?
                                   AND field_key = ?
                                   """
-            c.execute(sql_delete_field, (str(dataset_key), str(field_key),))
+            c.execute(sql_select_field, (str(dataset_key), str(field_key),))
+            result = c.fetchone()
+            if result is not None:
+                dataset_id = result[0]
+                field_id = result[1]
+                #take the field's tokens out of the term statistics before they are removed
+                token_store = self._GetTokenStore(c, dataset_id)
+                if token_store is None:
+                    self._UpdateTermStatistics(c, dataset_id, "field_id = ?", (field_id,), -1)
+                    sql_delete_stringtokens = """DELETE FROM """+StringTokensTable(dataset_id)+"""
+                                                 WHERE field_id = ?
+                                                 """
+                    c.execute(sql_delete_stringtokens, (field_id,))
+                else:
+                    columns = token_store.Read()
+                    field_tokens = columns['field_id'] == field_id
+                    self._UpdateColumnsTermStatistics(c, dataset_id, {column: values[field_tokens] for column, values in columns.items()}, -1)
+                    del columns
+                #and drop the aggregates of the field's words for every token type so they are rebuilt from the remaining fields
+                for token_type in TOKEN_TYPES:
+                    word_column, vocabulary_table = TokenTypeVocabulary(token_type)
+                    included_column, refresh_included_column, refresh_removed_column = TokenTypeInclusion(token_type)
+                    sql_field_keys = """SELECT """+word_column+""",
+                                               pos_id
+                                        FROM token_groups
+                                        WHERE field_id = :field_id
+                                        """
+                    sql_field_words = """SELECT """+word_column+"""
+                                         FROM token_groups
+                                         WHERE field_id = :field_id
+                                         """
+                    parameters = {'dataset_id':dataset_id, 'token_type':token_type, 'field_id':field_id}
+                    before_counts = self._GetStringTokensRowsCounts(c, 'string_tokens_included', sql_field_keys, sql_field_words, parameters)
+                    sql_delete_stringtokensincluded = """DELETE FROM string_tokens_included
+                                                         WHERE dataset_id = :dataset_id
+                                                         AND token_type = :token_type
+                                                         AND (word_id, pos_id) IN ("""+sql_field_keys+""")
+                                                         """
+                    c.execute(sql_delete_stringtokensincluded, parameters)
+                    after_counts = self._GetStringTokensRowsCounts(c, 'string_tokens_included', sql_field_keys, sql_field_words, parameters)
+                    self._UpdateStringTokensCounts(c, dataset_id, token_type, True, before_counts, after_counts)
+                    before_counts = self._GetStringTokensRowsCounts(c, 'string_tokens_removed', sql_field_keys, sql_field_words, parameters)
+                    sql_delete_stringtokensremoved = """DELETE FROM string_tokens_removed
+                                                        WHERE dataset_id = :dataset_id
+                                                        AND token_type = :token_type
+                                                        AND (word_id, pos_id) IN ("""+sql_field_keys+""")
+                                                        """
+                    c.execute(sql_delete_stringtokensremoved, parameters)
+                    after_counts = self._GetStringTokensRowsCounts(c, 'string_tokens_removed', sql_field_keys, sql_field_words, parameters)
+                    self._UpdateStringTokensCounts(c, dataset_id, token_type, False, before_counts, after_counts)
+                    sql_update_refreshgroups = """UPDATE token_groups
+                                                  SET """+refresh_included_column+""" = 1,
+                                                      """+refresh_removed_column+""" = 1
+                                                  WHERE dataset_id = :dataset_id
+                                                  AND field_id != :field_id
+                                                  AND ("""+word_column+""", pos_id) IN ("""+sql_field_keys+""")
+                                                  """
+                    c.execute(sql_update_refreshgroups, {'dataset_id':dataset_id, 'field_id':field_id})
+                sql_delete_field = """DELETE FROM fields
+                                      WHERE id = ?
+                                      """
+                c.execute(sql_delete_field, (field_id,))
+            self.__conn.commit()
+            c.close()
+            #the columns are only rewritten once the field is gone, any of its tokens left behind by a failed rewrite belong to no token group
+            if result is not None and token_store is not None:
+                token_store.Filter(~field_tokens)
+        except OSError as e:
+            logger.exception("token store failed with error")
+        except sqlite3.Error as e:
+            logger.exception("sql failed with error")
+            self.__conn.rollback()
+        logger.info("Finished")
+
+    @WriteOperation
+    def DeleteDatasetTokens(self, dataset_key):
+        '''removes every field and string token of a dataset so that it can be tokenized again'''
+        logger = logging.getLogger(__name__+".DeleteDatasetTokens")
+        logger.info("Starting")
+        try:
+            c = self.__conn.cursor()
+            sql_select_datasetid = """SELECT id
+                                      FROM datasets 
+                                      WHERE dataset_key = ?
+                                      """
+            c.execute(sql_select_datasetid, (str(dataset_key),))
+            dataset_id = c.fetchone()[0]
+            #all of the dataset's tokens are removed so their table is dropped and recreated rather than deleted from
+            c.execute("""DROP TABLE IF EXISTS """+StringTokensTable(dataset_id))
+            self._CreateStringTokensTable(c, dataset_id)
+            token_store = self._GetTokenStore(c, dataset_id)
+            if token_store is not None:
+                token_store.Drop()
+            c.execute("""DELETE FROM fields WHERE dataset_id = ?""", (dataset_id,))
+            c.execute("""DELETE FROM token_group_overrides WHERE dataset_id = ?""", (dataset_id,))
+            c.execute("""DELETE FROM term_document_statistics WHERE dataset_id = ?""", (dataset_id,))
+            c.execute("""DELETE FROM term_statistics WHERE dataset_id = ?""", (dataset_id,))
+            c.execute("""DELETE FROM string_tokens_included WHERE dataset_id = ?""", (dataset_id,))
+            c.execute("""DELETE FROM string_tokens_removed WHERE dataset_id = ?""", (dataset_id,))
+            c.execute("""DELETE FROM string_tokens_counts WHERE dataset_id = ?""", (dataset_id,))
+            c.execute("""DELETE FROM string_tokens_document_counts WHERE dataset_id = ?""", (dataset_id,))
+            sql_update_dataset = """UPDATE datasets
+                                    SET tfidf_document_count = NULL
+                                    WHERE id = ?
+                                    """
+            c.execute(sql_update_dataset, (dataset_id,))
             self.__conn.commit()
             c.close()
         except sqlite3.Error as e:
             logger.exception("sql failed with error")
+            self.__conn.rollback()
         logger.info("Finished")
 
     def CheckIfFieldExists(self, dataset_key, field_key):
@@ -336,9 +1352,11 @@ class DatabaseConnection():
             c.close()
         except sqlite3.Error as e:
             logger.exception("sql failed with error")
+            self.__conn.rollback()
         logger.info("Finished")
         return value
     
+    @WriteOperation
     def InsertDocuments(self, dataset_key, document_keys):
         logger = logging.getLogger(__name__+".InsertDataset")
         logger.info("Starting")
@@ -355,44 +1373,52 @@ class DatabaseConnection():
             dataset_id = c.fetchone()[0]
             parameters = []
             for document_key in document_keys:
-                parameters.append((dataset_id, str(document_key),))
+                parameters.append((dataset_id, str(document_key), EncodeDocumentKey(document_key),))
             sql_insert_tokens = """INSERT INTO documents (
                                           dataset_id,
-                                          document_key
-                                          ) values (?, ?)"""
+                                          document_key,
+                                          document_key_json
+                                          ) values (?, ?, ?)"""
             c.executemany(sql_insert_tokens, parameters)
             c.execute("COMMIT")
+            self._SyncDocumentMap(c, dataset_id)
             c.close()
         except sqlite3.Error as e:
             logger.exception("sql failed with error")
+            self.__conn.rollback()
         finally:
             self.__conn.isolation_level = old_isolation_level
         logger.info("Finished")
     
-    def GetDocumentKeys(self, document_ids):
-        logger = logging.getLogger(__name__+".InsertDataset")
+    def GetDocumentKeys(self, dataset_key, document_ids):
+        logger = logging.getLogger(__name__+".GetDocumentKeys")
         logger.info("Starting")
         document_keys = []
         try:
             c = self.__conn.cursor()
-            sql_select_documentkeys = """SELECT document_key
-                                         FROM documents
-                                         WHERE id = ?
-                                         """
-            for document_id in document_ids:
-                c.execute(sql_select_documentkeys, (document_id,))
-                document_keys.append(ast.literal_eval(c.fetchone()[0]))
+            sql_select_datasetid = """SELECT id
+                                      FROM datasets 
+                                      WHERE dataset_key = ?
+                                      """
+            c.execute(sql_select_datasetid, (str(dataset_key),))
+            dataset_id = c.fetchone()[0]
+            document_map = self._GetDocumentMap(c, dataset_id)
+            document_keys = document_map.GetKeys(document_ids)
+            c.close()
         except sqlite3.Error as e:
             logger.exception("sql failed with error")
+            self.__conn.rollback()
         logger.info("Finished")
         return document_keys
 
     #Function used during processing
+    @WriteOperation
     def InsertStringTokens(self, dataset_key, field_key, tokens):
         logger = logging.getLogger(__name__+".InsertStringTokens")
         logger.info("Starting")
         old_isolation_level = self.__conn.isolation_level
         self.__conn.isolation_level = None
+        store_start = None
         try:
             c = self.__conn.cursor()
             sql_select_datasetid = """SELECT id
@@ -410,52 +1436,248 @@ class DatabaseConnection():
             c.execute(sql_select_fieldid, (dataset_id, str(field_key),))
             field_id = c.fetchone()[0]
 
-            sql_select_documentid = """SELECT id
-                                       FROM documents 
-                                       WHERE dataset_id = ?
-                                       AND document_key = ?
-                                       """
-            sql_insert_tokens = """INSERT INTO string_tokens (
+            string_tokens_table = StringTokensTable(dataset_id)
+            sql_insert_tokens = """INSERT INTO """+string_tokens_table+""" (
                                         dataset_id,
                                         field_id,
                                         document_id,
                                         position,
-                                        text,
-                                        stem,
-                                        lemma,
-                                        pos,
-                                        spacy_stopword
-                                        ) values (?,?,?,?,?,?,?,?,?)"""
+                                        text_id,
+                                        stem_id,
+                                        lemma_id,
+                                        pos_id,
+                                        spacy_stopword,
+                                        group_id
+                                        ) values (?,?,?,?,?,?,?,?,?,?)"""
+            if not isinstance(tokens, TokenStore.PackedTokens):
+                tokens = TokenStore.PackedTokens.FromTokensets(tokens)
             c.execute("BEGIN")
-            for doc_key in tokens:
-                c.execute(sql_select_documentid, (dataset_id, str(doc_key),))
-                document_id = c.fetchone()[0]
-                parameters = []
-                for t in tokens[doc_key]:
-                    parameters.append((dataset_id, field_id, document_id, t[0], t[1], t[2], t[3], t[4], t[5],))
-                c.executemany(sql_insert_tokens, parameters)
+            c.execute("""SELECT IFNULL(MAX(id), 0) FROM """+string_tokens_table)
+            last_token_id = c.fetchone()[0]
+            #each distinct term of the chunk is interned once and the tokens' term indexes are mapped to ids as whole arrays
+            terms = tokens.terms
+            text_ids = self._InternTermIndexes(c, 'text_vocabulary', terms, tokens.columns['text'])
+            stem_ids = self._InternTermIndexes(c, 'stem_vocabulary', terms, tokens.columns['stem'])
+            lemma_ids = self._InternTermIndexes(c, 'lemma_vocabulary', terms, tokens.columns['lemma'])
+            pos_ids = self._InternTermIndexes(c, 'pos_vocabulary', terms, tokens.columns['pos'])
+            spacy_stopwords = (tokens.columns['spacy_stopword'] != 0).astype(np.int64)
+            group_ids = np.zeros(len(text_ids), dtype=np.int64)
+            if len(group_ids) > 0:
+                unique_groups, group_indexes = TokenStore.UniqueRows((text_ids, stem_ids, lemma_ids, pos_ids, spacy_stopwords))
+                group_keys = [(text_id, stem_id, lemma_id, pos_id, bool(spacy_stopword),) for text_id, stem_id, lemma_id, pos_id, spacy_stopword in unique_groups.tolist()]
+                unique_group_ids = self._InternTokenGroups(c, dataset_id, field_id, group_keys)
+                group_ids = np.array([unique_group_ids[group_key] for group_key in group_keys], dtype=np.int64)[group_indexes]
+            document_ids = np.repeat(self._GetDocumentMap(c, dataset_id).GetIds(tokens.document_keys), tokens.DocumentTokenCounts())
+            token_store = self._GetTokenStore(c, dataset_id)
+            if token_store is None:
+                c.executemany(sql_insert_tokens, zip(itertools.repeat(dataset_id),
+                                                     itertools.repeat(field_id),
+                                                     document_ids.tolist(),
+                                                     tokens.columns['position'].tolist(),
+                                                     text_ids.tolist(),
+                                                     stem_ids.tolist(),
+                                                     lemma_ids.tolist(),
+                                                     pos_ids.tolist(),
+                                                     spacy_stopwords.tolist(),
+                                                     group_ids.tolist()))
+                #new tokens always receive ids above the previous largest id
+                sql_upsert_tokengroupdocuments = """INSERT INTO token_group_documents (
+                                                        group_id,
+                                                        document_id,
+                                                        token_count
+                                                        )
+                                                    SELECT group_id,
+                                                           document_id,
+                                                           COUNT(*)
+                                                    FROM """+string_tokens_table+"""
+                                                    WHERE id > ?
+                                                    GROUP BY group_id, document_id
+                                                    ON CONFLICT(group_id, document_id)
+                                                    DO UPDATE SET token_count = token_count + excluded.token_count
+                                                    """
+                c.execute(sql_upsert_tokengroupdocuments, (last_token_id,))
+                sql_update_refreshgroups = """UPDATE token_groups
+                                              SET """+TokenGroupsRefreshSql()+"""
+                                              WHERE id IN (SELECT group_id
+                                                           FROM """+string_tokens_table+"""
+                                                           WHERE id > ?)
+                                              """
+                c.execute(sql_update_refreshgroups, (last_token_id,))
+                self._UpdateTermStatistics(c, dataset_id, "id > ?", (last_token_id,), 1)
+            else:
+                #the store is appended to first so the aggregates can be calculated from the columns, the append is undone if they fail
+                columns = {'field_id': np.full(len(document_ids), field_id),
+                           'document_id': document_ids,
+                           'position': tokens.columns['position'],
+                           'text_id': text_ids,
+                           'stem_id': stem_ids,
+                           'lemma_id': lemma_ids,
+                           'pos_id': pos_ids,
+                           'spacy_stopword': spacy_stopwords,
+                           'group_id': group_ids}
+                store_start = token_store.Append(columns)
+                columns = token_store.Read(store_start)
+                self._InsertColumnsTokenGroupDocuments(c, columns)
+                self._UpdateColumnsTermStatistics(c, dataset_id, columns, 1)
+                del columns
             c.execute("COMMIT")
             c.close()
-        except sqlite3.Error as e:
+        except (sqlite3.Error, OSError) as e:
             logger.exception("sql failed with error")
+            self.__conn.rollback()
+            if store_start is not None:
+                token_store.Truncate(store_start)
         finally:
             self.__conn.isolation_level = old_isolation_level
         logger.info("Finished")
 
+    def _InternVocabulary(self, c, vocabulary_table, terms):
+        #adds any new terms to the vocabulary and returns the id of every term
+        sql_insert_terms = """INSERT OR IGNORE INTO """+vocabulary_table+""" (term)
+                              VALUES (?)"""
+        c.executemany(sql_insert_terms, [(term,) for term in terms])
+        sql_select_termid = """SELECT id
+                               FROM """+vocabulary_table+"""
+                               WHERE term = ?
+                               """
+        term_ids = {}
+        for term in terms:
+            c.execute(sql_select_termid, (term,))
+            term_ids[term] = c.fetchone()[0]
+        return term_ids
+
+    def _InternTermIndexes(self, c, vocabulary_table, terms, term_indexes):
+        #interns the terms referenced by an array of indexes into terms and returns an array of the matching term ids
+        unique_indexes, inverse = np.unique(term_indexes, return_inverse=True)
+        unique_terms = [terms[term_index] for term_index in unique_indexes.tolist()]
+        term_ids = self._InternVocabulary(c, vocabulary_table, unique_terms)
+        return np.array([term_ids[term] for term in unique_terms], dtype=np.int64)[inverse.reshape(-1)]
+
+    def _UpdateTermStatistics(self, c, dataset_id, tokens_filter_sql, tokens_filter_parameters, direction):
+        #adds (direction 1) or subtracts (direction -1) the dataset's string tokens matched by tokens_filter_sql from the term statistics
+        #and flags their terms as changed so that the next tf-idf update recalculates them
+        for token_type in TOKEN_TYPES:
+            word_column, vocabulary_table = TokenTypeVocabulary(token_type)
+            sql_upsert_termdocumentstatistics = """INSERT INTO term_document_statistics (
+                                                        dataset_id,
+                                                        token_type,
+                                                        term_id,
+                                                        document_id,
+                                                        tf
+                                                        )
+                                                   SELECT dataset_id,
+                                                          ?,
+                                                          """+word_column+""",
+                                                          document_id,
+                                                          ? * COUNT(*)
+                                                   FROM """+StringTokensTable(dataset_id)+"""
+                                                   WHERE """+tokens_filter_sql+"""
+                                                   GROUP BY dataset_id, """+word_column+""", document_id
+                                                   ON CONFLICT(dataset_id, token_type, term_id, document_id)
+                                                   DO UPDATE SET tf = tf + excluded.tf
+                                                   """
+            c.execute(sql_upsert_termdocumentstatistics, (token_type, direction,)+tuple(tokens_filter_parameters))
+            sql_upsert_termstatistics = """INSERT INTO term_statistics (
+                                                dataset_id,
+                                                token_type,
+                                                term_id
+                                                )
+                                           SELECT DISTINCT dataset_id,
+                                                  ?,
+                                                  """+word_column+"""
+                                           FROM """+StringTokensTable(dataset_id)+"""
+                                           WHERE """+tokens_filter_sql+"""
+                                           ON CONFLICT(dataset_id, token_type, term_id)
+                                           DO UPDATE SET changed = 1
+                                           """
+            c.execute(sql_upsert_termstatistics, (token_type,)+tuple(tokens_filter_parameters))
+
+    def _UpdateColumnsTermStatistics(self, c, dataset_id, columns, direction):
+        #same as _UpdateTermStatistics for tokens read from a dataset's columnar token store
+        for token_type in TOKEN_TYPES:
+            word_column, vocabulary_table = TokenTypeVocabulary(token_type)
+            term_ids, document_ids, counts = TokenStore.GroupCounts(columns[word_column], columns['document_id'])
+            sql_upsert_termdocumentstatistics = """INSERT INTO term_document_statistics (
+                                                        dataset_id,
+                                                        token_type,
+                                                        term_id,
+                                                        document_id,
+                                                        tf
+                                                        ) VALUES (?,?,?,?,?)
+                                                   ON CONFLICT(dataset_id, token_type, term_id, document_id)
+                                                   DO UPDATE SET tf = tf + excluded.tf
+                                                   """
+            c.executemany(sql_upsert_termdocumentstatistics, zip([dataset_id]*len(counts), [token_type]*len(counts), term_ids.tolist(), document_ids.tolist(), (direction*counts).tolist()))
+            sql_upsert_termstatistics = """INSERT INTO term_statistics (
+                                                dataset_id,
+                                                token_type,
+                                                term_id
+                                                ) VALUES (?,?,?)
+                                           ON CONFLICT(dataset_id, token_type, term_id)
+                                           DO UPDATE SET changed = 1
+                                           """
+            c.executemany(sql_upsert_termstatistics, [(dataset_id, token_type, term_id,) for term_id in np.unique(term_ids).tolist()])
+
+    def _InsertColumnsTokenGroupDocuments(self, c, columns):
+        #counts new tokens read from a dataset's columnar token store into their groups' documents and flags the groups for refreshing
+        group_ids, document_ids, counts = TokenStore.GroupCounts(columns['group_id'], columns['document_id'])
+        sql_upsert_tokengroupdocuments = """INSERT INTO token_group_documents (
+                                                group_id,
+                                                document_id,
+                                                token_count
+                                                ) VALUES (?,?,?)
+                                            ON CONFLICT(group_id, document_id)
+                                            DO UPDATE SET token_count = token_count + excluded.token_count
+                                            """
+        c.executemany(sql_upsert_tokengroupdocuments, zip(group_ids.tolist(), document_ids.tolist(), counts.tolist()))
+        sql_update_refreshgroups = """UPDATE token_groups
+                                      SET """+TokenGroupsRefreshSql()+"""
+                                      WHERE id = ?
+                                      """
+        c.executemany(sql_update_refreshgroups, [(group_id,) for group_id in np.unique(group_ids).tolist()])
+
+    def _InternTokenGroups(self, c, dataset_id, field_id, group_keys):
+        #adds any new token groups to the field and returns the id of every group
+        sql_insert_groups = """INSERT OR IGNORE INTO token_groups (
+                                    dataset_id,
+                                    field_id,
+                                    text_id,
+                                    stem_id,
+                                    lemma_id,
+                                    pos_id,
+                                    spacy_stopword
+                                    ) VALUES (?,?,?,?,?,?,?)"""
+        c.executemany(sql_insert_groups, [(dataset_id, field_id,)+group_key for group_key in group_keys])
+        sql_select_groupid = """SELECT id
+                                FROM token_groups
+                                WHERE field_id = ?
+                                AND text_id = ?
+                                AND stem_id = ?
+                                AND lemma_id = ?
+                                AND pos_id = ?
+                                AND spacy_stopword = ?
+                                """
+        group_ids = {}
+        for group_key in group_keys:
+            c.execute(sql_select_groupid, (field_id,)+group_key)
+            group_ids[group_key] = c.fetchone()[0]
+        return group_ids
+
+    @WriteOperation
     def UpdateStringTokensTFIDF(self, dataset_key):
         logger = logging.getLogger(__name__+".UpdateStringTokensTFIDF")
         logger.info("Starting")
         try:
             c = self.__conn.cursor()
 
-            self.__conn.create_function('log', 1, math.log)
-
-            sql_select_datasetid = """SELECT id
-                                      FROM datasets 
-                                      WHERE dataset_key = ?
-                                      """
-            c.execute(sql_select_datasetid, (str(dataset_key),))
-            dataset_id = c.fetchone()[0]
+            sql_select_dataset = """SELECT id, tfidf_document_count
+                                    FROM datasets 
+                                    WHERE dataset_key = ?
+                                    """
+            c.execute(sql_select_dataset, (str(dataset_key),))
+            result = c.fetchone()
+            dataset_id = result[0]
+            tfidf_document_count = result[1]
 
             sql_select_documentscount = """SELECT COUNT(DISTINCT document_key)
                                            FROM documents
@@ -463,134 +1685,113 @@ class DatabaseConnection():
             c.execute(sql_select_documentscount, (dataset_id,))
             document_count = c.fetchone()[0]
 
-            #1) For Text
-            sql_texttf = """SELECT dataset_id,
-                                   text,
-                                   document_id,
-                                   COUNT(*) as tf
-                            FROM string_tokens
-                            WHERE dataset_id = :dataset_id
-                            GROUP BY dataset_id, text, document_id
-                            """
-
-            sql_textidf = """SELECT dataset_id,
-                                    text,
-                                    log(CAST(:document_count as REAL)/COUNT(DISTINCT document_id)) as idf
-                             FROM string_tokens
-                             WHERE dataset_id = :dataset_id
-                             GROUP BY dataset_id, text
-                             """
-
-            sql_update_texttfidf = """UPDATE string_tokens
-                                      SET text_tfidf = tmp_tfidf.tfidf
-                                      FROM (SELECT text_tf.dataset_id AS dataset_id,
-                                                   text_tf.text AS text ,
-                                                   text_tf.document_id AS document_id,
-                                                   text_tf.tf * text_idf.idf AS tfidf
-                                            FROM ("""+sql_texttf+""") AS text_tf
-                                            JOIN ("""+sql_textidf+""") AS text_idf
-                                            ON text_tf.text = text_idf.text
-                                            ) AS tmp_tfidf
-                                      WHERE string_tokens.dataset_id = tmp_tfidf.dataset_id
-                                      AND string_tokens.text = tmp_tfidf.text
-                                      AND string_tokens.document_id = tmp_tfidf.document_id
-                                      """
-            c.execute(sql_update_texttfidf, {'dataset_id':dataset_id, 'document_count': document_count})
-            logger.info("Updated Text tf-idf")
-
-            #2) for Stem
-            sql_stemtf = """SELECT dataset_id,
-                                   stem,
-                                   document_id,
-                                   COUNT(*) as tf
-                            FROM string_tokens
-                            WHERE dataset_id = :dataset_id
-                            GROUP BY dataset_id, stem, document_id
-                            """
-
-            sql_stemidf = """SELECT dataset_id,
-                                    stem,
-                                    log(CAST(:document_count as REAL)/COUNT(DISTINCT document_id)) as idf
-                             FROM string_tokens
-                             WHERE dataset_id = :dataset_id
-                             GROUP BY dataset_id, stem
-                             """
-
-            sql_update_stemtfidf = """UPDATE string_tokens
-                                      SET stem_tfidf = tmp_tfidf.tfidf
-                                      FROM (SELECT stem_tf.dataset_id AS dataset_id,
-                                                   stem_tf.stem AS stem ,
-                                                   stem_tf.document_id AS document_id,
-                                                   stem_tf.tf * stem_idf.idf AS tfidf
-                                            FROM ("""+sql_stemtf+""") AS stem_tf
-                                            JOIN ("""+sql_stemidf+""") AS stem_idf
-                                            ON stem_tf.stem = stem_idf.stem
-                                            ) AS tmp_tfidf
-                                      WHERE string_tokens.dataset_id = tmp_tfidf.dataset_id
-                                      AND string_tokens.stem = tmp_tfidf.stem
-                                      AND string_tokens.document_id = tmp_tfidf.document_id
-                                      """
-            c.execute(sql_update_stemtfidf, {'dataset_id':dataset_id, 'document_count': document_count})
-            logger.info("Updated Stem tf-idf")
-
-            #3) For Lemma
-            sql_lemmatf = """SELECT dataset_id,
-                                    lemma,
-                                    document_id,
-                                    COUNT(*) as tf
-                             FROM string_tokens
-                             WHERE dataset_id = :dataset_id
-                             GROUP BY dataset_id, lemma, document_id
-                            """
-            
-            sql_lemmaidf = """SELECT dataset_id,
-                                     lemma,
-                                     log(CAST(:document_count as REAL)/COUNT(DISTINCT document_id)) as idf
-                              FROM string_tokens
-                              WHERE dataset_id = :dataset_id
-                              GROUP BY dataset_id, lemma
-                              """
-
-            sql_update_lemmatfidf = """UPDATE string_tokens
-                                       SET lemma_tfidf = tmp_tfidf.tfidf
-                                       FROM (SELECT lemma_tf.dataset_id AS dataset_id,
-                                                    lemma_tf.lemma AS lemma ,
-                                                    lemma_tf.document_id AS document_id,
-                                                    lemma_tf.tf * lemma_idf.idf AS tfidf
-                                             FROM ("""+sql_lemmatf+""") AS lemma_tf
-                                             JOIN ("""+sql_lemmaidf+""") AS lemma_idf
-                                             ON lemma_tf.lemma = lemma_idf.lemma
-                                             ) AS tmp_tfidf
-                                       WHERE string_tokens.dataset_id = tmp_tfidf.dataset_id
-                                       AND string_tokens.lemma = tmp_tfidf.lemma
-                                       AND string_tokens.document_id = tmp_tfidf.document_id
+            #the idf of every term depends on the number of documents
+            if tfidf_document_count != document_count:
+                sql_update_allterms = """UPDATE term_statistics
+                                         SET changed = 1
+                                         WHERE dataset_id = ?
+                                         """
+                c.execute(sql_update_allterms, (dataset_id,))
+
+            sql_changed_terms = """SELECT token_type,
+                                          term_id
+                                   FROM term_statistics
+                                   WHERE dataset_id = :dataset_id
+                                   AND changed = 1
+                                   """
+
+            sql_delete_emptytermdocuments = """DELETE FROM term_document_statistics
+                                               WHERE dataset_id = :dataset_id
+                                               AND tf <= 0
+                                               AND (token_type, term_id) IN ("""+sql_changed_terms+""")
+                                               """
+            c.execute(sql_delete_emptytermdocuments, {'dataset_id':dataset_id})
+
+            sql_update_documentfrequency = """UPDATE term_statistics
+                                              SET document_frequency = (SELECT COUNT(*)
+                                                                        FROM term_document_statistics
+                                                                        WHERE term_document_statistics.dataset_id = term_statistics.dataset_id
+                                                                        AND term_document_statistics.token_type = term_statistics.token_type
+                                                                        AND term_document_statistics.term_id = term_statistics.term_id)
+                                              WHERE dataset_id = :dataset_id
+                                              AND changed = 1
+                                              """
+            c.execute(sql_update_documentfrequency, {'dataset_id':dataset_id})
+
+            #one pass over the changed terms' statistics calculates tf-idf for all token types
+            sql_update_termdocumenttfidf = """UPDATE term_document_statistics
+                                              SET tfidf = tf * log(CAST(:document_count as REAL)/term_statistics.document_frequency)
+                                              FROM term_statistics
+                                              WHERE term_statistics.dataset_id = :dataset_id
+                                              AND term_statistics.changed = 1
+                                              AND term_document_statistics.dataset_id = term_statistics.dataset_id
+                                              AND term_document_statistics.token_type = term_statistics.token_type
+                                              AND term_document_statistics.term_id = term_statistics.term_id
+                                              """
+            c.execute(sql_update_termdocumenttfidf, {'dataset_id':dataset_id, 'document_count': document_count})
+            logger.info("Updated term tf-idf")
+
+            #the tf-idf ranges shown for the changed terms of each token type need refreshing
+            for token_type in TOKEN_TYPES:
+                word_column, vocabulary_table = TokenTypeVocabulary(token_type)
+                included_column, refresh_included_column, refresh_removed_column = TokenTypeInclusion(token_type)
+                sql_update_refreshgroups = """UPDATE token_groups
+                                              SET """+refresh_included_column+""" = 1,
+                                                  """+refresh_removed_column+""" = 1
+                                              WHERE dataset_id = :dataset_id
+                                              AND """+word_column+""" IN (SELECT term_id
+                                                                FROM term_statistics
+                                                                WHERE dataset_id = :dataset_id
+                                                                AND token_type = :token_type
+                                                                AND changed = 1)
+                                              """
+                c.execute(sql_update_refreshgroups, {'dataset_id':dataset_id, 'token_type':token_type})
+
+            sql_delete_emptyterms = """DELETE FROM term_statistics
+                                       WHERE dataset_id = ?
+                                       AND changed = 1
+                                       AND document_frequency = 0
                                        """
-            c.execute(sql_update_lemmatfidf, {'dataset_id':dataset_id, 'document_count': document_count})
-            logger.info("Updated Lemma tf-idf")
+            c.execute(sql_delete_emptyterms, (dataset_id,))
+            sql_update_changedterms = """UPDATE term_statistics
+                                         SET changed = 0
+                                         WHERE dataset_id = ?
+                                         AND changed = 1
+                                         """
+            c.execute(sql_update_changedterms, (dataset_id,))
+            sql_update_dataset = """UPDATE datasets
+                                    SET tfidf_document_count = ?
+                                    WHERE id = ?
+                                    """
+            c.execute(sql_update_dataset, (document_count, dataset_id,))
 
             self.__conn.commit()
             c.close()
         except sqlite3.Error as e:
             logger.exception("sql failed with error")
+            self.__conn.rollback()
         logger.info("Finished")
 
     def _RuleGroupSqlCreator(self, rule_action, rule_group, dataset_id, token_type):
+        #returns the list of sql statements and their parameters that apply a group of rules sharing the same action
+        word_column, vocabulary_table = TokenTypeVocabulary(token_type)
+        included_column, refresh_included_column, refresh_removed_column = TokenTypeInclusion(token_type)
 
         #filter sql
-        word_sql = """CASE ?
-                      WHEN 'stem' THEN stem
-                      WHEN 'lemma' THEN lemma
-                      ELSE text
-                      END = ?
+        word_sql = """token_groups."""+word_column+""" = (SELECT id
+                                                        FROM """+vocabulary_table+"""
+                                                        WHERE term = ?)
                       """
-        pos_sql = """pos = ?
+        pos_sql = """token_groups.pos_id = (SELECT id
+                                            FROM pos_vocabulary
+                                            WHERE term = ?)
                      """
-        field_sql = """field_id = (SELECT id
-                                   FROM fields
-                                   WHERE fields.dataset_id = dataset_id
-                                   AND field_key = ?)
+        field_sql = """token_groups.field_id = (SELECT id
+                                                FROM fields
+                                                WHERE fields.dataset_id = token_groups.dataset_id
+                                                AND field_key = ?)
                        """
-        stopword_sql = """spacy_stopword = 1
+        stopword_sql = """token_groups.spacy_stopword = 1
                           """
 
         sql_type_filters_list = []
@@ -599,7 +1800,6 @@ class DatabaseConnection():
             sql_filter_list = []
             if word != Constants.FILTER_RULE_ANY:
                 sql_filter_list.append(word_sql)
-                sql_type_filters_parameters.append(token_type)
                 sql_type_filters_parameters.append(word)
             if pos != Constants.FILTER_RULE_ANY:
                 sql_filter_list.append(pos_sql)
@@ -612,180 +1812,229 @@ class DatabaseConnection():
             sql_filter = " AND ".join(sql_filter_list)
             sql_type_filters_list.append(sql_filter)
         sql_filters = " OR ".join(sql_type_filters_list)
-
-
-        update_sql = """UPDATE string_tokens
-                        SET included = ?
-                        WHERE dataset_id = ?
-                        AND included = ?
-                        """
-            
-
-        query_totalwordcount_sql = """SELECT COUNT(*),
-                                    FROM string_tokens
-                                    WHERE dataset_id = ?
-                                    """
+        if sql_filters != "":
+            sql_filters = "AND ("+sql_filters+")"
+
+        #a token's included value is its group's value unless a tf-idf rule stored an exception for its document
+        groupdocuments_sql = """FROM token_groups
+                                JOIN token_group_documents ON
+                                     token_group_documents.group_id = token_groups.id
+                                LEFT JOIN token_group_overrides ON
+                                          token_group_overrides.dataset_id = token_groups.dataset_id
+                                          AND token_group_overrides.token_type = ?
+                                          AND token_group_overrides.group_id = token_groups.id
+                                          AND token_group_overrides.document_id = token_group_documents.document_id
+                                """
+        groupdocuments_included_sql = """COALESCE(token_group_overrides.included, token_groups."""+included_column+""")"""
+
+        #rules that change every token of the groups they match
+        #groups are only flagged for refreshing when their tokens actually change
+        update_groups_sql = """UPDATE token_groups
+                               SET """+included_column+""" = ?,
+                                   """+refresh_included_column+""" = 1,
+                                   """+refresh_removed_column+""" = 1
+                               WHERE dataset_id = ?
+                               AND ("""+included_column+""" != ?
+                                    OR id IN (SELECT group_id
+                                              FROM token_group_overrides
+                                              WHERE dataset_id = ?
+                                              AND token_type = ?))
+                               """
+        delete_groupsoverrides_sql = """DELETE FROM token_group_overrides
+                                        WHERE dataset_id = ?
+                                        AND token_type = ?
+                                        AND group_id IN (SELECT id
+                                                         FROM token_groups
+                                                         WHERE dataset_id = ?
+                                                         """
+
+        query_totalwordcount_sql = """SELECT SUM(token_count)
+                                      FROM token_group_documents
+                                      WHERE group_id IN (SELECT id
+                                                         FROM token_groups
+                                                         WHERE dataset_id = ?)
+                                      """
         query_totaldoccount_sql = """SELECT COUNT(DISTINCT document_id)
-                                    FROM string_tokens
-                                    WHERE dataset_id = ?
-                                    """
+                                     FROM token_group_documents
+                                     WHERE group_id IN (SELECT id
+                                                        FROM token_groups
+                                                        WHERE dataset_id = ?)
+                                     """
 
         #special sql code user to figure out tfidf positions
-        update_tfidflowerper_sql = """UPDATE string_tokens
-                                      SET included = ?
-                                      FROM (SELECT id, 
-                                            PERCENT_RANK() OVER(ORDER BY CASE ?
-                                                                         WHEN 'stem' THEN stem_tfidf
-                                                                         WHEN 'lemma' THEN lemma_tfidf
-                                                                         ELSE text_tfidf
-                                                                         END ASC
-                                                               ) AS per_rank
-                                            FROM string_tokens
-                                            WHERE dataset_id = ?
-                                           ) AS ranktable
-                                      WHERE ranktable.id = string_tokens.id
-                                      AND included = ?
-                                      AND per_rank < ?
-                                      """
-        
-        update_tfidfupperper_sql = """UPDATE string_tokens
-                                      SET included = ?
-                                      FROM (SELECT id, 
-                                            PERCENT_RANK() OVER(ORDER BY CASE ?
-                                                                         WHEN 'stem' THEN stem_tfidf
-                                                                         WHEN 'lemma' THEN lemma_tfidf
-                                                                         ELSE text_tfidf
-                                                                         END DESC
-                                                               ) AS per_rank
-                                            FROM string_tokens
-                                            WHERE dataset_id = ?
-                                           ) AS ranktable
-                                        WHERE ranktable.id = string_tokens.id
-                                        AND included = ?
-                                        AND per_rank < ?
+        #the rank of a term's document is weighted by its tf so that it matches the rank every one of its tokens would have
+        insert_tfidfmatches_sql1 = """INSERT INTO temp.rule_matched_groups (
+                                            group_id,
+                                            document_id
+                                            )
+                                        SELECT token_groups.id,
+                                               token_group_documents.document_id
+                                        FROM (SELECT token_type,
+                                                     term_id,
+                                                     document_id,
+                                                     CASE WHEN SUM(tf) OVER () > 1
+                                                          THEN IFNULL(SUM(tf) OVER (ORDER BY tfidf """
+        insert_tfidfmatches_sql2 = """ GROUPS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0)*1.0/(SUM(tf) OVER () - 1)
+                                                          ELSE 0
+                                                          END AS per_rank
+                                              FROM term_document_statistics
+                                              WHERE dataset_id = ?
+                                              AND token_type = ?
+                                              ) AS ranktable
+                                        JOIN token_groups ON
+                                             token_groups.dataset_id = ?
+                                             AND token_groups."""+word_column+""" = ranktable.term_id
+                                        JOIN token_group_documents ON
+                                             token_group_documents.group_id = token_groups.id
+                                             AND token_group_documents.document_id = ranktable.document_id
+                                        LEFT JOIN token_group_overrides ON
+                                                  token_group_overrides.dataset_id = token_groups.dataset_id
+                                                  AND token_group_overrides.token_type = ranktable.token_type
+                                                  AND token_group_overrides.group_id = token_groups.id
+                                                  AND token_group_overrides.document_id = token_group_documents.document_id
+                                        WHERE ranktable.per_rank < ?
+                                        AND """+groupdocuments_included_sql+""" = ?
                                         """
 
+        insert_tfidfoverrides_sql = """INSERT OR REPLACE INTO token_group_overrides (
+                                            dataset_id,
+                                            token_type,
+                                            group_id,
+                                            document_id,
+                                            included
+                                            )
+                                       SELECT ?,
+                                              ?,
+                                              group_id,
+                                              document_id,
+                                              ?
+                                       FROM temp.rule_matched_groups
+                                       """
+        update_tfidfgroups_sql = """UPDATE token_groups
+                                    SET """+refresh_included_column+""" = 1,
+                                        """+refresh_removed_column+""" = 1
+                                    WHERE id IN (SELECT group_id
+                                                 FROM temp.rule_matched_groups)
+                                    """
+
+        #matches depend on the included values so they are found before any of them are changed
+        create_matches_sql = """CREATE TEMP TABLE IF NOT EXISTS rule_matched_groups (
+                                    group_id INTEGER,
+                                    document_id INTEGER
+                                    )"""
+        delete_matches_sql = """DELETE FROM temp.rule_matched_groups"""
+
         #special code needed for number filters
-        update_count_sql1 = """UPDATE string_tokens
-                            SET included = ?
-                            FROM (
-                            """
-        subquery_count_sql2 = """GROUP BY CASE ?
-                                        WHEN 'stem' THEN stem
-                                        WHEN 'lemma' THEN lemma
-                                        ELSE text
-                                        END,
-                                        pos
+        insert_countmatches_sql1 = """INSERT INTO temp.rule_matched_groups (group_id)
+                                      SELECT token_groups.id
+                                      FROM token_groups
+                                      JOIN (
+                                      """
+        subquery_count_sql2 = """GROUP BY token_groups."""+word_column+""",
+                                          token_groups.pos_id
                                 """
-        subquery_wordcount_sql1 = """SELECT CASE ?
-                                            WHEN 'stem' THEN stem
-                                            WHEN 'lemma' THEN lemma
-                                            ELSE text
-                                            END word,
-                                            pos,
-                                            COUNT(*) AS count
-                                    FROM string_tokens
-                                    WHERE dataset_id = ?
-                                    AND included = ?
+        subquery_wordcount_sql1 = """SELECT token_groups."""+word_column+""" AS word_id,
+                                            token_groups.pos_id AS pos_id,
+                                            SUM(token_group_documents.token_count) AS count
+                                     """+groupdocuments_sql+"""
+                                     WHERE token_groups.dataset_id = ?
+                                     AND """+groupdocuments_included_sql+""" = ?
+                                     """
+        subquery_doccount_sql1 = """SELECT token_groups."""+word_column+""" AS word_id,
+                                           token_groups.pos_id AS pos_id,
+                                           COUNT(DISTINCT token_group_documents.document_id) AS count
+                                    """+groupdocuments_sql+"""
+                                    WHERE token_groups.dataset_id = ?
+                                    AND """+groupdocuments_included_sql+""" = ?
                                     """
-        subquery_doccount_sql1 = """SELECT CASE ?
-                                        WHEN 'stem' THEN stem
-                                        WHEN 'lemma' THEN lemma
-                                        ELSE text
-                                        END word,
-                                        pos,
-                                        COUNT(DISTINCT document_id) AS count
-                                    FROM string_tokens
-                                    WHERE dataset_id = ?
-                                    AND included = ?
+        insert_countmatches_sql2 = """) AS counttable ON
+                                           counttable.word_id = token_groups."""+word_column+"""
+                                           AND counttable.pos_id = token_groups.pos_id
+                                      WHERE token_groups.dataset_id = ?
+                                      """
+        update_countgroups_sql = """UPDATE token_groups
+                                    SET """+included_column+""" = ?,
+                                        """+refresh_included_column+""" = 1,
+                                        """+refresh_removed_column+""" = 1
+                                    WHERE id IN (SELECT group_id
+                                                 FROM temp.rule_matched_groups)
+                                    AND ("""+included_column+""" != ?
+                                         OR id IN (SELECT group_id
+                                                   FROM token_group_overrides
+                                                   WHERE dataset_id = ?
+                                                   AND token_type = ?))
                                     """
-        update_count_sql2 = """) AS counttable
-                            WHERE dataset_id = ?
-                            AND included = ?
-                            AND counttable.word = CASE ?
-                                                    WHEN 'stem' THEN stem
-                                                    WHEN 'lemma' THEN lemma
-                                                    ELSE text
-                                                    END
-                            AND counttable.pos = string_tokens.pos
-                            AND counttable.count"""
+        delete_countoverrides_sql = """DELETE FROM token_group_overrides
+                                       WHERE dataset_id = ?
+                                       AND token_type = ?
+                                       AND group_id IN (SELECT group_id
+                                                        FROM temp.rule_matched_groups)
+                                       """
 
         #number filter symbol
-        gt_sql = """ > ?
+        gt_sql = """AND counttable.count > ?
                     """
-        gteq_sql = """ >= ?
+        gteq_sql = """AND counttable.count >= ?
                     """
-        eq_sql = """ = ?
+        eq_sql = """AND counttable.count = ?
                     """
-        lteq_sql = """ <= ?
+        lteq_sql = """AND counttable.count <= ?
                     """
-        lt_sql = """ < ?
+        lt_sql = """AND counttable.count < ?
                     """
 
         #Action sql
-        sql_action = ""
-        sql_action_parameters = []
-        if rule_action == Constants.FILTER_RULE_REMOVE:
-            sql_action = update_sql
-            sql_action_parameters.append(0)
-            sql_action_parameters.append(dataset_id)
-            sql_action_parameters.append(1)
-        elif rule_action == Constants.FILTER_RULE_INCLUDE:
-            sql_action = update_sql
-            sql_action_parameters.append(1)
-            sql_action_parameters.append(dataset_id)
-            sql_action_parameters.append(0)
+        sql_statements = []
+        if rule_action == Constants.FILTER_RULE_REMOVE or rule_action == Constants.FILTER_RULE_INCLUDE:
+            if rule_action == Constants.FILTER_RULE_REMOVE:
+                new_included = 0
+            else:
+                new_included = 1
+            sql_statements.append((update_groups_sql+sql_filters,
+                                   [new_included, dataset_id, new_included, dataset_id, token_type]+sql_type_filters_parameters))
+            sql_statements.append((delete_groupsoverrides_sql+sql_filters+")",
+                                   [dataset_id, token_type, dataset_id]+sql_type_filters_parameters))
         elif isinstance(rule_action, tuple):
-            if rule_action[0] == Constants.FILTER_TFIDF_REMOVE:
-                sql_action_parameters.append(0)
-                sql_action_parameters.append(token_type)
-                sql_action_parameters.append(dataset_id)
-                sql_action_parameters.append(1)
-                sql_action_parameters.append(rule_action[2]/100)
-                if rule_action[1] == Constants.FILTER_TFIDF_LOWER:
-                    sql_action = update_tfidflowerper_sql
-                elif rule_action[1] == Constants.FILTER_TFIDF_UPPER:
-                    sql_action = update_tfidfupperper_sql
-            elif rule_action[0] == Constants.FILTER_TFIDF_INCLUDE:
-                sql_action_parameters.append(1)
-                sql_action_parameters.append(token_type)
-                sql_action_parameters.append(dataset_id)
-                sql_action_parameters.append(0)
-                sql_action_parameters.append(rule_action[2]/100)
+            if rule_action[0] == Constants.FILTER_TFIDF_REMOVE or rule_action[0] == Constants.FILTER_TFIDF_INCLUDE:
+                if rule_action[0] == Constants.FILTER_TFIDF_REMOVE:
+                    new_included = 0
+                    apply_to_included = 1
+                else:
+                    new_included = 1
+                    apply_to_included = 0
                 if rule_action[1] == Constants.FILTER_TFIDF_LOWER:
-                    sql_action = update_tfidflowerper_sql
+                    sql_action = insert_tfidfmatches_sql1+"ASC"+insert_tfidfmatches_sql2
                 elif rule_action[1] == Constants.FILTER_TFIDF_UPPER:
-                    sql_action = update_tfidfupperper_sql
+                    sql_action = insert_tfidfmatches_sql1+"DESC"+insert_tfidfmatches_sql2
+                sql_statements.append((create_matches_sql, []))
+                sql_statements.append((delete_matches_sql, []))
+                sql_statements.append((sql_action+sql_filters,
+                                       [dataset_id, token_type, dataset_id, rule_action[2]/100, apply_to_included]+sql_type_filters_parameters))
+                sql_statements.append((insert_tfidfoverrides_sql, [dataset_id, token_type, new_included]))
+                sql_statements.append((update_tfidfgroups_sql, []))
             elif rule_action[0] == Constants.FILTER_RULE_REMOVE or rule_action[0] == Constants.FILTER_RULE_INCLUDE:
                 if rule_action[0] == Constants.FILTER_RULE_REMOVE:
-                    sql_action_parameters.append(0)
+                    new_included = 0
                     apply_to_included = 1
                 else:
-                    sql_action_parameters.append(1)
+                    new_included = 1
                     apply_to_included = 0
-                sql_action_parameters.append(token_type)
-                sql_action_parameters.append(dataset_id)
-                sql_action_parameters.append(apply_to_included)
-                sql_action_parameters = sql_action_parameters + sql_type_filters_parameters
-                sql_action_parameters.append(token_type)
-                sql_action_parameters.append(dataset_id)
-                sql_action_parameters.append(apply_to_included)
-                sql_action_parameters.append(token_type)
+                sql_action_parameters = [token_type, dataset_id, apply_to_included]+sql_type_filters_parameters+[dataset_id]+sql_type_filters_parameters
 
                 if rule_action[1] == Constants.TOKEN_NUM_WORDS:
-                    sql_action = update_count_sql1+subquery_wordcount_sql1+sql_filters+subquery_count_sql2+update_count_sql2
+                    sql_action = insert_countmatches_sql1+subquery_wordcount_sql1+sql_filters+subquery_count_sql2+insert_countmatches_sql2+sql_filters
                     sql_action_parameters.append(rule_action[3])
                 elif rule_action[1] == Constants.TOKEN_PER_WORDS:
-                    sql_action = update_count_sql1+subquery_wordcount_sql1+sql_filters+subquery_count_sql2+update_count_sql2
+                    sql_action = insert_countmatches_sql1+subquery_wordcount_sql1+sql_filters+subquery_count_sql2+insert_countmatches_sql2+sql_filters
                     #TODO rework to not need seperate sql call
                     c = self.__conn.execute(query_totalwordcount_sql, (dataset_id,))
-                    total_words = c.fetchone()[0]
+                    total_words = c.fetchone()[0] or 0
                     sql_action_parameters.append(rule_action[3]/100*total_words)
                 elif rule_action[1] == Constants.TOKEN_NUM_DOCS:
-                    sql_action = update_count_sql1+subquery_doccount_sql1+sql_filters+subquery_count_sql2+update_count_sql2
+                    sql_action = insert_countmatches_sql1+subquery_doccount_sql1+sql_filters+subquery_count_sql2+insert_countmatches_sql2+sql_filters
                     sql_action_parameters.append(rule_action[3])
                 elif rule_action[1] == Constants.TOKEN_PER_DOCS:
-                    sql_action = update_count_sql1+subquery_doccount_sql1+sql_filters+subquery_count_sql2+update_count_sql2
+                    sql_action = insert_countmatches_sql1+subquery_doccount_sql1+sql_filters+subquery_count_sql2+insert_countmatches_sql2+sql_filters
                     #TODO rework to not need seperate sql call
                     c = self.__conn.execute(query_totaldoccount_sql, (dataset_id,))
                     total_docs = c.fetchone()[0]
@@ -802,14 +2051,14 @@ class DatabaseConnection():
                 elif rule_action[2] == "<":
                     sql_action = sql_action + lt_sql
 
-        if sql_filters != "":
-            sql = sql_action+" AND ("+sql_filters+")"
-            sql_parameters = sql_action_parameters + sql_type_filters_parameters
-        else:
-            sql = sql_action
-            sql_parameters = sql_action_parameters
-        return sql, sql_parameters
+                sql_statements.append((create_matches_sql, []))
+                sql_statements.append((delete_matches_sql, []))
+                sql_statements.append((sql_action, sql_action_parameters))
+                sql_statements.append((update_countgroups_sql, [new_included, new_included, dataset_id, token_type]))
+                sql_statements.append((delete_countoverrides_sql, [dataset_id, token_type]))
+        return sql_statements
 
+    @WriteOperation
     def ApplyAllDatasetRules(self, dataset_key, rules):
         logger = logging.getLogger(__name__+".ApplyAllDatasetRules")
         logger.info("Starting")
@@ -819,22 +2068,32 @@ class DatabaseConnection():
             remaining_loops = len(rules)
             estimated_loop_time = timedelta()
             c = self.__conn.cursor()
-            sql_select_dataset = """SELECT id, token_type
+            sql_select_dataset = """SELECT id
                                     FROM datasets 
                                     WHERE dataset_key = ?
                                     """
             c.execute(sql_select_dataset, (str(dataset_key),))
-            result = c.fetchone()
-            dataset_id = result[0]
-            token_type = result[1]
+            dataset_id = c.fetchone()[0]
             
-            update_sql = """UPDATE string_tokens
-                            SET included = ?
+            #reset included to default for all strings of every token type
+            for token_type in TOKEN_TYPES:
+                included_column, refresh_included_column, refresh_removed_column = TokenTypeInclusion(token_type)
+                update_sql = """UPDATE token_groups
+                                SET """+included_column+""" = ?,
+                                    """+refresh_included_column+""" = 1,
+                                    """+refresh_removed_column+""" = 1
+                                WHERE dataset_id = ?
+                                AND ("""+included_column+""" != ?
+                                     OR id IN (SELECT group_id
+                                               FROM token_group_overrides
+                                               WHERE dataset_id = ?
+                                               AND token_type = ?))
+                                """
+                c.execute(update_sql, (1, dataset_id, 1, dataset_id, token_type,))
+            delete_sql = """DELETE FROM token_group_overrides
                             WHERE dataset_id = ?
                             """
-            #reset included to default for all strings
-            c.execute(update_sql, (1, dataset_id,))
-            self.__conn.commit()
+            c.execute(delete_sql, (dataset_id,))
             logger.info("Completed Reseting all tokens to included.")
 
             #apply rules in order
@@ -856,12 +2115,10 @@ class DatabaseConnection():
                 if next_rule_action == cur_rule_action:
                     cur_rule_group.append(rule)
                 else:
-                    sql, sql_parameters = self._RuleGroupSqlCreator(cur_rule_action, cur_rule_group, dataset_id, token_type)
                     #execute the rule group
-                    c.execute(sql, sql_parameters)
-                    #commit after every rule to make sure operations are applied in correct order
-                    #TODO Assess if this is needed
-                    self.__conn.commit()
+                    for token_type in TOKEN_TYPES:
+                        for sql, sql_parameters in self._RuleGroupSqlCreator(cur_rule_action, cur_rule_group, dataset_id, token_type):
+                            c.execute(sql, sql_parameters)
                     new_estimated_loop_time = datetime.now() - start_loop_time
                     if new_estimated_loop_time > estimated_loop_time:
                         estimated_loop_time = new_estimated_loop_time
@@ -878,21 +2135,25 @@ class DatabaseConnection():
                     cur_rule_group = [rule]
             
             if cur_rule_action != None:
-                sql, sql_parameters = self._RuleGroupSqlCreator(cur_rule_action, cur_rule_group, dataset_id, token_type)
                 #execute the rule group
-                c.execute(sql, sql_parameters)
-                self.__conn.commit()
+                for token_type in TOKEN_TYPES:
+                    for sql, sql_parameters in self._RuleGroupSqlCreator(cur_rule_action, cur_rule_group, dataset_id, token_type):
+                        c.execute(sql, sql_parameters)
                 new_msg = GUITextFiltering.FILTERS_APPLYING_RULES_GROUP_MSG
                 for cur_rule in cur_rule_group:
                     new_msg += "\n-- "+str(cur_rule)
                 wx.PostEvent(main_frame, CustomEvents.ProgressEvent({'msg':new_msg}))
                 logger.info("Completed Applying Rule Group containing [%s] rules", str(len(cur_rule_group)))
 
+            #rules only change the small token group tables so all of them are committed together
+            self.__conn.commit()
             c.close()
         except sqlite3.Error as e:
             logger.exception("sql failed with error")
+            self.__conn.rollback()
         logger.info("Finished")
     
+    @WriteOperation
     def ApplyNewDatasetRules(self, dataset_key, new_rules):
         logger = logging.getLogger(__name__+".ApplyNewDatasetRules")
         logger.info("Starting")
@@ -902,14 +2163,12 @@ class DatabaseConnection():
             remaining_loops = len(new_rules)
             estimated_loop_time = timedelta()
             c = self.__conn.cursor()
-            sql_select_dataset = """SELECT id, token_type
+            sql_select_dataset = """SELECT id
                                       FROM datasets 
                                       WHERE dataset_key = ?
                                       """
             c.execute(sql_select_dataset, (str(dataset_key),))
-            result = c.fetchone()
-            dataset_id = result[0]
-            token_type = result[1]
+            dataset_id = c.fetchone()[0]
 
             #apply rules in order
             ##TODO explore if further concatination is possible (i.e. TFIDF removal with pos removal)
@@ -929,12 +2188,10 @@ class DatabaseConnection():
                 if next_rule_action == cur_rule_action:
                     cur_rule_group.append(rule)
                 else:
-                    sql, sql_parameters = self._RuleGroupSqlCreator(cur_rule_action, cur_rule_group, dataset_id, token_type)
                     #execute the rule group
-                    c.execute(sql, sql_parameters)
-                    #commit after every rule to make sure operations are applied in correct order
-                    #TODO Assess if this is needed
-                    self.__conn.commit()
+                    for token_type in TOKEN_TYPES:
+                        for sql, sql_parameters in self._RuleGroupSqlCreator(cur_rule_action, cur_rule_group, dataset_id, token_type):
+                            c.execute(sql, sql_parameters)
                     new_estimated_loop_time = datetime.now() - start_loop_time
                     if new_estimated_loop_time > estimated_loop_time:
                         estimated_loop_time = new_estimated_loop_time
@@ -951,181 +2208,549 @@ class DatabaseConnection():
                     cur_rule_group = [rule]
             
             if cur_rule_action != None:
-                sql, sql_parameters = self._RuleGroupSqlCreator(cur_rule_action, cur_rule_group, dataset_id, token_type)
                 #execute the rule group
-                c.execute(sql, sql_parameters)
-                self.__conn.commit()
+                for token_type in TOKEN_TYPES:
+                    for sql, sql_parameters in self._RuleGroupSqlCreator(cur_rule_action, cur_rule_group, dataset_id, token_type):
+                        c.execute(sql, sql_parameters)
                 new_msg = GUITextFiltering.FILTERS_APPLYING_RULES_GROUP_MSG
                 for cur_rule in cur_rule_group:
                     new_msg += "\n-- "+str(cur_rule)
                 wx.PostEvent(main_frame, CustomEvents.ProgressEvent({'msg':new_msg}))
                 logger.info("Completed Applying Rule Group containing [%s] rules", str(len(cur_rule_group)))
 
+            #rules only change the small token group tables so all of them are committed together
+            self.__conn.commit()
             c.close()
         except sqlite3.Error as e:
             logger.exception("sql failed with error")
+            self.__conn.rollback()
         logger.info("Finished")
 
+    def PreviewDatasetRules(self, dataset_key, rules):
+        '''returns the included counts the dataset would have if its rules were replaced by rules without changing the workspace,
+        the rules are applied to temporary copies of the dataset's token groups that hide the real ones on a connection of its own'''
+        logger = logging.getLogger(__name__+".PreviewDatasetRules")
+        logger.info("Starting")
+        counts = {}
+        try:
+            conn = self.manager.OpenConnection()
+            try:
+                c = conn.cursor()
+                sql_select_dataset = """SELECT id, token_type
+                                        FROM datasets 
+                                        WHERE dataset_key = ?
+                                        """
+                c.execute(sql_select_dataset, (str(dataset_key),))
+                result = c.fetchone()
+                dataset_id = result[0]
+                token_type = result[1]
+                word_column, vocabulary_table = TokenTypeVocabulary(token_type)
+                included_column, refresh_included_column, refresh_removed_column = TokenTypeInclusion(token_type)
+
+                #every group starts included without any overrides, the same as when all of a dataset's rules are applied
+                sql_createtable_tokengroups = """CREATE TEMP TABLE token_groups (
+                                                    id INTEGER PRIMARY KEY,
+                                                    dataset_id INTEGER,
+                                                    field_id INTEGER,
+                                                    text_id INTEGER,
+                                                    stem_id INTEGER,
+                                                    lemma_id INTEGER,
+                                                    pos_id INTEGER,
+                                                    spacy_stopword BOOLEAN,
+                                                    """+included_column+""" BOOLEAN DEFAULT 1,
+                                                    """+refresh_included_column+""" BOOLEAN DEFAULT 1,
+                                                    """+refresh_removed_column+""" BOOLEAN DEFAULT 1
+                                                )"""
+                c.execute(sql_createtable_tokengroups)
+                sql_insert_tokengroups = """INSERT INTO temp.token_groups (
+                                                id,
+                                                dataset_id,
+                                                field_id,
+                                                text_id,
+                                                stem_id,
+                                                lemma_id,
+                                                pos_id,
+                                                spacy_stopword
+                                                )
+                                            SELECT id,
+                                                   dataset_id,
+                                                   field_id,
+                                                   text_id,
+                                                   stem_id,
+                                                   lemma_id,
+                                                   pos_id,
+                                                   spacy_stopword
+                                            FROM main.token_groups
+                                            WHERE dataset_id = ?
+                                            """
+                c.execute(sql_insert_tokengroups, (dataset_id,))
+                c.execute("""CREATE INDEX temp.token_groups_word_index ON token_groups(dataset_id, """+word_column+""")""")
+                sql_createtable_tokengroupoverrides = """CREATE TEMP TABLE token_group_overrides (
+                                                            dataset_id INTEGER,
+                                                            token_type TEXT,
+                                                            group_id INTEGER,
+                                                            document_id INTEGER,
+                                                            included BOOLEAN,
+                                                            PRIMARY KEY(dataset_id, token_type, group_id, document_id)
+                                                        ) WITHOUT ROWID"""
+                c.execute(sql_createtable_tokengroupoverrides)
+
+                #rules are grouped the same way ApplyAllDatasetRules groups them
+                cur_rule_action = None
+                cur_rule_group = []
+                for rule in rules:
+                    next_rule_action = rule[3]
+                    if next_rule_action == Constants.FILTER_RULE_REMOVE_SPACY_AUTO_STOPWORDS:
+                        next_rule_action = Constants.FILTER_RULE_REMOVE
+                    elif next_rule_action == Constants.FILTER_RULE_INCLUDE_SPACY_AUTO_STOPWORDS:
+                        next_rule_action = Constants.FILTER_RULE_INCLUDE
+                    if cur_rule_action == None:
+                        cur_rule_action = next_rule_action
+                    if next_rule_action == cur_rule_action:
+                        cur_rule_group.append(rule)
+                    else:
+                        for sql, sql_parameters in self._RuleGroupSqlCreator(cur_rule_action, cur_rule_group, dataset_id, token_type):
+                            c.execute(sql, sql_parameters)
+                        cur_rule_action = next_rule_action
+                        cur_rule_group = [rule]
+                if cur_rule_action != None:
+                    for sql, sql_parameters in self._RuleGroupSqlCreator(cur_rule_action, cur_rule_group, dataset_id, token_type):
+                        c.execute(sql, sql_parameters)
+
+                counts = self._ScanStringTokensCounts(c, dataset_id, token_type, True)
+                c.close()
+            finally:
+                #the temporary tables only exist on this connection and are dropped with it
+                conn.rollback()
+                conn.close()
+        except sqlite3.Error as e:
+            logger.exception("sql failed with error")
+        logger.info("Finished")
+        return counts
+
+    @WriteOperation
     def RefreshStringTokensIncluded(self, dataset_key):
         logger = logging.getLogger(__name__+".RefreshStringTokensIncluded")
         logger.info("Starting")
         try:
             c = self.__conn.cursor()
-            sql_select_dataset = """SELECT id, token_type
+            sql_select_dataset = """SELECT id
                                       FROM datasets 
                                       WHERE dataset_key = ?
                                       """
             c.execute(sql_select_dataset, (str(dataset_key),))
-            result = c.fetchone()
-            dataset_id = result[0]
-            token_type = result[1]
-            sql_truncate_stringtokensincluded = """DELETE FROM string_tokens_included WHERE dataset_id = ?"""
-            c.execute(sql_truncate_stringtokensincluded, (dataset_id,))
-            sql_insert_stringtokensincluded = """INSERT INTO string_tokens_included (
-                                                    dataset_id,
-                                                    words,
-                                                    pos, 
-                                                    num_of_words,
-                                                    num_of_docs,
-                                                    tfidf_range_min,
-                                                    tfidf_range_max,
-                                                    document_ids
-                                                 )
-                                                 SELECT
-                                                    dataset_id,
-                                                    CASE :token_type
-                                                        WHEN 'stem' THEN stem
-                                                        WHEN 'lemma' THEN lemma
-                                                        ELSE text
-                                                        END AS words,
-                                                    pos,
-                                                    COUNT(CASE :token_type
-                                                            WHEN 'stem' THEN stem
-                                                            WHEN 'lemma' THEN lemma
-                                                            ELSE text
-                                                            END) AS num_of_words,
-                                                    COUNT(DISTINCT document_id) AS num_of_docs,
-                                                    CASE :token_type
-                                                        WHEN 'stem' THEN ROUND(MIN(stem_tfidf),4)
-                                                        WHEN 'lemma' THEN ROUND(MIN(lemma_tfidf),4)
-                                                        ELSE ROUND(MIN(text_tfidf),4)
-                                                        END AS tfidf_range_min,
-                                                    CASE :token_type
-                                                        WHEN 'stem' THEN ROUND(MAX(stem_tfidf),4)
-                                                        WHEN 'lemma' THEN ROUND(MAX(lemma_tfidf),4)
-                                                        ELSE ROUND(MAX(text_tfidf),4)
-                                                        END AS tfidf_range_max,
-                                                    GROUP_CONCAT(document_id) as document_ids
-                                                 FROM string_tokens
-                                                 WHERE dataset_id = :dataset_id
-                                                 AND included = 1
-                                                 GROUP BY dataset_id,
-                                                          words,
-                                                          pos"""
-            c.execute(sql_insert_stringtokensincluded, {'token_type': token_type, 'dataset_id': dataset_id})
+            dataset_id = c.fetchone()[0]
+            #the aggregates of every token type are kept up to date so that switching between them does not need a refresh
+            for token_type in TOKEN_TYPES:
+                word_column, vocabulary_table = TokenTypeVocabulary(token_type)
+                included_column, refresh_included_column, refresh_removed_column = TokenTypeInclusion(token_type)
+                #only the words whose groups changed since the last refresh are rebuilt
+                sql_refresh_keys = """SELECT DISTINCT """+word_column+""",
+                                             pos_id
+                                      FROM token_groups
+                                      WHERE dataset_id = :dataset_id
+                                      AND """+refresh_included_column+""" = 1
+                                      """
+                sql_refresh_words = """SELECT DISTINCT """+word_column+"""
+                                       FROM token_groups
+                                       WHERE dataset_id = :dataset_id
+                                       AND """+refresh_included_column+""" = 1
+                                       """
+                parameters = {'dataset_id': dataset_id, 'token_type': token_type}
+                before_counts = self._GetStringTokensRowsCounts(c, 'string_tokens_included', sql_refresh_keys, sql_refresh_words, parameters)
+                sql_truncate_stringtokensincluded = """DELETE FROM string_tokens_included
+                                                     WHERE dataset_id = :dataset_id
+                                                     AND token_type = :token_type
+                                                     AND (word_id, pos_id) IN ("""+sql_refresh_keys+""")"""
+                c.execute(sql_truncate_stringtokensincluded, parameters)
+                sql_insert_stringtokensincluded = """INSERT INTO string_tokens_included (
+                                                        dataset_id,
+                                                        token_type,
+                                                        word_id,
+                                                        pos_id,
+                                                        words,
+                                                        pos, 
+                                                        num_of_words,
+                                                        num_of_docs,
+                                                        tfidf_range_min,
+                                                        tfidf_range_max,
+                                                        document_ids
+                                                     )
+                                                     SELECT
+                                                        grouped_tokens.dataset_id,
+                                                        :token_type,
+                                                        grouped_tokens.word_id,
+                                                        grouped_tokens.pos_id,
+                                                        """+vocabulary_table+""".term AS words,
+                                                        pos_vocabulary.term AS pos,
+                                                        grouped_tokens.num_of_words,
+                                                        grouped_tokens.num_of_docs,
+                                                        grouped_tokens.tfidf_range_min,
+                                                        grouped_tokens.tfidf_range_max,
+                                                        grouped_tokens.document_ids
+                                                     FROM (SELECT
+                                                              token_groups.dataset_id AS dataset_id,
+                                                              token_groups."""+word_column+""" AS word_id,
+                                                              token_groups.pos_id AS pos_id,
+                                                              SUM(token_group_documents.token_count) AS num_of_words,
+                                                              COUNT(DISTINCT token_group_documents.document_id) AS num_of_docs,
+                                                              ROUND(MIN(term_document_statistics.tfidf),4) AS tfidf_range_min,
+                                                              ROUND(MAX(term_document_statistics.tfidf),4) AS tfidf_range_max,
+                                                              posting_list(token_group_documents.document_id) AS document_ids
+                                                           FROM token_groups
+                                                           JOIN token_group_documents ON
+                                                                token_group_documents.group_id = token_groups.id
+                                                           LEFT JOIN token_group_overrides ON
+                                                                     token_group_overrides.dataset_id = token_groups.dataset_id
+                                                                     AND token_group_overrides.token_type = :token_type
+                                                                     AND token_group_overrides.group_id = token_groups.id
+                                                                     AND token_group_overrides.document_id = token_group_documents.document_id
+                                                           LEFT JOIN term_document_statistics ON
+                                                                     term_document_statistics.dataset_id = token_groups.dataset_id
+                                                                     AND term_document_statistics.token_type = :token_type
+                                                                     AND term_document_statistics.term_id = token_groups."""+word_column+"""
+                                                                     AND term_document_statistics.document_id = token_group_documents.document_id
+                                                           WHERE token_groups.dataset_id = :dataset_id
+                                                           AND (token_groups."""+word_column+""", token_groups.pos_id) IN ("""+sql_refresh_keys+""")
+                                                           AND COALESCE(token_group_overrides.included, token_groups."""+included_column+""") = 1
+                                                           GROUP BY token_groups."""+word_column+""",
+                                                                    token_groups.pos_id
+                                                           ) AS grouped_tokens
+                                                     LEFT JOIN """+vocabulary_table+""" ON
+                                                        grouped_tokens.word_id = """+vocabulary_table+""".id
+                                                     LEFT JOIN pos_vocabulary ON
+                                                        grouped_tokens.pos_id = pos_vocabulary.id"""
+                c.execute(sql_insert_stringtokensincluded, parameters)
+                after_counts = self._GetStringTokensRowsCounts(c, 'string_tokens_included', sql_refresh_keys, sql_refresh_words, parameters)
+                self._UpdateStringTokensCounts(c, dataset_id, token_type, True, before_counts, after_counts)
+                sql_update_refreshgroups = """UPDATE token_groups
+                                              SET """+refresh_included_column+""" = 0
+                                              WHERE dataset_id = ?
+                                              AND """+refresh_included_column+""" = 1
+                                              """
+                c.execute(sql_update_refreshgroups, (dataset_id,))
             self.__conn.commit()
             c.close()
         except sqlite3.Error as e:
             logger.exception("sql failed with error")
+            self.__conn.rollback()
         logger.info("Finished")
     
+    @WriteOperation
     def RefreshStringTokensRemoved(self, dataset_key):
         logger = logging.getLogger(__name__+".RefreshStringTokensRemoved")
         logger.info("Starting")
         try:
             c = self.__conn.cursor()
-            sql_select_dataset = """SELECT id, token_type
+            sql_select_dataset = """SELECT id
                                       FROM datasets 
                                       WHERE dataset_key = ?
                                       """
             c.execute(sql_select_dataset, (str(dataset_key),))
-            result = c.fetchone()
-            dataset_id = result[0]
-            token_type = result[1]
-            sql_truncate_stringtokensremoved = """DELETE FROM string_tokens_removed WHERE dataset_id = ?"""
-            c.execute(sql_truncate_stringtokensremoved, (dataset_id,))
-            sql_insert_stringtokensremoved = """INSERT INTO string_tokens_removed (
-                                                    dataset_id,
-                                                    words,
-                                                    pos, 
-                                                    num_of_words,
-                                                    num_of_docs,
-                                                    tfidf_range_min,
-                                                    tfidf_range_max,
-                                                    document_ids
-                                                 )
-                                                 SELECT
-                                                    dataset_id,
-                                                    CASE :token_type
-                                                        WHEN 'stem' THEN stem
-                                                        WHEN 'lemma' THEN lemma
-                                                        ELSE text
-                                                        END AS words,
-                                                    pos,
-                                                    COUNT(CASE :token_type
-                                                            WHEN 'stem' THEN stem
-                                                            WHEN 'lemma' THEN lemma
-                                                            ELSE text
-                                                            END) AS num_of_words,
-                                                    COUNT(DISTINCT document_id) AS num_of_docs,
-                                                    CASE :token_type
-                                                        WHEN 'stem' THEN ROUND(MIN(stem_tfidf),4)
-                                                        WHEN 'lemma' THEN ROUND(MIN(lemma_tfidf),4)
-                                                        ELSE ROUND(MIN(text_tfidf),4)
-                                                        END AS tfidf_range_min,
-                                                    CASE :token_type
-                                                        WHEN 'stem' THEN ROUND(MAX(stem_tfidf),4)
-                                                        WHEN 'lemma' THEN ROUND(MAX(lemma_tfidf),4)
-                                                        ELSE ROUND(MAX(text_tfidf),4)
-                                                        END AS tfidf_range_max,
-                                                    GROUP_CONCAT(document_id) as document_ids
-                                                 FROM string_tokens
-                                                 WHERE dataset_id = :dataset_id
-                                                 AND included = 0
-                                                 GROUP BY dataset_id,
-                                                          words,
-                                                          pos"""
-            c.execute(sql_insert_stringtokensremoved, {'token_type': token_type, 'dataset_id': dataset_id})
+            dataset_id = c.fetchone()[0]
+            #the aggregates of every token type are kept up to date so that switching between them does not need a refresh
+            for token_type in TOKEN_TYPES:
+                word_column, vocabulary_table = TokenTypeVocabulary(token_type)
+                included_column, refresh_included_column, refresh_removed_column = TokenTypeInclusion(token_type)
+                #only the words whose groups changed since the last refresh are rebuilt
+                sql_refresh_keys = """SELECT DISTINCT """+word_column+""",
+                                             pos_id
+                                      FROM token_groups
+                                      WHERE dataset_id = :dataset_id
+                                      AND """+refresh_removed_column+""" = 1
+                                      """
+                sql_refresh_words = """SELECT DISTINCT """+word_column+"""
+                                       FROM token_groups
+                                       WHERE dataset_id = :dataset_id
+                                       AND """+refresh_removed_column+""" = 1
+                                       """
+                parameters = {'dataset_id': dataset_id, 'token_type': token_type}
+                before_counts = self._GetStringTokensRowsCounts(c, 'string_tokens_removed', sql_refresh_keys, sql_refresh_words, parameters)
+                sql_truncate_stringtokensremoved = """DELETE FROM string_tokens_removed
+                                                     WHERE dataset_id = :dataset_id
+                                                     AND token_type = :token_type
+                                                     AND (word_id, pos_id) IN ("""+sql_refresh_keys+""")"""
+                c.execute(sql_truncate_stringtokensremoved, parameters)
+                sql_insert_stringtokensremoved = """INSERT INTO string_tokens_removed (
+                                                        dataset_id,
+                                                        token_type,
+                                                        word_id,
+                                                        pos_id,
+                                                        words,
+                                                        pos, 
+                                                        num_of_words,
+                                                        num_of_docs,
+                                                        tfidf_range_min,
+                                                        tfidf_range_max,
+                                                        document_ids
+                                                     )
+                                                     SELECT
+                                                        grouped_tokens.dataset_id,
+                                                        :token_type,
+                                                        grouped_tokens.word_id,
+                                                        grouped_tokens.pos_id,
+                                                        """+vocabulary_table+""".term AS words,
+                                                        pos_vocabulary.term AS pos,
+                                                        grouped_tokens.num_of_words,
+                                                        grouped_tokens.num_of_docs,
+                                                        grouped_tokens.tfidf_range_min,
+                                                        grouped_tokens.tfidf_range_max,
+                                                        grouped_tokens.document_ids
+                                                     FROM (SELECT
+                                                              token_groups.dataset_id AS dataset_id,
+                                                              token_groups."""+word_column+""" AS word_id,
+                                                              token_groups.pos_id AS pos_id,
+                                                              SUM(token_group_documents.token_count) AS num_of_words,
+                                                              COUNT(DISTINCT token_group_documents.document_id) AS num_of_docs,
+                                                              ROUND(MIN(term_document_statistics.tfidf),4) AS tfidf_range_min,
+                                                              ROUND(MAX(term_document_statistics.tfidf),4) AS tfidf_range_max,
+                                                              posting_list(token_group_documents.document_id) AS document_ids
+                                                           FROM token_groups
+                                                           JOIN token_group_documents ON
+                                                                token_group_documents.group_id = token_groups.id
+                                                           LEFT JOIN token_group_overrides ON
+                                                                     token_group_overrides.dataset_id = token_groups.dataset_id
+                                                                     AND token_group_overrides.token_type = :token_type
+                                                                     AND token_group_overrides.group_id = token_groups.id
+                                                                     AND token_group_overrides.document_id = token_group_documents.document_id
+                                                           LEFT JOIN term_document_statistics ON
+                                                                     term_document_statistics.dataset_id = token_groups.dataset_id
+                                                                     AND term_document_statistics.token_type = :token_type
+                                                                     AND term_document_statistics.term_id = token_groups."""+word_column+"""
+                                                                     AND term_document_statistics.document_id = token_group_documents.document_id
+                                                           WHERE token_groups.dataset_id = :dataset_id
+                                                           AND (token_groups."""+word_column+""", token_groups.pos_id) IN ("""+sql_refresh_keys+""")
+                                                           AND COALESCE(token_group_overrides.included, token_groups."""+included_column+""") = 0
+                                                           GROUP BY token_groups."""+word_column+""",
+                                                                    token_groups.pos_id
+                                                           ) AS grouped_tokens
+                                                     LEFT JOIN """+vocabulary_table+""" ON
+                                                        grouped_tokens.word_id = """+vocabulary_table+""".id
+                                                     LEFT JOIN pos_vocabulary ON
+                                                        grouped_tokens.pos_id = pos_vocabulary.id"""
+                c.execute(sql_insert_stringtokensremoved, parameters)
+                after_counts = self._GetStringTokensRowsCounts(c, 'string_tokens_removed', sql_refresh_keys, sql_refresh_words, parameters)
+                self._UpdateStringTokensCounts(c, dataset_id, token_type, False, before_counts, after_counts)
+                sql_update_refreshgroups = """UPDATE token_groups
+                                              SET """+refresh_removed_column+""" = 0
+                                              WHERE dataset_id = ?
+                                              AND """+refresh_removed_column+""" = 1
+                                              """
+                c.execute(sql_update_refreshgroups, (dataset_id,))
             self.__conn.commit()
             c.close()
         except sqlite3.Error as e:
             logger.exception("sql failed with error")
+            self.__conn.rollback()
         logger.info("Finished")
 
-    def GetStringTokensCounts(self, dataset_key):
-        logger = logging.getLogger(__name__+".GetStringTokensCounts")
-        logger.info("Starting")
-        counts={}
-        try:
-            c = self.__conn.cursor()
-            sql_select_datasetid = """SELECT id, token_type
-                                      FROM datasets 
-                                      WHERE dataset_key = ?
-                                      """
-            c.execute(sql_select_datasetid, (str(dataset_key),))
-            result = c.fetchone()
-            dataset_id = result[0]
-            token_type = result[1]
-
-            sql_tokencount_query = """SELECT COUNT(*),
-                                             CASE :token_type
-                                                  WHEN 'stem' THEN COUNT(DISTINCT stem)
-                                                  WHEN 'lemma' THEN COUNT(DISTINCT lemma)
-                                                  ELSE COUNT(DISTINCT text)
-                                                  END,
-                                             COUNT(DISTINCT document_id)   
-                                      FROM string_tokens
+    def _GetStringTokensRowsCounts(self, c, table, sql_keys, sql_words, parameters):
+        #returns the tokens, unique words and unique words of both aggregate tables in the aggregates of the keys and words selected by sql_keys and sql_words,
+        #along with every document id in those aggregates' posting lists
+        sql_select_rows = """SELECT num_of_words,
+                                    document_ids
+                             FROM """+table+"""
+                             WHERE dataset_id = :dataset_id
+                             AND token_type = :token_type
+                             AND (word_id, pos_id) IN ("""+sql_keys+""")
+                             """
+        c.execute(sql_select_rows, parameters)
+        tokens = 0
+        document_ids = [DecodePostingList(None)]
+        for row in c.fetchall():
+            tokens += row[0] or 0
+            document_ids.append(DecodePostingList(row[1]))
+        sql_count_words = """SELECT COUNT(DISTINCT word_id)
+                             FROM """+table+"""
+                             WHERE dataset_id = :dataset_id
+                             AND token_type = :token_type
+                             AND word_id IN ("""+sql_words+""")
+                             """
+        c.execute(sql_count_words, parameters)
+        unique_tokens = c.fetchone()[0]
+        sql_count_allwords = """SELECT COUNT(DISTINCT word_id)
+                                FROM (SELECT word_id
+                                      FROM string_tokens_included
                                       WHERE dataset_id = :dataset_id
-                                      """
-            c.execute(sql_tokencount_query, {'dataset_id': dataset_id, 'token_type':token_type})
-            cur_result = c.fetchone()
+                                      AND token_type = :token_type
+                                      AND word_id IN ("""+sql_words+""")
+                                      UNION ALL
+                                      SELECT word_id
+                                      FROM string_tokens_removed
+                                      WHERE dataset_id = :dataset_id
+                                      AND token_type = :token_type
+                                      AND word_id IN ("""+sql_words+"""))
+                                """
+        c.execute(sql_count_allwords, parameters)
+        all_unique_tokens = c.fetchone()[0]
+        return tokens, unique_tokens, all_unique_tokens, np.concatenate(document_ids)
+
+    def _UpdateStringTokensCounts(self, c, dataset_id, token_type, included, before_counts, after_counts):
+        #adds the difference between _GetStringTokensRowsCounts before and after an aggregate table changed to the dataset's maintained counts
+        tokens_change = after_counts[0] - before_counts[0]
+        all_unique_tokens_change = after_counts[2] - before_counts[2]
+        if included:
+            words_column = 'included_words'
+            unique_tokens_change = after_counts[1] - before_counts[1]
+        else:
+            words_column = 'removed_words'
+            unique_tokens_change = 0
+
+        #a document is counted while it appears in at least one aggregate, so only the documents whose number of aggregates changed are checked
+        document_ids, inverse = np.unique(np.concatenate([before_counts[3], after_counts[3]]), return_inverse=True)
+        weights = np.concatenate([np.full(len(before_counts[3]), -1), np.full(len(after_counts[3]), 1)])
+        words_changes = np.bincount(inverse, weights=weights, minlength=len(document_ids)).astype(np.int64)
+        changed = words_changes != 0
+        c.execute("""CREATE TEMP TABLE IF NOT EXISTS document_words_changes (
+                        document_id INTEGER PRIMARY KEY,
+                        words INTEGER
+                        )""")
+        c.execute("""DELETE FROM temp.document_words_changes""")
+        c.executemany("""INSERT INTO temp.document_words_changes (document_id, words) VALUES (?, ?)""",
+                      zip(document_ids[changed].tolist(), words_changes[changed].tolist()))
+        sql_count_documents = """SELECT IFNULL(SUM(included_words > 0), 0),
+                                        IFNULL(SUM(included_words + removed_words > 0), 0)
+                                 FROM string_tokens_document_counts
+                                 WHERE dataset_id = :dataset_id
+                                 AND token_type = :token_type
+                                 AND document_id IN (SELECT document_id
+                                                     FROM temp.document_words_changes)
+                                 """
+        parameters = {'dataset_id': dataset_id, 'token_type': token_type}
+        c.execute(sql_count_documents, parameters)
+        before_documents = c.fetchone()
+        sql_upsert_documentcounts = """INSERT INTO string_tokens_document_counts (
+                                            dataset_id,
+                                            token_type,
+                                            document_id,
+                                            """+words_column+"""
+                                            )
+                                       SELECT :dataset_id,
+                                              :token_type,
+                                              document_id,
+                                              words
+                                       FROM temp.document_words_changes
+                                       WHERE true
+                                       ON CONFLICT(dataset_id, token_type, document_id)
+                                       DO UPDATE SET """+words_column+""" = """+words_column+""" + excluded."""+words_column+"""
+                                       """
+        c.execute(sql_upsert_documentcounts, parameters)
+        c.execute(sql_count_documents, parameters)
+        after_documents = c.fetchone()
+        sql_delete_documentcounts = """DELETE FROM string_tokens_document_counts
+                                       WHERE dataset_id = :dataset_id
+                                       AND token_type = :token_type
+                                       AND document_id IN (SELECT document_id
+                                                           FROM temp.document_words_changes)
+                                       AND included_words = 0
+                                       AND removed_words = 0
+                                       """
+        c.execute(sql_delete_documentcounts, parameters)
+        if included:
+            included_documents_change = after_documents[0] - before_documents[0]
+        else:
+            included_documents_change = 0
+        all_documents_change = after_documents[1] - before_documents[1]
+
+        sql_insert_counts = """INSERT OR IGNORE INTO string_tokens_counts (
+                                    dataset_id,
+                                    token_type
+                                    ) VALUES (:dataset_id, :token_type)"""
+        c.execute(sql_insert_counts, parameters)
+        sql_update_counts = """UPDATE string_tokens_counts
+                               SET tokens = tokens + :tokens,
+                                   unique_tokens = unique_tokens + :unique_tokens,
+                                   documents = documents + :documents,
+                                   included_tokens = included_tokens + :included_tokens,
+                                   included_unique_tokens = included_unique_tokens + :included_unique_tokens,
+                                   included_documents = included_documents + :included_documents
+                               WHERE dataset_id = :dataset_id
+                               AND token_type = :token_type
+                               """
+        parameters.update({'tokens': tokens_change,
+                           'unique_tokens': all_unique_tokens_change,
+                           'documents': all_documents_change,
+                           'included_tokens': tokens_change if included else 0,
+                           'included_unique_tokens': unique_tokens_change,
+                           'included_documents': included_documents_change})
+        c.execute(sql_update_counts, parameters)
+
+    def _ScanStringTokensCounts(self, c, dataset_id, token_type, included_only):
+        #recalculates a dataset's counts from the token groups, used to verify the maintained counts
+        word_column, vocabulary_table = TokenTypeVocabulary(token_type)
+        included_column, refresh_included_column, refresh_removed_column = TokenTypeInclusion(token_type)
+        sql_tokencount_query = """SELECT IFNULL(SUM(token_group_documents.token_count), 0),
+                                         COUNT(DISTINCT token_groups."""+word_column+"""),
+                                         COUNT(DISTINCT token_group_documents.document_id)
+                                  FROM token_groups
+                                  JOIN token_group_documents ON
+                                       token_group_documents.group_id = token_groups.id
+                                  LEFT JOIN token_group_overrides ON
+                                            token_group_overrides.dataset_id = token_groups.dataset_id
+                                            AND token_group_overrides.token_type = :token_type
+                                            AND token_group_overrides.group_id = token_groups.id
+                                            AND token_group_overrides.document_id = token_group_documents.document_id
+                                  WHERE token_groups.dataset_id = :dataset_id
+                                  """
+        if included_only:
+            sql_tokencount_query = sql_tokencount_query + """AND COALESCE(token_group_overrides.included, token_groups."""+included_column+""") = 1"""
+        c.execute(sql_tokencount_query, {'dataset_id': dataset_id, 'token_type':token_type})
+        cur_result = c.fetchone()
+        return {'tokens': cur_result[0], 'unique_tokens': cur_result[1], 'documents': cur_result[2]}
+
+    def _GetStringTokensCounts(self, dataset_key, included_only):
+        logger = logging.getLogger(__name__+"._GetStringTokensCounts")
+        counts = {'tokens': 0, 'unique_tokens': 0, 'documents': 0}
+        c = self.__conn.cursor()
+        sql_select_datasetid = """SELECT id, token_type
+                                  FROM datasets 
+                                  WHERE dataset_key = ?
+                                  """
+        c.execute(sql_select_datasetid, (str(dataset_key),))
+        result = c.fetchone()
+        dataset_id = result[0]
+        token_type = result[1]
+
+        if included_only:
+            sql_select_counts = """SELECT included_tokens,
+                                          included_unique_tokens,
+                                          included_documents
+                                   FROM string_tokens_counts
+                                   WHERE dataset_id = ?
+                                   AND token_type = ?
+                                   """
+        else:
+            sql_select_counts = """SELECT tokens,
+                                          unique_tokens,
+                                          documents
+                                   FROM string_tokens_counts
+                                   WHERE dataset_id = ?
+                                   AND token_type = ?
+                                   """
+        c.execute(sql_select_counts, (dataset_id, token_type,))
+        cur_result = c.fetchone()
+        if cur_result is not None:
             counts['tokens'] = cur_result[0]
             counts['unique_tokens'] = cur_result[1]
             counts['documents'] = cur_result[2]
 
-            c.close()
+        if Constants.DB_VERIFY_COUNTS:
+            scanned_counts = self._ScanStringTokensCounts(c, dataset_id, token_type, included_only)
+            if scanned_counts != counts:
+                logger.error("maintained counts %s of dataset[%s] differ from recalculated counts %s", str(counts), str(dataset_key), str(scanned_counts))
+                counts = scanned_counts
+        c.close()
+        return counts
+
+    def GetStringTokensCounts(self, dataset_key):
+        logger = logging.getLogger(__name__+".GetStringTokensCounts")
+        logger.info("Starting")
+        counts={}
+        try:
+            counts = self._GetStringTokensCounts(dataset_key, False)
         except sqlite3.Error as e:
             logger.exception("sql failed with error")
+            self.__conn.rollback()
         logger.info("Finished")
         return counts
 
@@ -1134,160 +2759,185 @@ class DatabaseConnection():
         logger.info("Starting")
         counts={}
         try:
-            c = self.__conn.cursor()
-            sql_select_datasetid = """SELECT id, token_type
-                                      FROM datasets 
-                                      WHERE dataset_key = ?
-                                      """
-            c.execute(sql_select_datasetid, (str(dataset_key),))
-            result = c.fetchone()
-            dataset_id = result[0]
-            token_type = result[1]
-
-            sql_tokencount_query = """SELECT COUNT(*),
-                                             CASE :token_type
-                                                  WHEN 'stem' THEN COUNT(DISTINCT stem)
-                                                  WHEN 'lemma' THEN COUNT(DISTINCT lemma)
-                                                  ELSE COUNT(DISTINCT text)
-                                                  END,
-                                             COUNT(DISTINCT document_id)   
-                                      FROM string_tokens
-                                      WHERE dataset_id = :dataset_id
-                                      AND included = 1
-                                      """
-            c.execute(sql_tokencount_query, {'dataset_id': dataset_id, 'token_type':token_type})
-            cur_result = c.fetchone()
-            counts['tokens'] = cur_result[0]
-            counts['unique_tokens'] = cur_result[1]
-            counts['documents'] = cur_result[2]
-
-            c.close()
+            counts = self._GetStringTokensCounts(dataset_key, True)
         except sqlite3.Error as e:
             logger.exception("sql failed with error")
+            self.__conn.rollback()
         logger.info("Finished")
         return counts
 
-    def GetIncludedStringTokens(self, dataset_key, search_term, sort_col, sort_ascending):
-        logger = logging.getLogger(__name__+".GetIncludedStringTokens")
-        #logger.info("Starting")
-        try:
-            c = self.__conn.cursor()
-            sql_select_datasetid = """SELECT id
-                                      FROM datasets 
-                                      WHERE dataset_key = ?
-                                      """
-            c.execute(sql_select_datasetid, (str(dataset_key),))
-            dataset_id = c.fetchone()[0]
+    def _StringTokensSortColumn(self, sort_col):
+        #tfidf ranges are null for words without statistics so they are sorted as 0 to keep the page keys comparable
+        if sort_col == GUITextFiltering.FILTERS_WORDS:
+            return "words", 0
+        elif sort_col == GUITextFiltering.FILTERS_POS:
+            return "pos", 1
+        elif sort_col == GUITextFiltering.FILTERS_NUM_DOCS:
+            return "num_of_docs", 3
+        elif sort_col == GUITextFiltering.FILTERS_TFIDF_MIN:
+            return "IFNULL(tfidf_range_min, 0)", 4
+        elif sort_col == GUITextFiltering.FILTERS_TFIDF_MAX:
+            return "IFNULL(tfidf_range_max, 0)", 5
+        else:
+            return "num_of_words", 2
 
-            sql_select_includedrow1 = """SELECT words,
-                                                pos,
-                                                num_of_words,
-                                                num_of_docs,
-                                                tfidf_range_min,
-                                                tfidf_range_max,
-                                                document_ids
-                                         FROM string_tokens_included
-                                         WHERE dataset_id = ?
-                                         """
-            sql_select_includedrow2 = "ORDER BY "
-
-            sql = sql_select_includedrow1 
-            parameters = [dataset_id]
-            if search_term != "":
-                sql = sql + "AND (words = ? OR pos = ?)"
-                parameters.append(search_term)
-                parameters.append(search_term)
-            sql = sql + sql_select_includedrow2
-            
-            if sort_col is GUITextFiltering.FILTERS_WORDS:
-                sql = sql + "words "
-            elif sort_col is GUITextFiltering.FILTERS_POS:
-                sql = sql + "pos "
-            elif sort_col is GUITextFiltering.FILTERS_NUM_WORDS:
-                sql = sql + "num_of_words "
-            elif sort_col is GUITextFiltering.FILTERS_NUM_DOCS:
-                sql = sql + "num_of_docs "
-            elif sort_col is GUITextFiltering.FILTERS_TFIDF_MAX:
-                sql = sql + "tfidf_range_max "
-            elif sort_col is GUITextFiltering.FILTERS_TFIDF_MIN:
-                sql = sql + "tfidf_range_min "
-            
+    def _GetStringTokensCount(self, table, dataset_key, search_term):
+        c = self.__conn.cursor()
+        sql_select_datasetid = """SELECT id, token_type
+                                  FROM datasets 
+                                  WHERE dataset_key = ?
+                                  """
+        c.execute(sql_select_datasetid, (str(dataset_key),))
+        result = c.fetchone()
+        dataset_id = result[0]
+        token_type = result[1]
+
+        sql = """SELECT COUNT(*)
+                 FROM """+table+"""
+                 WHERE dataset_id = ?
+                 AND token_type = ?
+                 """
+        parameters = [dataset_id, token_type]
+        if search_term != "":
+            sql = sql + "AND (words = ? OR pos = ?)"
+            parameters.append(search_term)
+            parameters.append(search_term)
+        c.execute(sql, parameters)
+        count = c.fetchone()[0]
+        c.close()
+        return count
+
+    def _GetStringTokensPage(self, table, dataset_key, search_term, sort_col, sort_ascending, page_size, after_row, offset):
+        c = self.__conn.cursor()
+        sql_select_datasetid = """SELECT id, token_type
+                                  FROM datasets 
+                                  WHERE dataset_key = ?
+                                  """
+        c.execute(sql_select_datasetid, (str(dataset_key),))
+        result = c.fetchone()
+        dataset_id = result[0]
+        token_type = result[1]
+
+        sort_column, sort_idx = self._StringTokensSortColumn(sort_col)
+        sql = """SELECT words,
+                        pos,
+                        num_of_words,
+                        num_of_docs,
+                        tfidf_range_min,
+                        tfidf_range_max,
+                        id
+                 FROM """+table+"""
+                 WHERE dataset_id = ?
+                 AND token_type = ?
+                 """
+        parameters = [dataset_id, token_type]
+        if search_term != "":
+            sql = sql + "AND (words = ? OR pos = ?) "
+            parameters.append(search_term)
+            parameters.append(search_term)
+        #when the last row of the previous page is known the page starts from its sort key instead of skipping rows
+        if after_row is not None:
             if sort_ascending:
-                sql = sql + "ASC "
+                sql = sql + "AND ("+sort_column+", id) > (?, ?) "
             else:
-                sql = sql + "DESC "
+                sql = sql + "AND ("+sort_column+", id) < (?, ?) "
+            sort_value = after_row[sort_idx]
+            if sort_value is None:
+                sort_value = 0
+            parameters.append(sort_value)
+            parameters.append(after_row[-1])
+            offset = 0
+        if sort_ascending:
+            sql = sql + "ORDER BY "+sort_column+" ASC, id ASC "
+        else:
+            sql = sql + "ORDER BY "+sort_column+" DESC, id DESC "
+        sql = sql + "LIMIT ? OFFSET ?"
+        parameters.append(page_size)
+        parameters.append(offset)
+
+        c.execute(sql, parameters)
+        data = c.fetchall()
+        c.close()
+        return data
 
-            c.execute(sql, parameters)
-            data = c.fetchall()
-            c.close()
+    def _GetStringTokensDocumentIds(self, table, row_id):
+        c = self.__conn.cursor()
+        sql = """SELECT document_ids
+                 FROM """+table+"""
+                 WHERE id = ?
+                 """
+        c.execute(sql, (row_id,))
+        result = c.fetchone()
+        c.close()
+        if result is None:
+            return DecodePostingList(None)
+        return DecodePostingList(result[0])
+
+    def GetIncludedStringTokensRowCount(self, dataset_key, search_term):
+        logger = logging.getLogger(__name__+".GetIncludedStringTokensRowCount")
+        count = 0
+        try:
+            count = self._GetStringTokensCount("string_tokens_included", dataset_key, search_term)
         except sqlite3.Error as e:
             logger.exception("sql failed with error")
-        #logger.info("Finished")
-        return data
+            self.__conn.rollback()
+        return count
 
-    def GetRemovedStringTokens(self, dataset_key, search_term, sort_col, sort_ascending):
-        logger = logging.getLogger(__name__+".GetRemovedStringTokens")
-        #logger.info("Starting")
+    def GetRemovedStringTokensRowCount(self, dataset_key, search_term):
+        logger = logging.getLogger(__name__+".GetRemovedStringTokensRowCount")
+        count = 0
         try:
-            c = self.__conn.cursor()
-            sql_select_datasetid = """SELECT id
-                                      FROM datasets 
-                                      WHERE dataset_key = ?
-                                      """
-            c.execute(sql_select_datasetid, (str(dataset_key),))
-            dataset_id = c.fetchone()[0]
+            count = self._GetStringTokensCount("string_tokens_removed", dataset_key, search_term)
+        except sqlite3.Error as e:
+            logger.exception("sql failed with error")
+            self.__conn.rollback()
+        return count
 
-            sql_select_removedrow1 = """SELECT words,
-                                               pos,
-                                               num_of_words,
-                                               num_of_docs,
-                                               tfidf_range_min,
-                                               tfidf_range_max,
-                                               document_ids
-                                        FROM string_tokens_removed
-                                        WHERE dataset_id = ?
-                                        """
-            sql_select_removedrow2 = "ORDER BY "
-
-            sql = sql_select_removedrow1 
-            parameters = [dataset_id]
-            if search_term != "":
-                sql = sql + "AND (words = ? OR pos = ?)"
-                parameters.append(search_term)
-                parameters.append(search_term)
-            sql = sql + sql_select_removedrow2
-            
-            if sort_col is GUITextFiltering.FILTERS_WORDS:
-                sql = sql + "words "
-            elif sort_col is GUITextFiltering.FILTERS_POS:
-                sql = sql + "pos "
-            elif sort_col is GUITextFiltering.FILTERS_NUM_WORDS:
-                sql = sql + "num_of_words "
-            elif sort_col is GUITextFiltering.FILTERS_NUM_DOCS:
-                sql = sql + "num_of_docs "
-            elif sort_col is GUITextFiltering.FILTERS_TFIDF_MIN:
-                sql = sql + "tfidf_range_min "
-            elif sort_col is GUITextFiltering.FILTERS_TFIDF_MAX:
-                sql = sql + "tfidf_range_max "
+    def GetIncludedStringTokensPage(self, dataset_key, search_term, sort_col, sort_ascending, page_size, after_row=None, offset=0):
+        logger = logging.getLogger(__name__+".GetIncludedStringTokensPage")
+        data = []
+        try:
+            data = self._GetStringTokensPage("string_tokens_included", dataset_key, search_term, sort_col, sort_ascending, page_size, after_row, offset)
+        except sqlite3.Error as e:
+            logger.exception("sql failed with error")
+            self.__conn.rollback()
+        return data
 
-            if sort_ascending:
-                sql = sql + "ASC "
-            else:
-                sql = sql + "DESC "
+    def GetRemovedStringTokensPage(self, dataset_key, search_term, sort_col, sort_ascending, page_size, after_row=None, offset=0):
+        logger = logging.getLogger(__name__+".GetRemovedStringTokensPage")
+        data = []
+        try:
+            data = self._GetStringTokensPage("string_tokens_removed", dataset_key, search_term, sort_col, sort_ascending, page_size, after_row, offset)
+        except sqlite3.Error as e:
+            logger.exception("sql failed with error")
+            self.__conn.rollback()
+        return data
 
-            c.execute(sql, parameters)
-            data = c.fetchall()
+    def GetIncludedStringTokenDocumentIds(self, row_id):
+        logger = logging.getLogger(__name__+".GetIncludedStringTokenDocumentIds")
+        document_ids = DecodePostingList(None)
+        try:
+            document_ids = self._GetStringTokensDocumentIds("string_tokens_included", row_id)
+        except sqlite3.Error as e:
+            logger.exception("sql failed with error")
+            self.__conn.rollback()
+        return document_ids
 
-            c.close()
+    def GetRemovedStringTokenDocumentIds(self, row_id):
+        logger = logging.getLogger(__name__+".GetRemovedStringTokenDocumentIds")
+        document_ids = DecodePostingList(None)
+        try:
+            document_ids = self._GetStringTokensDocumentIds("string_tokens_removed", row_id)
         except sqlite3.Error as e:
             logger.exception("sql failed with error")
-        #logger.info("Finished")
-        return data
+            self.__conn.rollback()
+        return document_ids
 
-    def GetDocumentsTokensFromStringTokens(self, dataset_key):
-        logger = logging.getLogger(__name__+".GetDocumentsTokensFromStringTokens")
+    def IterateDocumentsTokens(self, dataset_key):
+        '''yields (document key, included tokens) for each document of a dataset that has included tokens,
+        in document order and reading Constants.DB_DOCUMENTS_TOKENS_BATCH documents from the database at a time'''
+        logger = logging.getLogger(__name__+".IterateDocumentsTokens")
         logger.info("Starting")
-        tokens_dict = {}
         try:
             c = self.__conn.cursor()
             sql_select_datasetid = """SELECT id, token_type
@@ -1298,31 +2948,128 @@ class DatabaseConnection():
             result = c.fetchone()
             dataset_id = result[0]
             token_type = result[1]
+            word_column, vocabulary_table = TokenTypeVocabulary(token_type)
+            included_column, refresh_included_column, refresh_removed_column = TokenTypeInclusion(token_type)
+            document_map = self._GetDocumentMap(c, dataset_id)
+            token_store = self._GetTokenStore(c, dataset_id)
+            if token_store is not None:
+                yield from self._IterateColumnsDocumentsTokens(c, dataset_id, token_type, token_store, document_map)
+            else:
 
-            sql_select_documenttokens = """SELECT document_key,
-                                                 GROUP_CONCAT(word, " ") 
-                                           FROM (SELECT document_key,
-                                                        CASE :token_type
-                                                        WHEN 'stem' THEN stem
-                                                        WHEN 'lemma' THEN lemma
-                                                        ELSE text
-                                                        END as word
-                                                 FROM string_tokens
-                                                 LEFT JOIN  documents ON
-                                                    string_tokens.document_id = documents.id
-                                                 WHERE string_tokens.dataset_id = :dataset_id
-                                                 AND string_tokens.included = 1
-                                                 ORDER BY string_tokens.document_id ASC,
-                                                          string_tokens.field_id ASC,
-                                                          string_tokens.position ASC)
-                                           GROUP BY document_key
-                                           """
-            tokens_dict = {}
-            c.execute(sql_select_documenttokens, {'dataset_id':dataset_id, 'token_type':token_type})
-            for row in c.fetchall():
-                tokens_dict[eval(row[0])] = row[1].split()
+                sql_select_batchend = """SELECT MAX(id)
+                                         FROM (SELECT id
+                                               FROM documents
+                                               WHERE dataset_id = :dataset_id
+                                               AND id > :batch_start
+                                               ORDER BY id
+                                               LIMIT :batch_size)
+                                         """
+                sql_select_documenttokens = """SELECT string_tokens.document_id,
+                                                      """+vocabulary_table+""".term
+                                               FROM """+StringTokensTable(dataset_id)+""" AS string_tokens
+                                               JOIN """+vocabulary_table+""" ON
+                                                    string_tokens."""+word_column+""" = """+vocabulary_table+""".id
+                                               JOIN token_groups ON
+                                                    string_tokens.group_id = token_groups.id
+                                               LEFT JOIN token_group_overrides ON
+                                                         token_group_overrides.dataset_id = :dataset_id
+                                                         AND token_group_overrides.token_type = :token_type
+                                                         AND token_group_overrides.group_id = string_tokens.group_id
+                                                         AND token_group_overrides.document_id = string_tokens.document_id
+                                               WHERE string_tokens.document_id > :batch_start
+                                               AND string_tokens.document_id <= :batch_end
+                                               AND COALESCE(token_group_overrides.included, token_groups."""+included_column+""") = 1
+                                               ORDER BY string_tokens.document_id ASC,
+                                                        string_tokens.field_id ASC,
+                                                        string_tokens.position ASC
+                                               """
+                batch_start = 0
+                while True:
+                    c.execute(sql_select_batchend, {'dataset_id':dataset_id, 'batch_start':batch_start, 'batch_size':Constants.DB_DOCUMENTS_TOKENS_BATCH})
+                    batch_end = c.fetchone()[0]
+                    if batch_end is None:
+                        break
+                    c.execute(sql_select_documenttokens, {'dataset_id':dataset_id, 'token_type':token_type, 'batch_start':batch_start, 'batch_end':batch_end})
+                    document_id = None
+                    tokens = []
+                    for row in c.fetchall():
+                        if row[0] != document_id:
+                            if document_id is not None:
+                                yield document_map.GetKeys([document_id])[0], tokens
+                            document_id = row[0]
+                            tokens = []
+                        tokens.extend(row[1].split())
+                    if document_id is not None:
+                        yield document_map.GetKeys([document_id])[0], tokens
+                    batch_start = batch_end
             c.close()
         except sqlite3.Error as e:
             logger.exception("sql failed with error")
+            self.__conn.rollback()
         logger.info("Finished")
-        return tokens_dict
+
+    def _IterateColumnsDocumentsTokens(self, c, dataset_id, token_type, token_store, document_map):
+        #same as IterateDocumentsTokens for a dataset's columnar token store,
+        #which tokens are included is worked out for every token at once instead of joining each one to its group
+        word_column, vocabulary_table = TokenTypeVocabulary(token_type)
+        included_column, refresh_included_column, refresh_removed_column = TokenTypeInclusion(token_type)
+        columns = token_store.Read()
+        group_ids = np.asarray(columns['group_id'], dtype=np.int64)
+        document_ids = np.asarray(columns['document_id'], dtype=np.int64)
+
+        sql_select_groups = """SELECT id, """+included_column+"""
+                               FROM token_groups
+                               WHERE dataset_id = ?
+                               """
+        c.execute(sql_select_groups, (dataset_id,))
+        groups = np.array(c.fetchall(), dtype=np.int64).reshape(-1, 2)
+        #groups of deleted fields are missing and so their tokens are never included
+        groups_included = np.zeros(int(max(groups[:,0].max(initial=0), group_ids.max(initial=0)))+1, dtype=bool)
+        groups_included[groups[:,0]] = groups[:,1] == 1
+        included = groups_included[group_ids]
+
+        sql_select_overrides = """SELECT group_id, document_id, included
+                                  FROM token_group_overrides
+                                  WHERE dataset_id = ?
+                                  AND token_type = ?
+                                  AND included IS NOT NULL
+                                  """
+        c.execute(sql_select_overrides, (dataset_id, token_type,))
+        overrides = np.array(c.fetchall(), dtype=np.int64).reshape(-1, 3)
+        if len(overrides) > 0:
+            override_keys = (overrides[:,0] << 32) | overrides[:,1]
+            override_order = np.argsort(override_keys)
+            override_keys = override_keys[override_order]
+            token_keys = (group_ids << 32) | document_ids
+            positions = np.minimum(np.searchsorted(override_keys, token_keys), len(override_keys)-1)
+            overridden = override_keys[positions] == token_keys
+            included[overridden] = overrides[override_order[positions[overridden]], 2] == 1
+
+        tokens_order = np.nonzero(included)[0]
+        tokens_order = tokens_order[np.lexsort((columns['position'][tokens_order], columns['field_id'][tokens_order], document_ids[tokens_order]))]
+        word_ids = np.asarray(columns[word_column])[tokens_order]
+        document_ids = document_ids[tokens_order]
+        del columns
+        document_starts = np.concatenate(([0], np.flatnonzero(np.diff(document_ids))+1)).astype(np.int64)
+        document_ends = np.append(document_starts[1:], len(document_ids))
+        if len(document_ids) == 0:
+            document_starts = document_ends = np.zeros(0, dtype=np.int64)
+
+        for batch_start in range(0, len(document_starts), Constants.DB_DOCUMENTS_TOKENS_BATCH):
+            batch_starts = document_starts[batch_start:batch_start+Constants.DB_DOCUMENTS_TOKENS_BATCH]
+            batch_ends = document_ends[batch_start:batch_start+Constants.DB_DOCUMENTS_TOKENS_BATCH]
+            batch_word_ids = np.unique(word_ids[batch_starts[0]:batch_ends[-1]]).tolist()
+            terms = {}
+            for i in range(0, len(batch_word_ids), Constants.DB_MAX_VARIABLES):
+                chunk_word_ids = batch_word_ids[i:i+Constants.DB_MAX_VARIABLES]
+                sql_select_terms = """SELECT id, term
+                                      FROM """+vocabulary_table+"""
+                                      WHERE id IN ("""+",".join(["?"]*len(chunk_word_ids))+""")
+                                      """
+                c.execute(sql_select_terms, chunk_word_ids)
+                terms.update(c.fetchall())
+            for start, end in zip(batch_starts.tolist(), batch_ends.tolist()):
+                tokens = []
+                for word_id in word_ids[start:end].tolist():
+                    tokens.extend(terms[word_id].split())
+                yield document_map.GetKeys([document_ids[start]])[0], tokens
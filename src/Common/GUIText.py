@@ -215,6 +215,7 @@ class Main(Common):
     OPTIONS_MULTIPLEDATASETS_LABEL = "Allow Multiple Datasets Mode (not yet fully tested)"
     OPTIONS_ADJUSTABLE_LABEL_FIELDS_LABEL = "Allow adjusting label fields during retrieval"
     OPTIONS_ADJUSTABLE_COMPUTATIONAL_FIELDS_LABEL = "Allow adjusting computational fields during retrieval"
+    OPTIONS_COLUMNAR_TOKEN_STORE_LABEL = "Store tokens of datasets added from now on in memory-mapped columns"
     CONSUMER_KEY_MISSING_ERROR = "You need to enter a Consumer Key."
     CONSUMER_SECRET_MISSING_ERROR = "You need to enter a Consumer Secret."
     INVALID_CREDENTIALS_ERROR = "Invalid credentials."
@@ -813,6 +814,7 @@ class Filtering(Main, Datasets):
     FILTERS_MANUALAPPLY_TOOLTIP = "Will apply any drafted rule changes made to the dataset"
     FILTERS_MANUALCANCEL = "Cancel Changes"
     FILTERS_MANUALCANCEL_TOOLTIP = "Will cancel any drafted rule changes to the dataset"
+    FILTERS_DRAFTED_IMPACT = "after drafted changes: "
 
 
     FILTERS_IMPORT_CONFIRMATION_REQUEST = "Are you sure you want to proceed with importing rule?"\
@@ -1,5 +1,6 @@
 import logging
 from datetime import datetime
+from collections import OrderedDict
 import webbrowser
 
 import wx
@@ -24,6 +25,8 @@ class TokenListCtrl(wx.ListCtrl):
         self.search_term = ""
         self.sort_col = GUIText.FILTERS_NUM_WORDS
         self.sort_ascending = False
+        self.item_count = 0
+        self.pages = OrderedDict()
         
         self.col_names = [GUIText.FILTERS_WORDS,
                           GUIText.FILTERS_POS,
@@ -66,10 +69,11 @@ class TokenListCtrl(wx.ListCtrl):
         main_frame = wx.GetApp().GetTopWindow()
         db_conn = Database.DatabaseConnection(main_frame.current_workspace.name)
         if self.word_type == "Included":
-            self.data = db_conn.GetIncludedStringTokens(self.dataset.key, self.search_term, self.sort_col, self.sort_ascending)
+            self.item_count = db_conn.GetIncludedStringTokensRowCount(self.dataset.key, self.search_term)
         else:
-            self.data = db_conn.GetRemovedStringTokens(self.dataset.key, self.search_term, self.sort_col, self.sort_ascending)
-        self.SetItemCount(len(self.data))
+            self.item_count = db_conn.GetRemovedStringTokensRowCount(self.dataset.key, self.search_term)
+        self.pages.clear()
+        self.SetItemCount(self.item_count)
 
         self.SetColumnWidth(0, wx.LIST_AUTOSIZE)
         self.SetColumnWidth(1, wx.LIST_AUTOSIZE_USEHEADER)
@@ -80,8 +84,45 @@ class TokenListCtrl(wx.ListCtrl):
 
         self.Refresh()
 
+    def GetPage(self, page_num):
+        #rows are only fetched from the database when they are shown and a limited number of pages are kept
+        if page_num in self.pages:
+            self.pages.move_to_end(page_num)
+            return self.pages[page_num]
+        after_row = None
+        if page_num-1 in self.pages and len(self.pages[page_num-1]) > 0:
+            after_row = self.pages[page_num-1][-1]
+        main_frame = wx.GetApp().GetTopWindow()
+        db_conn = Database.DatabaseConnection(main_frame.current_workspace.name)
+        if self.word_type == "Included":
+            page = db_conn.GetIncludedStringTokensPage(self.dataset.key, self.search_term, self.sort_col, self.sort_ascending,
+                                                       Constants.TOKEN_LIST_PAGE_SIZE, after_row, page_num*Constants.TOKEN_LIST_PAGE_SIZE)
+        else:
+            page = db_conn.GetRemovedStringTokensPage(self.dataset.key, self.search_term, self.sort_col, self.sort_ascending,
+                                                      Constants.TOKEN_LIST_PAGE_SIZE, after_row, page_num*Constants.TOKEN_LIST_PAGE_SIZE)
+        self.pages[page_num] = page
+        if len(self.pages) > Constants.TOKEN_LIST_CACHED_PAGES:
+            self.pages.popitem(last=False)
+        return page
+
+    def GetRowData(self, item):
+        page = self.GetPage(item // Constants.TOKEN_LIST_PAGE_SIZE)
+        idx = item % Constants.TOKEN_LIST_PAGE_SIZE
+        if idx < len(page):
+            return page[idx]
+        return ("", "", 0, 0, None, None, None)
+
+    def GetDocumentIds(self, item):
+        row_data = self.GetRowData(item)
+        main_frame = wx.GetApp().GetTopWindow()
+        db_conn = Database.DatabaseConnection(main_frame.current_workspace.name)
+        if self.word_type == "Included":
+            return db_conn.GetIncludedStringTokenDocumentIds(row_data[-1])
+        else:
+            return db_conn.GetRemovedStringTokenDocumentIds(row_data[-1])
+
     def OnGetItemText(self, item, col):
-        row_data = self.data[item]
+        row_data = self.GetRowData(item)
         if self.col_names[col] == GUIText.FILTERS_NUM_WORDS:
             return str(row_data[col]) +" (" +str(round((row_data[col]/self.dataset.total_tokens)*100, 4))+"%)"
         elif self.col_names[col] == GUIText.FILTERS_NUM_DOCS:
@@ -95,13 +136,14 @@ class TokenListCtrl(wx.ListCtrl):
         selected_items = []
         row = self.GetFirstSelected()
         while row != -1:
+            row_data = self.GetRowData(row)
             line = ''
-            line += str(self.data[row][0]) + '\t'
-            line += str(self.data[row][1]) + '\t'
-            line += str(self.data[row][2]) + '\t'
-            line += str(self.data[row][3]) + '\t'
-            line += str(self.data[row][4]) + '\t'
-            line += str(self.data[row][5]) + '\n'
+            line += str(row_data[0]) + '\t'
+            line += str(row_data[1]) + '\t'
+            line += str(row_data[2]) + '\t'
+            line += str(row_data[3]) + '\t'
+            line += str(row_data[4]) + '\t'
+            line += str(row_data[5]) + '\n'
             selected_items.append(line.strip())
             row = self.GetNextSelected(row)
         clipdata = wx.TextDataObject()
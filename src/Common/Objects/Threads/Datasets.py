@@ -42,13 +42,9 @@ class ChangeTokenizationChoiceThread(Thread):
         logger = logging.getLogger(__name__+"ChangeTokenizationChoiceThread["+str(self.dataset.key)+"].run")
         logger.info("Starting")
         db_conn = Database.DatabaseConnection(self.main_frame.current_workspace.name)
+        #rules and aggregates are kept up to date for every token type so only the choice being read changes
         db_conn.UpdateDatasetTokenType(self.dataset.key, self.new_choice)
 
-        wx.PostEvent(self.main_frame, CustomEvents.ProgressEvent({'step':GUITextFiltering.FILTERS_APPLYING_RULES_STEP}))
-        db_conn.ApplyAllDatasetRules(self.dataset.key, self.dataset.filter_rules)
-        db_conn.RefreshStringTokensIncluded(self.dataset.key)
-        db_conn.RefreshStringTokensRemoved(self.dataset.key)
-
         wx.PostEvent(self.main_frame, CustomEvents.ProgressEvent({'step':GUITextFiltering.FILTERS_UPDATING_COUNTS_STEP}))
         counts = db_conn.GetStringTokensCounts(self.dataset.key)
         self.dataset.total_docs = counts['documents']
@@ -100,3 +96,24 @@ class ApplyFilterNewRulesThread(Thread):
         result = {}
         wx.PostEvent(self._notify_window, CustomEvents.ApplyFilterRulesResultEvent(result))
         logger.info("Finished")
+
+class PreviewFilterRulesThread(Thread):
+    def __init__(self, notify_window, main_frame, dataset, rules):
+        """Init Worker Thread Class."""
+        Thread.__init__(self)
+        self._notify_window = notify_window
+        self.dataset = dataset
+        self.main_frame = main_frame
+        self.rules = rules
+        self.start()
+
+    def run(self):
+        logger = logging.getLogger(__name__+"PreviewFilterRulesThread["+str(self.dataset.key)+"].run")
+        logger.info("Starting")
+        db_conn = Database.DatabaseConnection(self.main_frame.current_workspace.name)
+        #drafted rules name their fields so they are mapped the same way as when they are applied
+        counts = db_conn.PreviewDatasetRules(self.dataset.key, DatasetsUtilities.MapFilterRules(self.dataset, self.rules))
+        #return event from thread
+        result = {'counts': counts}
+        wx.PostEvent(self._notify_window, CustomEvents.PreviewFilterRulesResultEvent(result))
+        logger.info("Finished")
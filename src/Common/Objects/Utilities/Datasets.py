@@ -1,5 +1,7 @@
 import logging
-from datetime import datetime, timedelta
+import functools
+import queue
+from datetime import datetime
 
 import spacy
 import en_core_web_sm
@@ -12,6 +14,8 @@ import Common.Constants as Constants
 import Common.CustomEvents as CustomEvents
 import Common.Objects.Datasets as Datasets
 import Common.Database as Database
+import Common.TokenizationCache as TokenizationCache
+import Common.TokenStore as TokenStore
 from Common.GUIText import Datasets as GUIText
 from Common.GUIText import Filtering as GUITextFiltering
 
@@ -57,76 +61,96 @@ def TokenizeDataset(dataset, notify_window, main_frame, rerun=False, tfidf_updat
     main_frame = main_frame
     db_conn = Database.DatabaseConnection(main_frame.current_workspace.name)
 
-    def TokenizationController(field, field_data):
-        logger.info("Preparing Processes for %s, %s, for %s documents", repr(dataset), repr(field), str(len(field_data)))
+    def TokenizationController(fields):
         nonlocal main_frame
-        wx.PostEvent(main_frame, CustomEvents.ProgressEvent({'msg':GUIText.TOKENIZING_BUSY_STARTING_FIELD_MSG+str(field.name)}))
-        results = []
+        #chunks of every string field are queued to the pool together so processes never wait for one field to be stored before starting the next,
+        #the pool's callbacks only ever put results on an unbounded queue so its result handler is never blocked,
+        #instead this thread stops handing chunks to the pool while too many finished chunks are still waiting to be stored
+        results = queue.Queue()
+        max_unstored = main_frame.pool_num + Constants.TOKENIZATION_RESULTS_QUEUE_SIZE
+        totals = {}
+        completed = {}
+        stats = {}
+        chunks = []
+        error = None
+        try:
+            for field in fields:
+                field_data = FieldData(field)
+                logger.info("Preparing Processes for %s, %s, for %s documents", repr(dataset), repr(field), str(len(field_data)))
+                wx.PostEvent(main_frame, CustomEvents.ProgressEvent({'msg':GUIText.TOKENIZING_BUSY_STARTING_FIELD_MSG+str(field.name)}))
+                if not db_conn.CheckIfFieldExists(dataset.key, field.key):
+                    db_conn.InsertField(dataset.key, field.key)
+                totals[field.key] = len(field_data)
+                completed[field.key] = 0
+                split_data_lists = SplitTokenizationData(list(field_data.items()), main_frame.pool_num*Constants.TOKENIZATION_CHUNKS_PER_PROCESS)
+                count = 0
+                for data_list in split_data_lists:
+                    chunks.append((field, data_list, str(count+1)+"-"+str(count+len(data_list)-1)))
+                    count = count+len(data_list)
+        except Exception as e:
+            error = e
+        chunk_count = len(chunks)
 
-        total = len(field_data)
-        full_data_list = list(field_data.items())
-        split_data_lists = []
-        if total > main_frame.pool_num*2:
-            increment = int(total/(main_frame.pool_num*2))
-            start = 0
-            end = increment
-            for i in range(main_frame.pool_num*2-1):
-                split_data_lists.append(full_data_list[start:end])
-                start = end
-                end = end+increment
-            split_data_lists.append(full_data_list[start:])
-        else:
-            split_data_lists.append(full_data_list)
-        
-        count = 0
-        for data_list in split_data_lists:
-            logger.info("Creating TokenizationWorker for Documents %s - %s", str(count+1), str(count+len(data_list)))
-            res = main_frame.pool.apply_async(TokenizationWorker, (data_list, 
-                                                                   repr(field),
-                                                                   str(count+1)+"-"+str(count+len(data_list)-1),
-                                                                   field.parent.language))
-            results.append(res)
-            count = count+len(data_list)
-        
-        completed = 0
+        #results are stored in the order chunks finish rather than the order they were submitted
         start_time = datetime.now()
-        wx.PostEvent(main_frame, CustomEvents.ProgressEvent({'msg':GUIText.TOKENIZING_BUSY_COMPLETED_FIELD_MSG1+str(completed)\
-                                                               +GUIText.TOKENIZING_BUSY_COMPLETED_FIELD_MSG2+str(total)\
-                                                               +GUIText.TOKENIZING_BUSY_COMPLETED_FIELD_MSG3+str(field.name)}))
-        if not db_conn.CheckIfFieldExists(dataset.key, field.key):
-            db_conn.InsertField(dataset.key, field.key)
+        submitted = 0
+        unstored = 0
         res_count = 0
-        for res in results:
+        while unstored > 0 or (error is None and submitted < chunk_count):
+            #once anything has failed no more chunks are submitted but those already in the pool are still taken off the queue
+            while error is None and submitted < chunk_count and unstored < max_unstored:
+                field, data_list, label = chunks[submitted]
+                logger.info("Creating TokenizationWorker for %s Documents %s", repr(field), label)
+                try:
+                    main_frame.pool.apply_async(TokenizationWorker,
+                                                (data_list,
+                                                 repr(field),
+                                                 label,
+                                                 field.parent.language),
+                                                callback=lambda res, field=field: results.put((field, res)),
+                                                error_callback=lambda error, field=field: results.put((field, error)))
+                except Exception as e:
+                    error = e
+                    break
+                submitted += 1
+                unstored += 1
+            if unstored == 0:
+                break
+            field, res = results.get()
+            unstored -= 1
             res_count += 1
-            new_tokensets = res.get()[0]
-            package_versions = res.get()[1]
-            #insert documents' tokens into database
-            db_conn.InsertStringTokens(dataset.key, field.key, new_tokensets)
-            completed += len(new_tokensets)
-            logger.info("%s %s", repr(field), completed)
-            wx.PostEvent(main_frame, CustomEvents.ProgressEvent({'msg':GUIText.TOKENIZING_BUSY_COMPLETED_FIELD_MSG1+str(completed)\
-                                                                   +GUIText.TOKENIZING_BUSY_COMPLETED_FIELD_MSG2+str(total)\
-                                                                   +GUIText.TOKENIZING_BUSY_COMPLETED_FIELD_MSG3+str(field.name)}))
-
-            current_time = datetime.now()
-            if res_count < len(results)/2:
-                new_estimated_loop_time = (current_time - start_time)*2
-            else:
-                new_estimated_loop_time = (current_time - start_time)
-            nonlocal estimated_loop_time, field_count, remaining_field_count
-            if estimated_loop_time < new_estimated_loop_time:
-                estimated_loop_time = new_estimated_loop_time
-                elapsed_time = current_time - start_time
-                if res_count < len(results)/2:
-                    estimated_remaining_sec = estimated_loop_time.total_seconds() * (remaining_field_count-0.5)
-                else:
-                    estimated_remaining_sec = estimated_loop_time.total_seconds() * (remaining_field_count-1)
-                estimated_remaining_time = timedelta(seconds=estimated_remaining_sec)
+            if error is not None:
+                continue
+            if isinstance(res, BaseException):
+                error = res
+                continue
+            try:
+                new_tokensets = res[0]
+                package_versions = res[1]
+                for stat in res[2]:
+                    if stat != 'memo_size':
+                        stats[stat] = stats.get(stat, 0) + res[2][stat]
+                #insert documents' tokens into database
+                db_conn.InsertStringTokens(dataset.key, field.key, new_tokensets)
+                completed[field.key] += len(new_tokensets)
+                logger.info("%s %s", repr(field), completed[field.key])
+                wx.PostEvent(main_frame, CustomEvents.ProgressEvent({'msg':GUIText.TOKENIZING_BUSY_COMPLETED_FIELD_MSG1+str(completed[field.key])\
+                                                                       +GUIText.TOKENIZING_BUSY_COMPLETED_FIELD_MSG2+str(totals[field.key])\
+                                                                       +GUIText.TOKENIZING_BUSY_COMPLETED_FIELD_MSG3+str(field.name)}))
+                elapsed_time = datetime.now() - start_time
+                estimated_remaining_time = elapsed_time * ((chunk_count - res_count) / res_count)
                 wx.PostEvent(main_frame, CustomEvents.ProgressEvent({'estimated_time':elapsed_time + estimated_remaining_time}))
-        dataset.tokenization_package_versions = package_versions
+                dataset.tokenization_package_versions = package_versions
+            except Exception as e:
+                logger.exception("Failed to store tokenized chunk of %s", repr(field))
+                error = e
+        if error is not None:
+            raise error
+        if stats:
+            logger.info("%s of %s texts found in tokenization cache, %s of %s tokens' stems memoized",
+                        stats['cache_hits'], stats['texts'], stats['memo_hits'], stats['memo_hits']+stats['memo_misses'])
 
-    def FieldTokenizer(field):
-        loop_start_time = datetime.now()
+    def FieldData(field):
         id_key_fields = ["data_source", "data_type", "id"]
         field_data = {}
         for data in field.dataset.data.values():
@@ -147,100 +171,176 @@ def TokenizeDataset(dataset, notify_window, main_frame, rerun=False, tfidf_updat
                         field_data[id_key].extend(data[field.name])
                 else:
                     field_data[id_key].append("")
-        if field.fieldtype == "string":
-            TokenizationController(field, field_data)
-        else:
-            field.tokenset = field_data
-        new_estimated_loop_time = (datetime.now() - loop_start_time)
-        nonlocal estimated_loop_time, field_count, remaining_field_count, start_time
-        remaining_field_count -= 1
-        if estimated_loop_time == None or estimated_loop_time < new_estimated_loop_time:
-            estimated_loop_time = new_estimated_loop_time
-        elapsed_time = datetime.now() - start_time
-        wx.PostEvent(main_frame, CustomEvents.ProgressEvent({'estimated_time':elapsed_time + (estimated_loop_time * remaining_field_count)}))
+        return field_data
 
     wx.PostEvent(main_frame, CustomEvents.ProgressEvent({'step':GUIText.TOKENIZING_BUSY_STEP}))
-    field_count = len(dataset.computational_fields)
-    remaining_field_count = field_count
-    start_time = datetime.now()
-    estimated_loop_time = timedelta()
     stringfield_count = 0
+    stringfield_keys = []
+    if rerun:
+        db_conn.DeleteDatasetTokens(dataset.key)
     for computational_field_key in dataset.computational_fields:
-        has_data = False
         if dataset.computational_fields[computational_field_key].fieldtype == 'string':
-            if rerun:
-                db_conn.DeleteField(dataset.key, computational_field_key)
-            else:
-                has_data = db_conn.CheckIfFieldExists(dataset.key, computational_field_key)
-            if not has_data:
-                FieldTokenizer(dataset.computational_fields[computational_field_key])
-                stringfield_count += 1
-        elif dataset.computational_fields[computational_field_key].tokenset == None or rerun:
-            FieldTokenizer(dataset.computational_fields[computational_field_key])
+            if rerun or not db_conn.CheckIfFieldExists(dataset.key, computational_field_key):
+                stringfield_keys.append(computational_field_key)
+
+    #large loads are faster when string_tokens' indexes are rebuilt once afterwards instead of being maintained for every token
+    bulk_load = len(stringfield_keys)*len(dataset.data) >= Constants.DB_BULK_LOAD_MIN_DOCUMENTS
+    if bulk_load:
+        db_conn.BeginBulkLoad(dataset.key)
+    try:
+        for computational_field_key in dataset.computational_fields:
+            if dataset.computational_fields[computational_field_key].fieldtype != 'string':
+                if dataset.computational_fields[computational_field_key].tokenset == None or rerun:
+                    dataset.computational_fields[computational_field_key].tokenset = FieldData(dataset.computational_fields[computational_field_key])
+        TokenizationController([dataset.computational_fields[computational_field_key] for computational_field_key in stringfield_keys])
+        stringfield_count = len(stringfield_keys)
+    finally:
+        if bulk_load:
+            db_conn.EndBulkLoad(dataset.key)
 
     #calculate tfidf scores for all stored string tokens if any changes occured
     if stringfield_count > 0 or tfidf_update:
         wx.PostEvent(main_frame, CustomEvents.ProgressEvent({'step':GUIText.TOKENIZING_BUSY_STEP_TFIDF_STEP}))
         db_conn.UpdateStringTokensTFIDF(dataset.key)
+        ApplyFilterAllRules(dataset, main_frame)
+        #the dataset's counts are maintained as its included and removed tokens are refreshed so they are read after the rules are applied
         counts = db_conn.GetStringTokensCounts(dataset.key)
         dataset.total_docs = counts['documents']
         dataset.total_tokens = counts['tokens']
         dataset.total_uniquetokens = counts['unique_tokens']
-        ApplyFilterAllRules(dataset, main_frame)
             
     logger.info("Finished")
 
+def SplitTokenizationData(data_list, chunk_count):
+    '''splits (key, texts) pairs into about chunk_count chunks holding similar numbers of characters,
+    the chunks are returned largest first so that the longest work is started before the shortest'''
+    lengths = [sum(len(text) for text in data) for key, data in data_list]
+    chunk_length = max(sum(lengths)/max(chunk_count, 1), 1)
+    chunks = []
+    chunk = []
+    chunk_lengths = []
+    current_length = 0
+    for entry, length in zip(data_list, lengths):
+        chunk.append(entry)
+        current_length += length
+        if current_length >= chunk_length:
+            chunks.append(chunk)
+            chunk_lengths.append(current_length)
+            chunk = []
+            current_length = 0
+    if len(chunk) > 0:
+        chunks.append(chunk)
+        chunk_lengths.append(current_length)
+    order = sorted(range(len(chunks)), key=lambda i: chunk_lengths[i], reverse=True)
+    return [chunks[i] for i in order]
+
+#tokenization pipelines already loaded by this process, keyed by language
+tokenization_pipelines = {}
+tokenization_cache = None
+
+def TokenizationWorkerInitializer(languages):
+    '''run when each process of the pool starts so that the pipelines of the given languages are loaded before any work arrives'''
+    logger = logging.getLogger(__name__+".TokenizationWorkerInitializer")
+    logger.info("Starting")
+    spacy.prefer_gpu()
+    for language in languages:
+        GetTokenizationPipeline(language)
+    logger.info("Finished")
+
+def GetTokenizationPipeline(language):
+    '''returns the spacy model, memoized token normalizer, package versions and cache signature for a language,
+    loading them only the first time the language is used by this process'''
+    if language not in tokenization_pipelines:
+        logger = logging.getLogger(__name__+".GetTokenizationPipeline")
+        logger.info("Loading pipeline for language[%s]", language)
+        package_versions = []
+        if language == 'fre-sm':
+            #less accurate but faster model
+            nlp = fr_core_news_sm.load(exclude=Constants.TOKENIZATION_EXCLUDED_COMPONENTS)
+            stemmer = nltk.stem.snowball.FrenchStemmer()
+            package_versions.append(spacy.__name__+" "+spacy.__version__+" "+nlp.meta['lang']+"_"+nlp.meta['name']+" "+nlp.meta['version'])
+            package_versions.append(nltk.__name__ +" "+nltk.__version__+" snowball.FrenchStemmer")
+            package_versions.append(spacy.__name__ +" "+nlp.meta['lang']+"_"+nlp.meta['name']+" "+nlp.meta['version'])
+        elif language == 'eng-sm':
+            #less accurate but faster model
+            nlp = en_core_web_sm.load(exclude=Constants.TOKENIZATION_EXCLUDED_COMPONENTS)
+            stemmer = nltk.stem.snowball.EnglishStemmer()
+            package_versions.append(spacy.__name__+" "+spacy.__version__+" "+nlp.meta['lang']+"_"+nlp.meta['name']+" "+nlp.meta['version'])
+            package_versions.append(nltk.__name__ +" "+nltk.__version__+" snowball.EnglishStemmer")
+            package_versions.append(spacy.__name__ +" "+nlp.meta['lang']+"_"+nlp.meta['name']+" "+nlp.meta['version'])
+        #the components and batch size used are kept with the versions so it is known how a dataset's tokens were produced
+        package_versions.append(spacy.__name__+" pipeline "+",".join(nlp.pipe_names)+" batch_size "+str(Constants.TOKENIZATION_BATCH_SIZE))
+        #cached tokens are only reused by a pipeline with the same model, model version, stemmer and components
+        signature = "\n".join(package_versions[:2]+[",".join(nlp.pipe_names)])
+        #the same few thousand surface forms make up most tokens so their normalized text and stem are only worked out once per process,
+        #lemmas depend on the token's context so they are still taken from each token
+        @functools.lru_cache(maxsize=Constants.TOKENIZATION_MEMO_SIZE)
+        def NormalizeToken(token_text):
+            return token_text.strip().lower(), stemmer.stem(token_text).strip().lower()
+        tokenization_pipelines[language] = (nlp, NormalizeToken, package_versions, signature)
+    return tokenization_pipelines[language]
+
+def GetTokenizationCache():
+    '''returns this process's connection to the tokenization cache, or None if the cache is turned off'''
+    global tokenization_cache
+    if tokenization_cache is None and Constants.TOKENIZATION_CACHE:
+        tokenization_cache = TokenizationCache.TokenizationCache(Constants.TOKENIZATION_CACHE_PATH, Constants.TOKENIZATION_CACHE_MAX_BYTES)
+    return tokenization_cache
+
 def TokenizationWorker(data_list, field_repr, label, language):
     logger = logging.getLogger(__name__+".TokenizationWorker["+field_repr+"]["+str(label)+"]")
     logger.info("Starting")
 
-    package_versions = []
+    #pipelines stay loaded in the pool's processes between tasks, fields and datasets
+    nlp, NormalizeToken, package_versions, signature = GetTokenizationPipeline(language)
+    cache = GetTokenizationCache()
+    memo_info = NormalizeToken.cache_info()
 
-    spacy.prefer_gpu()
-    if language == 'fre-sm':
-        #less accurate but faster model
-        nlp = fr_core_news_sm.load()
-        stemmer = nltk.stem.snowball.FrenchStemmer()
-        package_versions.append(spacy.__name__+" "+spacy.__version__+" "+nlp.meta['lang']+"_"+nlp.meta['name']+" "+nlp.meta['version'])
-        package_versions.append(nltk.__name__ +" "+nltk.__version__+" snowball.FrenchStemmer")
-        package_versions.append(spacy.__name__ +" "+nlp.meta['lang']+"_"+nlp.meta['name']+" "+nlp.meta['version'])
-    elif language == 'eng-sm':
-        #less accurate but faster model
-        nlp = en_core_web_sm.load()
-        stemmer = nltk.stem.snowball.EnglishStemmer()
-        package_versions.append(spacy.__name__+" "+spacy.__version__+" "+nlp.meta['lang']+"_"+nlp.meta['name']+" "+nlp.meta['version'])
-        package_versions.append(nltk.__name__ +" "+nltk.__version__+" snowball.EnglishStemmer")
-        package_versions.append(spacy.__name__ +" "+nlp.meta['lang']+"_"+nlp.meta['name']+" "+nlp.meta['version'])
-    
-    tokensets = {}
+    texts = [text for key, data in data_list for text in data]
+    if cache is not None:
+        cache_keys = [cache.Key(signature, text) for text in texts]
+        text_tokens = cache.Get(cache_keys)
+    else:
+        cache_keys = list(range(len(texts)))
+        text_tokens = {}
+    cached_count = len([cache_key for cache_key in cache_keys if cache_key in text_tokens])
+
+    #every text that isn't cached is piped together so spacy can fill its batches
+    new_text_tokens = {}
+    missing_texts = {cache_key: text for text, cache_key in zip(texts, cache_keys) if cache_key not in text_tokens}
+    for tmp_tokens, cache_key in nlp.pipe(((text, cache_key) for cache_key, text in missing_texts.items()), as_tuples=True, batch_size=Constants.TOKENIZATION_BATCH_SIZE):
+        new_text_tokens[cache_key] = [NormalizeToken(token.text)
+                                      +(token.lemma_.strip().lower(),
+                                        token.pos_,
+                                        token.is_stop) for token in tmp_tokens]
+    if cache is not None:
+        cache.Put(new_text_tokens)
+    text_tokens.update(new_text_tokens)
+
+    #tokens are packed into term indexes and integer arrays so little more than raw memory is pickled back to the main process,
+    #a document's positions continue across its texts
+    tokensets = TokenStore.PackedTokens()
+    cache_keys = iter(cache_keys)
     for key, data in data_list:
-        tokenset = []
-        position = 0
-        for tmp_tokens in nlp.pipe(data):
-            for token in tmp_tokens:
-                text = token.text.strip().lower()
-                stem = stemmer.stem(token.text).strip().lower()
-                lemma = token.lemma_.strip().lower()
-                tokenset.append((position,
-                                     text,
-                                     stem,
-                                     lemma,
-                                     token.pos_,
-                                     token.is_stop))
-                position = position + 1
-        tokensets[key] = tokenset
+        tokens = (token for text in data for token in text_tokens[next(cache_keys)])
+        tokensets.AddDocument(key, ((position,)+token for position, token in enumerate(tokens)))
+    tokensets.Pack()
 
-    logger.info("Finished")
+    new_memo_info = NormalizeToken.cache_info()
+    stats = {'texts': len(texts),
+             'cache_hits': cached_count,
+             'memo_hits': new_memo_info.hits - memo_info.hits,
+             'memo_misses': new_memo_info.misses - memo_info.misses,
+             'memo_size': new_memo_info.currsize}
+    logger.info("Finished %s", stats)
     #return tokensets, rawtext_tokens_df, stem_tokens_df, lemma_tokens_df, package_versions
-    return tokensets, package_versions
+    return tokensets, package_versions, stats
 
-def ApplyFilterAllRules(dataset, main_frame):
-    logger = logging.getLogger(__name__+".ApplyFilterAllRules")
-    logger.info("Starting")
-    db_conn = Database.DatabaseConnection(main_frame.current_workspace.name)
-    wx.PostEvent(main_frame, CustomEvents.ProgressEvent({'step':GUITextFiltering.FILTERS_APPLYING_RULES_STEP}))
+def MapFilterRules(dataset, rules):
+    '''returns the rules with each field name replaced by the key of the dataset's computational field of that name,
+    rules for fields that are no longer computational are left out'''
     mapped_rules = []
-    for field_name, word, pos, action in dataset.filter_rules:
+    for field_name, word, pos, action in rules:
         include = False
         if field_name != Constants.FILTER_RULE_ANY:
             for field in dataset.computational_fields.values():
@@ -252,7 +352,14 @@ def ApplyFilterAllRules(dataset, main_frame):
             include = True
         if include:
             mapped_rules.append((field_name, word, pos, action))
-    db_conn.ApplyAllDatasetRules(dataset.key, mapped_rules)
+    return mapped_rules
+
+def ApplyFilterAllRules(dataset, main_frame):
+    logger = logging.getLogger(__name__+".ApplyFilterAllRules")
+    logger.info("Starting")
+    db_conn = Database.DatabaseConnection(main_frame.current_workspace.name)
+    wx.PostEvent(main_frame, CustomEvents.ProgressEvent({'step':GUITextFiltering.FILTERS_APPLYING_RULES_STEP}))
+    db_conn.ApplyAllDatasetRules(dataset.key, MapFilterRules(dataset, dataset.filter_rules))
     wx.PostEvent(main_frame, CustomEvents.ProgressEvent({'step':GUITextFiltering.FILTERS_UPDATING_COUNTS_STEP}))
     db_conn.RefreshStringTokensIncluded(dataset.key)
     db_conn.RefreshStringTokensRemoved(dataset.key)
@@ -268,20 +375,7 @@ def ApplyFilterNewRules(dataset, main_frame, new_rules):
     if len(new_rules) > 0:
         db_conn = Database.DatabaseConnection(main_frame.current_workspace.name)
         wx.PostEvent(main_frame, CustomEvents.ProgressEvent({'step': GUITextFiltering.FILTERS_APPLYING_RULES_STEP}))
-        mapped_rules = []
-        for field_name, word, pos, action in new_rules:
-            include = False
-            if field_name != Constants.FILTER_RULE_ANY:
-                for field in dataset.computational_fields.values():
-                    if field.name == field_name:
-                        field_name = field.key
-                        include = True
-                        break
-            else:
-                include = True
-            if include:
-                mapped_rules.append((field_name, word, pos, action))
-        db_conn.ApplyNewDatasetRules(dataset.key, mapped_rules)
+        db_conn.ApplyNewDatasetRules(dataset.key, MapFilterRules(dataset, new_rules))
         wx.PostEvent(main_frame, CustomEvents.ProgressEvent({'step': GUITextFiltering.FILTERS_UPDATING_COUNTS_STEP}))
         db_conn.RefreshStringTokensIncluded(dataset.key)
         db_conn.RefreshStringTokensRemoved(dataset.key)
@@ -21,7 +21,9 @@ def CaptureTokens(dataset_key, main_frame):
     dataset = main_frame.datasets[dataset_key]
 
     #strings are from database table due to needing to handle memory constraints caused by number of NLP variables
-    token_dict = Database.DatabaseConnection(main_frame.current_workspace.name).GetDocumentsTokensFromStringTokens(dataset.key)
+    db_conn = Database.DatabaseConnection(main_frame.current_workspace.name)
+    for doc_key, tokens in db_conn.IterateDocumentsTokens(dataset.key):
+        token_dict[doc_key] = tokens
 
     #Non-strings are stored in field objects
     field_list = list(main_frame.datasets[dataset_key].computational_fields.keys())
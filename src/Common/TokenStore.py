@@ -0,0 +1,182 @@
+import os
+import shutil
+
+import numpy as np
+
+#columns kept for each string token and the integer type each one is stored as
+COLUMNS = (('field_id', np.int32),
+           ('document_id', np.int64),
+           ('position', np.int32),
+           ('text_id', np.int32),
+           ('stem_id', np.int32),
+           ('lemma_id', np.int32),
+           ('pos_id', np.int32),
+           ('spacy_stopword', np.int8),
+           ('group_id', np.int32))
+
+class ColumnarTokenStore():
+    '''Keeps a dataset's string tokens as one file of raw integers per column inside the workspace.
+    Columns are read as memory-mapped numpy arrays so aggregates can be calculated with vectorized operations
+    instead of sql GROUP BYs, and tokens are only ever appended or rewritten as a whole column.'''
+    def __init__(self, directory):
+        self.directory = directory
+
+    def __ColumnPath(self, column):
+        return os.path.join(self.directory, column+".bin")
+
+    def Count(self):
+        '''returns the number of tokens that every column holds'''
+        count = None
+        for column, dtype in COLUMNS:
+            path = self.__ColumnPath(column)
+            column_count = os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0
+            #a column that is still being appended to by the writer may be ahead of the others
+            if count is None or column_count < count:
+                count = column_count
+        return count
+
+    def Read(self, start=0):
+        '''returns a dict of read only arrays with the tokens from position start onwards'''
+        count = self.Count()
+        columns = {}
+        for column, dtype in COLUMNS:
+            if count - start <= 0:
+                columns[column] = np.zeros(0, dtype=dtype)
+            else:
+                columns[column] = np.memmap(self.__ColumnPath(column), dtype=dtype, mode='r', shape=(count,))[start:]
+        return columns
+
+    def Append(self, columns):
+        '''appends tokens given as a dict of equal length arrays and returns the position of the first appended token'''
+        os.makedirs(self.directory, exist_ok=True)
+        start = self.Count()
+        for column, dtype in COLUMNS:
+            with open(self.__ColumnPath(column), 'ab') as column_file:
+                column_file.write(np.ascontiguousarray(columns[column], dtype=dtype).tobytes())
+        return start
+
+    def Truncate(self, count):
+        '''removes every token from position count onwards, used to undo an append'''
+        for column, dtype in COLUMNS:
+            path = self.__ColumnPath(column)
+            if os.path.exists(path):
+                with open(path, 'r+b') as column_file:
+                    column_file.truncate(count * np.dtype(dtype).itemsize)
+
+    def Filter(self, keep):
+        '''rewrites every column with only the tokens where the boolean array keep is set'''
+        columns = self.Read()
+        for column, dtype in COLUMNS:
+            path = self.__ColumnPath(column)
+            with open(path+".tmp", 'wb') as column_file:
+                column_file.write(np.ascontiguousarray(columns[column][keep]).tobytes())
+        del columns
+        for column, dtype in COLUMNS:
+            path = self.__ColumnPath(column)
+            os.replace(path+".tmp", path)
+
+    def Drop(self):
+        '''removes every token'''
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def Size(self):
+        '''returns the number of bytes used by the columns'''
+        size = 0
+        for column, dtype in COLUMNS:
+            path = self.__ColumnPath(column)
+            if os.path.exists(path):
+                size += os.path.getsize(path)
+        return size
+
+def GroupCounts(first, second):
+    '''returns the distinct (first, second) pairs of two integer arrays and the number of times each pair occurs'''
+    keys = (np.asarray(first, dtype=np.int64) << 32) | np.asarray(second, dtype=np.int64)
+    keys, counts = np.unique(keys, return_counts=True)
+    return keys >> 32, keys & 0xFFFFFFFF, counts
+
+def UniqueRows(columns):
+    '''returns the distinct rows of equal length columns of non negative integers below 2**32 as an array with one row each
+    and the index of every row's distinct row, a row at a time is folded into a single integer key
+    so only one dimensional arrays are sorted instead of comparing whole rows'''
+    inverse = np.zeros(len(columns[0]), dtype=np.int64)
+    for column in columns:
+        keys = (inverse << 32) | np.asarray(column, dtype=np.int64)
+        keys, inverse = np.unique(keys, return_inverse=True)
+        inverse = inverse.reshape(-1)
+    first = np.zeros(len(keys), dtype=np.int64)
+    first[inverse] = np.arange(len(inverse))
+    return np.stack([np.asarray(column, dtype=np.int64)[first] for column in columns], axis=1), inverse
+
+#columns kept for each token of a PackedTokens, text, stem, lemma and pos are indexes into its terms
+PACKED_COLUMNS = (('position', np.int32),
+                  ('text', np.int32),
+                  ('stem', np.int32),
+                  ('lemma', np.int32),
+                  ('pos', np.int32),
+                  ('spacy_stopword', np.int8))
+
+class PackedTokens():
+    '''A chunk of tokenized documents packed for the trip from a pool process to the database.
+    Each distinct text, stem, lemma and part of speech is kept once in terms and tokens only hold integer indexes into it,
+    so pickling a chunk copies a short list of strings and a few contiguous arrays instead of a tuple of strings per token.
+    Documents are added with AddDocument and Pack turns the columns into numpy arrays before the chunk is returned.'''
+    def __init__(self):
+        self.document_keys = []
+        self.offsets = [0]
+        self.terms = []
+        self.__term_indexes = {}
+        self.columns = {column: [] for column, dtype in PACKED_COLUMNS}
+
+    def __len__(self):
+        return len(self.document_keys)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_PackedTokens__term_indexes']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__term_indexes = None
+
+    def __TermIndex(self, term):
+        term_index = self.__term_indexes.get(term)
+        if term_index is None:
+            term_index = len(self.terms)
+            self.__term_indexes[term] = term_index
+            self.terms.append(term)
+        return term_index
+
+    def AddDocument(self, document_key, tokens):
+        '''adds a document's tokens given as (position, text, stem, lemma, pos, spacy_stopword) tuples'''
+        TermIndex = self.__TermIndex
+        position, text, stem, lemma, pos, spacy_stopword = (self.columns[column] for column, dtype in PACKED_COLUMNS)
+        for t in tokens:
+            position.append(t[0])
+            text.append(TermIndex(t[1]))
+            stem.append(TermIndex(t[2]))
+            lemma.append(TermIndex(t[3]))
+            pos.append(TermIndex(t[4]))
+            spacy_stopword.append(t[5])
+        self.document_keys.append(document_key)
+        self.offsets.append(len(position))
+
+    def Pack(self):
+        '''turns the columns into numpy arrays, no more documents can be added afterwards'''
+        self.offsets = np.array(self.offsets, dtype=np.int64)
+        for column, dtype in PACKED_COLUMNS:
+            self.columns[column] = np.array(self.columns[column], dtype=dtype)
+        self.__term_indexes = None
+        return self
+
+    def DocumentTokenCounts(self):
+        '''returns the number of tokens of each document'''
+        return np.diff(self.offsets)
+
+    @classmethod
+    def FromTokensets(cls, tokensets):
+        '''packs a dict of document keys to lists of (position, text, stem, lemma, pos, spacy_stopword) tuples'''
+        packed_tokens = cls()
+        for document_key in tokensets:
+            packed_tokens.AddDocument(document_key, tokensets[document_key])
+        return packed_tokens.Pack()
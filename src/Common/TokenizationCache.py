@@ -0,0 +1,121 @@
+import logging
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import Common.Constants as Constants
+
+class TokenizationCache():
+    '''Keeps the tokens produced for each text outside of any workspace so identical text is only tokenized once,
+    no matter which dataset, import or rerun it comes from.
+    Entries are addressed by a hash of the text and the signature of the pipeline that tokenized it,
+    and the least recently used entries are evicted once the cache grows past max_bytes.
+    Each process and thread opens its own connection and they share the file through sqlite's locking.'''
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.__local = threading.local()
+
+    def __Connect(self):
+        if getattr(self.__local, 'conn', None) is None:
+            conn = sqlite3.connect(self.path, timeout=Constants.DB_BUSY_TIMEOUT)
+            c = conn.cursor()
+            if c.execute("PRAGMA auto_vacuum").fetchone()[0] != 2 and c.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0:
+                #evicted entries give their pages back to the file system
+                c.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            c.execute("PRAGMA journal_mode = WAL")
+            c.execute("PRAGMA synchronous = NORMAL")
+            c.execute("""CREATE TABLE IF NOT EXISTS tokens (
+                                key BLOB PRIMARY KEY,
+                                tokens TEXT NOT NULL,
+                                last_used REAL NOT NULL
+                                ) WITHOUT ROWID""")
+            c.execute("""CREATE INDEX IF NOT EXISTS idx_tokens_last_used ON tokens(last_used)""")
+            conn.commit()
+            c.close()
+            self.__local.conn = conn
+        return self.__local.conn
+
+    def Key(self, signature, text):
+        '''returns the address of a text tokenized by the pipeline with the given signature'''
+        return hashlib.blake2b((signature+"\0"+text).encode('utf-8'), digest_size=16).digest()
+
+    def Get(self, keys):
+        '''returns a dict of key to token tuples for each of the keys that are cached'''
+        logger = logging.getLogger(__name__+".Get")
+        found = {}
+        try:
+            conn = self.__Connect()
+            c = conn.cursor()
+            unique_keys = list(set(keys))
+            for i in range(0, len(unique_keys), Constants.DB_MAX_VARIABLES):
+                batch = unique_keys[i:i+Constants.DB_MAX_VARIABLES]
+                c.execute("""SELECT key, tokens FROM tokens WHERE key IN ("""+",".join("?"*len(batch))+""")""", batch)
+                for key, tokens in c.fetchall():
+                    found[key] = [tuple(token) for token in json.loads(tokens)]
+            if found:
+                now = time.time()
+                c.executemany("""UPDATE tokens SET last_used = ? WHERE key = ?""", [(now, key) for key in found])
+                conn.commit()
+            c.close()
+        except sqlite3.Error as e:
+            #a cache that can't be read only means the texts get tokenized again
+            logger.exception("sql failed with error")
+            self.__Rollback()
+        return found
+
+    def Put(self, entries):
+        '''stores a dict of key to token tuples and evicts the least recently used entries if the cache is too large'''
+        logger = logging.getLogger(__name__+".Put")
+        if not entries:
+            return
+        try:
+            conn = self.__Connect()
+            c = conn.cursor()
+            now = time.time()
+            c.executemany("""INSERT OR REPLACE INTO tokens (key, tokens, last_used) VALUES (?, ?, ?)""",
+                          [(key, json.dumps(tokens, ensure_ascii=False, separators=(',', ':')), now) for key, tokens in entries.items()])
+            conn.commit()
+            self.__Evict(c)
+            c.close()
+        except sqlite3.Error as e:
+            logger.exception("sql failed with error")
+            self.__Rollback()
+
+    def __UsedBytes(self, c):
+        page_count = c.execute("PRAGMA page_count").fetchone()[0]
+        freelist_count = c.execute("PRAGMA freelist_count").fetchone()[0]
+        page_size = c.execute("PRAGMA page_size").fetchone()[0]
+        return (page_count - freelist_count) * page_size
+
+    def __Evict(self, c):
+        if self.__UsedBytes(c) <= self.max_bytes:
+            return
+        logger = logging.getLogger(__name__+".Evict")
+        logger.info("Starting")
+        #entries are removed a tenth at a time so a full cache isn't evicted on every put
+        while self.__UsedBytes(c) > self.max_bytes * 0.9:
+            count = c.execute("SELECT COUNT(*) FROM tokens").fetchone()[0]
+            if count == 0:
+                break
+            c.execute("""DELETE FROM tokens
+                         WHERE key IN (SELECT key FROM tokens ORDER BY last_used LIMIT ?)""", (max(1, count // 10),))
+            self.__local.conn.commit()
+        c.execute("PRAGMA incremental_vacuum").fetchall()
+        self.__local.conn.commit()
+        logger.info("Finished")
+
+    def __Rollback(self):
+        if getattr(self.__local, 'conn', None) is not None:
+            try:
+                self.__local.conn.rollback()
+            except sqlite3.Error:
+                pass
+
+    def Close(self):
+        if getattr(self.__local, 'conn', None) is not None:
+            self.__local.conn.close()
+            self.__local.conn = None
+
@@ -121,6 +121,9 @@ class FilterPanel(wx.Panel):
         #thread used to generate dataframes for use when display lists
         self.thread = None
         self.autosave = False
+        #drafted rules are previewed by their own thread so that drafting is not blocked by applying rules
+        self.preview_thread = None
+        self.preview_pending = False
 
         self.drag_source = None
 
@@ -170,6 +173,7 @@ class FilterPanel(wx.Panel):
         #event end points for completed threads
         CustomEvents.CHANGE_TOKENIZATION_CHOICE_EVT_RESULT(self, self.OnTokenizationChoiceEnd)
         CustomEvents.APPLY_FILTER_RULES_EVT_RESULT(self, self.OnApplyFilterRulesEnd)
+        CustomEvents.PREVIEW_FILTER_RULES_EVT_RESULT(self, self.OnPreviewFilterRulesEnd)
 
         self.included_words_panel.words_list.SetDropTarget(WordsTextDropTarget(Constants.FILTER_RULE_INCLUDE, self.removed_words_panel.words_list, self))
         self.removed_words_panel.words_list.SetDropTarget(WordsTextDropTarget(Constants.FILTER_RULE_REMOVE, self.included_words_panel.words_list, self))
@@ -191,8 +195,8 @@ class FilterPanel(wx.Panel):
         if len(selection) > 0:
             new_rules = []
             for row in selection:
-                word = self.included_words_panel.words_list.data[row][0]
-                pos = self.included_words_panel.words_list.data[row][1]
+                word = self.included_words_panel.words_list.GetRowData(row)[0]
+                pos = self.included_words_panel.words_list.GetRowData(row)[1]
                 new_rule = (Constants.FILTER_RULE_ANY, word, pos, Constants.FILTER_RULE_REMOVE)
                 if new_rule not in new_rules:
                     new_rules.append(new_rule)
@@ -216,8 +220,8 @@ class FilterPanel(wx.Panel):
         if len(selection) > 0:
             new_rules = []
             for row in selection:
-                word = self.removed_words_panel.words_list.data[row][0]
-                pos = self.removed_words_panel.words_list.data[row][1]
+                word = self.removed_words_panel.words_list.GetRowData(row)[0]
+                pos = self.removed_words_panel.words_list.GetRowData(row)[1]
                 new_rule = (Constants.FILTER_RULE_ANY, word, pos, Constants.FILTER_RULE_INCLUDE)
                 if new_rule not in new_rules:
                     new_rules.append(new_rule)
@@ -241,7 +245,7 @@ class FilterPanel(wx.Panel):
         if len(selection) > 0:
             new_rules = []
             for row in selection:
-                word = self.included_words_panel.words_list.data[row][0]
+                word = self.included_words_panel.words_list.GetRowData(row)[0]
                 new_rule = (Constants.FILTER_RULE_ANY, word, Constants.FILTER_RULE_ANY, Constants.FILTER_RULE_REMOVE)
                 if new_rule not in new_rules:
                     new_rules.append(new_rule)
@@ -265,7 +269,7 @@ class FilterPanel(wx.Panel):
         if len(selection) > 0:
             new_rules = []
             for row in selection:
-                word = self.removed_words_panel.words_list.data[row][0]
+                word = self.removed_words_panel.words_list.GetRowData(row)[0]
                 new_rule = (Constants.FILTER_RULE_ANY, word, Constants.FILTER_RULE_ANY, Constants.FILTER_RULE_INCLUDE)
                 if new_rule not in new_rules:
                     new_rules.append(new_rule)
@@ -289,7 +293,7 @@ class FilterPanel(wx.Panel):
         if len(selection) > 0:
             new_rules = []
             for row in selection:
-                pos = self.included_words_panel.words_list.data[row][1]
+                pos = self.included_words_panel.words_list.GetRowData(row)[1]
                 new_rule = (Constants.FILTER_RULE_ANY, Constants.FILTER_RULE_ANY, pos, Constants.FILTER_RULE_REMOVE)
                 if new_rule not in new_rules:
                     new_rules.append(new_rule)
@@ -313,7 +317,7 @@ class FilterPanel(wx.Panel):
         if len(selection) > 0:
             new_rules = []
             for row in selection:
-                pos = self.removed_words_panel.words_list.data[row][1]
+                pos = self.removed_words_panel.words_list.GetRowData(row)[1]
                 new_rule = (Constants.FILTER_RULE_ANY, Constants.FILTER_RULE_ANY, pos, Constants.FILTER_RULE_INCLUDE)
                 if new_rule not in new_rules:
                     new_rules.append(new_rule)
@@ -456,6 +460,7 @@ class FilterPanel(wx.Panel):
         self.rules_panel.DisplayFilterRules(self.dataset.filter_rules)
         self.rules_panel.applyrules_btn.Hide()
         self.rules_panel.cancelrules_btn.Hide()
+        self.rules_panel.DisplayDraftImpact(None)
         logger.info("Finished")
     
     def OnApplyRules(self, event):
@@ -560,6 +565,29 @@ class FilterPanel(wx.Panel):
         main_frame.CloseProgressDialog(thaw=False)
         logger.info("Finished")
     
+    def PreviewDraftedRulesStart(self):
+        logger = logging.getLogger(__name__+".FilterPanel["+str(self.name)+"].PreviewDraftedRulesStart")
+        logger.info("Starting")
+        #only one preview runs at a time, rules drafted while it runs are previewed once it has finished
+        if self.preview_thread is not None:
+            self.preview_pending = True
+        else:
+            main_frame = wx.GetApp().GetTopWindow()
+            self.preview_thread = DatasetsThreads.PreviewFilterRulesThread(self, main_frame, self.dataset, self.rules_panel.GetDraftedRules())
+        logger.info("Finished")
+
+    def OnPreviewFilterRulesEnd(self, event):
+        logger = logging.getLogger(__name__+".FilterPanel["+str(self.name)+"].OnPreviewFilterRulesEnd")
+        logger.info("Starting")
+        self.preview_thread.join()
+        self.preview_thread = None
+        if self.preview_pending:
+            self.preview_pending = False
+            self.PreviewDraftedRulesStart()
+        elif not self.rules_panel.autoapply and self.rules_panel.applyrules_btn.IsShown():
+            self.rules_panel.DisplayDraftImpact(event.data['counts'])
+        logger.info("Finished")
+
     def UpdateImpact(self):
         logger = logging.getLogger(__name__+".FilterPanel["+str(self.name)+"].UpdateImpact")
         logger.info("Starting")
@@ -672,7 +700,7 @@ class WordsPanel(wx.Panel):
         logger = logging.getLogger(__name__+".WordsPanel["+self.word_type+"]["+str(self.parent_frame.name)+"].OnSearch")
         logger.info("Starting")
         self.DisplayWordsList()
-        self.search_count_text.SetLabel(str(self.words_list.GetNumberRows())+GUIText.SEARCH_RESULTS_LABEL)
+        self.search_count_text.SetLabel(str(self.words_list.GetItemCount())+GUIText.SEARCH_RESULTS_LABEL)
         self.Layout()
         logger.info("Finished")
 
@@ -685,21 +713,21 @@ class WordsPanel(wx.Panel):
         if self.searchctrl.GetValue() == "":
             self.search_count_text.SetLabel("")
         else:
-            self.search_count_text.SetLabel(str(self.words_list.GetNumberRows())+GUIText.SEARCH_RESULTS_LABEL)
+            self.search_count_text.SetLabel(str(self.words_list.GetItemCount())+GUIText.SEARCH_RESULTS_LABEL)
         self.Layout()
         logger.info("Finished")
     
     def OnShowDocumentList(self, event):    
         row = event.GetIndex()
-        document_ids = list(set(self.words_list.data[row][-1].split(',')))
+        document_ids = self.words_list.GetDocumentIds(row)
         main_frame = wx.GetApp().GetTopWindow()
         random.seed(0)
         sample_size = 20
         if len(document_ids) < 20:
             sample_size = len(document_ids)
-        sampled_document_ids = random.sample(document_ids, k=sample_size)
+        sampled_document_ids = random.sample(document_ids.tolist(), k=sample_size)
         db_conn = Database.DatabaseConnection(main_frame.current_workspace.name)
-        document_keys = db_conn.GetDocumentKeys(sampled_document_ids)
+        document_keys = db_conn.GetDocumentKeys(self.dataset.key, sampled_document_ids)
         documents = []
         for document_key in document_keys[:20]:
             documents.append(self.dataset.GetDocument(document_key))
@@ -1042,8 +1070,24 @@ class RulesPanel(wx.Panel):
             self.applyrules_btn.Show()
             self.cancelrules_btn.Show()
             self.Layout()
+            self.parent_frame.PreviewDraftedRulesStart()
         self.Refresh()
 
+    def DisplayDraftImpact(self, draft_counts):
+        '''shows the counts that would remain if the drafted rules were applied next to the current ones, or only the current ones when draft_counts is None'''
+        dataset = self.parent_frame.dataset
+        document_num_label = str(dataset.total_docs_remaining)
+        token_num_label = str(dataset.total_tokens_remaining)
+        uniquetoken_num_label = str(dataset.total_uniquetokens_remaining)
+        if draft_counts:
+            document_num_label += " ("+GUIText.FILTERS_DRAFTED_IMPACT+str(draft_counts['documents'])+")"
+            token_num_label += " ("+GUIText.FILTERS_DRAFTED_IMPACT+str(draft_counts['tokens'])+")"
+            uniquetoken_num_label += " ("+GUIText.FILTERS_DRAFTED_IMPACT+str(draft_counts['unique_tokens'])+")"
+        self.document_num_remaining.SetLabel(document_num_label)
+        self.token_num_remaining.SetLabel(token_num_label)
+        self.uniquetoken_num_remaining.SetLabel(uniquetoken_num_label)
+        self.Layout()
+
     def DraftNewFilterRules(self, new_rules):
         for new_rule in new_rules:
             self.current_rules.append([new_rule, "A"])
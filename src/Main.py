@@ -21,6 +21,7 @@ import Common.Constants as Constants
 import Common.CustomEvents as CustomEvents
 import Common.Database as Database
 import Common.Objects.Utilities.Generic as GenericUtilities
+import Common.Objects.Utilities.Datasets as DatasetsUtilities
 from Common.GUIText import Main as GUIText
 import Common.Notes as cn
 import Collection.ModuleCollection as CollectionModule
@@ -64,6 +65,8 @@ class MainFrame(wx.Frame):
         
         self.last_load_dt = datetime.now()
         self.load_thread = None
+        self.save_thread = None
+        self.maintenance_thread = None
         self.progress_dialog = None
         self.progress_dialog_references = 0
         self.closing = False
@@ -222,7 +225,12 @@ class MainFrame(wx.Frame):
         self.SetMenuBar(self.menu_bar)
 
         CustomEvents.EVT_PROGRESS(self, self.OnProgress)
-        
+
+        #workspace database is analyzed and shrunk in the background while nothing else is running
+        self.maintenance_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.OnMaintenanceStart, self.maintenance_timer)
+        CustomEvents.MAINTENANCE_EVT_RESULT(self, self.OnMaintenanceEnd)
+        self.maintenance_timer.Start(Constants.DB_MAINTENANCE_INTERVAL*1000)
 
         self.Layout()
         self.Fit()
@@ -307,6 +315,9 @@ class MainFrame(wx.Frame):
                 self.Freeze()
 
                 #reset objects
+                if self.options_dialog != None:
+                    self.options_dialog.Destroy()
+                    self.options_dialog = None
                 for key in self.theme_dialogs:
                     self.theme_dialogs[key].Destroy()    
                 self.theme_dialogs.clear()
@@ -331,6 +342,7 @@ class MainFrame(wx.Frame):
                 
 
                 self.save_path = ''
+                Database.CloseWorkspace(self.current_workspace.name)
                 self.current_workspace.cleanup()
                 self.current_workspace = tempfile.TemporaryDirectory(dir=Constants.CURRENT_WORKSPACE_PATH)
                 Database.DatabaseConnection(self.current_workspace.name).Create()
@@ -457,6 +469,7 @@ class MainFrame(wx.Frame):
         #once load thread has finished loading data files into memory run the GUI with the loaded data
         if 'error' in event.data:
             self.CloseProgressDialog(message=GUIText.LOAD_CANCELED, thaw=True)
+            Database.CloseWorkspace(self.load_workspace.name)
             self.load_workspace.cleanup()
             self.load_workspace = None
         else:
@@ -497,6 +510,7 @@ class MainFrame(wx.Frame):
             self.DocumentsUpdated(self)
             self.CodesUpdated()
 
+            Database.CloseWorkspace(self.current_workspace.name)
             self.current_workspace.cleanup()
             self.current_workspace = self.load_workspace
             self.load_workspace = None
@@ -515,7 +529,9 @@ class MainFrame(wx.Frame):
                 if self.pool_num != saved_data['pool_num']:
                     self.pool_num = saved_data['pool_num']
                     self.pool.close()
-                    self.pool = multiprocessing.get_context("spawn").Pool(processes=saved_data['pool_num'])
+                    self.pool = multiprocessing.get_context("spawn").Pool(processes=saved_data['pool_num'],
+                                                                          initializer=DatasetsUtilities.TokenizationWorkerInitializer,
+                                                                          initargs=(Constants.TOKENIZATION_PRELOAD_LANGUAGES,))
                 self.multiprocessing_inprogress_flag = False
 
             if 'collection_module' in saved_data:
@@ -677,6 +693,26 @@ class MainFrame(wx.Frame):
         logger.info("Finished")
         if self.closing:
             self.OnCloseEnd(event)
+
+    def OnMaintenanceStart(self, event):
+        #only runs while no other operation is in progress so maintenance never competes with the user's work
+        if self.closing or self.multiprocessing_inprogress_flag or self.progress_dialog_references > 0:
+            return
+        if self.maintenance_thread is not None or self.save_thread is not None or self.load_thread is not None:
+            return
+        logger = logging.getLogger(__name__+".MainFrame.OnMaintenanceStart")
+        logger.info("Starting")
+        self.maintenance_thread = MainThreads.MaintenanceThread(self, self.current_workspace.name)
+        logger.info("Finished")
+
+    def OnMaintenanceEnd(self, event):
+        logger = logging.getLogger(__name__+".MainFrame.OnMaintenanceEnd")
+        logger.info("Starting")
+        #the thread has already been joined if the application is closing
+        if self.maintenance_thread is not None:
+            self.maintenance_thread.join()
+            self.maintenance_thread = None
+        logger.info("Finished")
     
     def OnImportCodes(self, event):
         logger = logging.getLogger(__name__+".MainFrame.OnImportCodes")
@@ -908,6 +944,12 @@ class MainFrame(wx.Frame):
         self.DocumentsUpdated(self)
         self.CodesUpdated()
 
+        self.maintenance_timer.Stop()
+        if self.maintenance_thread is not None:
+            self.maintenance_thread.join()
+            self.maintenance_thread = None
+        Database.CloseWorkspace(self.current_workspace.name)
+
         self.StepProgressDialog(GUIText.SHUTDOWN_BUSY_POOL_MSG)
         logger.info("Starting to shut down of process pool")
         self.pool.close()
@@ -1188,6 +1230,12 @@ class OptionsDialog(wx.Dialog):
         self.adjustable_computation_fields_ctrl.Bind(wx.EVT_CHECKBOX, self.ChangeAdjustableComputationalFieldsMode)
         advanced_sizer.Add(self.adjustable_computation_fields_ctrl, 0, wx.ALL, 5)
 
+        self.columnar_token_store_ctrl = wx.CheckBox(self, label=GUIText.OPTIONS_COLUMNAR_TOKEN_STORE_LABEL)
+        db_conn = Database.DatabaseConnection(main_frame.current_workspace.name)
+        self.columnar_token_store_ctrl.SetValue(db_conn.GetWorkspaceSetting('token_store') == 'columnar')
+        self.columnar_token_store_ctrl.Bind(wx.EVT_CHECKBOX, self.ChangeTokenStore)
+        advanced_sizer.Add(self.columnar_token_store_ctrl, 0, wx.ALL, 5)
+
         twitter_box = wx.StaticBox(self, label=GUIText.TWITTER_LABEL)
         twitter_box.SetFont(main_frame.GROUP_LABEL_FONT)
         twitter_sizer = wx.StaticBoxSizer(twitter_box, wx.VERTICAL)
@@ -1251,6 +1299,15 @@ class OptionsDialog(wx.Dialog):
         new_mode = self.adjustable_computation_fields_ctrl.GetValue()
         main_frame.options_dict['adjustable_computation_fields_mode'] = new_mode
         main_frame.ModeChange()
+
+    def ChangeTokenStore(self, event):
+        main_frame = wx.GetApp().GetTopWindow()
+        #kept in the workspace's database so that it is saved with the workspace, datasets already added keep their store
+        if self.columnar_token_store_ctrl.GetValue():
+            token_store = 'columnar'
+        else:
+            token_store = 'sqlite'
+        Database.DatabaseConnection(main_frame.current_workspace.name).UpdateWorkspaceSetting('token_store', token_store)
     
     def ToggleTwitter(self, event):
         main_frame = wx.GetApp().GetTopWindow()
@@ -1271,7 +1328,9 @@ class OptionsDialog(wx.Dialog):
             if main_frame.pool_num != new_pool_num:
                 main_frame.pool_num = new_pool_num
                 main_frame.pool.close()
-                main_frame.pool = multiprocessing.get_context("spawn").Pool(processes=new_pool_num)
+                main_frame.pool = multiprocessing.get_context("spawn").Pool(processes=new_pool_num,
+                                                                            initializer=DatasetsUtilities.TokenizationWorkerInitializer,
+                                                                            initargs=(Constants.TOKENIZATION_PRELOAD_LANGUAGES,))
             main_frame.multiprocessing_inprogress_flag = False
         else:
             wx.MessageBox(GUIText.MULTIPROCESSING_WARNING_MSG)
@@ -1352,13 +1411,23 @@ def Main():
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     handler.setFormatter(formatter)
     logger.addHandler(handler)
+    if Constants.DB_PROFILE:
+        #each database profile record is a line of json so it is kept out of the main log
+        profile_logger = logging.getLogger("Common.Database.Profile")
+        profile_logger.propagate = False
+        profile_handler = RotatingFileHandler(os.path.join(Constants.LOG_PATH, Constants.DB_PROFILE_LOG_FILE), maxBytes=10000000, backupCount=10)
+        profile_handler.setFormatter(logging.Formatter('%(message)s'))
+        profile_logger.addHandler(profile_handler)
 
     cpus = psutil.cpu_count(logical=False)
     if cpus is None or cpus < 2:
         pool_num = 1
     else:
         pool_num = cpus-1
-    with multiprocessing.get_context("spawn").Pool(processes=pool_num) as pool:
+    #each process of the pool loads its tokenization pipelines once and keeps them for every dataset tokenized afterwards
+    with multiprocessing.get_context("spawn").Pool(processes=pool_num,
+                                                   initializer=DatasetsUtilities.TokenizationWorkerInitializer,
+                                                   initargs=(Constants.TOKENIZATION_PRELOAD_LANGUAGES,)) as pool:
         #start up the GUI
         app = RootApp.RootApp()
         MainFrame(None, -1, GUIText.APP_NAME+" - "+GUIText.NEW_WORKSPACE_NAME,
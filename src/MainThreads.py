@@ -3,6 +3,7 @@ import os
 import re
 import psutil
 import tarfile
+import sqlite3
 from threading import Thread
 import shutil
 from datetime import datetime
@@ -99,6 +100,12 @@ class SaveThread(Thread):
             with open(self.current_workspace_path+"/themes.pk", 'wb') as outfile:
                 pickle.dump(self.themes, outfile)
 
+            #return free pages to the file system and make sure the database file holds every change before it is copied
+            db_conn = Database.DatabaseConnection(self.current_workspace_path)
+            while db_conn.IncrementalVacuum(Constants.DB_MAINTENANCE_VACUUM_PAGES) > 0:
+                pass
+            db_conn.Checkpoint()
+
             if not self.autosave:
                 wx.PostEvent(self._notify_window, CustomEvents.ProgressEvent({'msg':GUIText.SAVE_BUSY_MSG_COMPRESSING}))
                 logger.info("Archiving Files to tar")
@@ -209,6 +216,9 @@ class LoadThread(Thread):
                 if ver < version.parse('0.8.11'):
                     self.Upgrade0_8_11(result, ver)
                     ver = version.parse('0.8.11')
+                if ver < version.parse('0.8.12'):
+                    self.Upgrade0_8_12(result, ver)
+                    ver = version.parse('0.8.12')
 
         except:
             wx.PostEvent(self._notify_window, CustomEvents.ProgressEvent({'msg':GUIText.LOAD_OPEN_FAILURE + self.save_path}))
@@ -666,4 +676,53 @@ class LoadThread(Thread):
             pool_num = 1
         else:
             pool_num = cpus-1
-        result['config']['pool_num'] = pool_num
\ No newline at end of file
+        result['config']['pool_num'] = pool_num
+
+    def Upgrade0_8_12(self, result, ver):
+        wx.PostEvent(self._notify_window, CustomEvents.ProgressEvent({'step':GUIText.UPGRADE_BUSY_MSG_WORKSPACE_STEP1+str(ver)+GUIText.UPGRADE_BUSY_MSG_WORKSPACE_STEP2+'0.8.12'}))
+
+        def UpgradeDatabase(result, ver):
+            wx.PostEvent(self._notify_window, CustomEvents.ProgressEvent({'msg':GUIText.UPGRADE_BUSY_MSG_DATABASE_MSG}))
+            db_conn = Database.DatabaseConnection(self.current_workspace_path)
+            db_conn.Upgrade0_8_12()
+            for dataset_key in result['datasets']:
+                db_conn.UpdateStringTokensTFIDF(dataset_key)
+                db_conn.ApplyAllDatasetRules(dataset_key, result['datasets'][dataset_key].filter_rules)
+                db_conn.RefreshStringTokensIncluded(dataset_key)
+                db_conn.RefreshStringTokensRemoved(dataset_key)
+
+        UpgradeDatabase(result, ver)
+
+class MaintenanceThread(Thread):
+    """Maintenance Thread Class."""
+    def __init__(self, notify_window, current_workspace_path):
+        """Init Worker Thread Class."""
+        Thread.__init__(self)
+        self._notify_window = notify_window
+        self.current_workspace_path = current_workspace_path
+        self.daemon = True
+        self.start()
+
+    def run(self):
+        logger = logging.getLogger(__name__+".MaintenanceThread.run")
+        logger.info("Starting")
+        result = {}
+        try:
+            db_conn = Database.DatabaseConnection(self.current_workspace_path)
+            db_conn.Analyze()
+            #free pages are returned in small steps so writes from the gui are queued behind one step at most
+            freed_pages = 0
+            while True:
+                step_freed_pages = db_conn.IncrementalVacuum(Constants.DB_MAINTENANCE_VACUUM_PAGES)
+                if step_freed_pages <= 0:
+                    break
+                freed_pages += step_freed_pages
+            result['freed_pages'] = freed_pages
+            result['footprint'] = db_conn.GetStorageFootprint()
+            logger.info("Freed %s pages, database footprint %s", freed_pages, result['footprint'])
+        except sqlite3.ProgrammingError:
+            #the workspace was closed while maintenance was running
+            logger.info("Workspace[%s] closed during maintenance", self.current_workspace_path)
+            result['error'] = ""
+        logger.info("Finished")
+        wx.PostEvent(self._notify_window, CustomEvents.MaintenanceResultEvent(result))